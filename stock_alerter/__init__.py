@@ -0,0 +1,46 @@
+"""Alerts on stock price updates
+
+The commonly used classes can be imported from the package itself
+
+    from stock_alerter import Stock, Alert, PriceThresholdRule
+
+Each of them is imported from its module when it is first used, so that
+importing the package, or a single module of it, stays cheap"""
+import importlib
+
+_EXPORTS = {
+    "Stock": "stock", "StockSignal": "stock",
+    "TimeSeries": "timeseries", "RetentionPolicy": "timeseries",
+    "Event": "event", "Exchange": "exchange",
+    "PriceRule": "rule", "PriceThresholdRule": "rule", "AndRule": "rule",
+    "ExpressionRule": "rule", "TrendRule": "rule", "DailyTrendRule": "rule",
+    "Alert": "alert", "AlertEngine": "alert", "BulkAlertEvaluator": "alert",
+    "PrintAction": "action", "EmailAction": "action",
+    "AsyncEmailAction": "action", "EmailDelivery": "action",
+    "QueuedEmailAction": "action",
+    "ListReader": "reader", "FileReader": "reader", "SocketReader": "reader",
+    "MmapReader": "reader", "MergedReader": "reader",
+    "ParallelFileReader": "reader", "write_tick_file": "reader",
+    "SharedTicks": "reader", "SharedMemoryReader": "reader",
+    "Processor": "processor", "ShardedProcessor": "processor",
+    "AsyncProcessor": "processor", "BatchProcessor": "processor",
+    "save_snapshot": "snapshot", "load_snapshot": "snapshot",
+    "NewerUpdatesReader": "snapshot",
+    "Backtest": "backtest", "sweep": "backtest",
+}
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(
+            __name__, name)) from None
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,5 +1,20 @@
-import smtplib
-from email.mime.text import MIMEText
+import queue
+import threading
+import time
+
+from . import metrics
+
+# smtplib and email are slow to import, and most processes never send an
+# email, so they are imported when they are first used
+
+
+def _create_message(from_email, to_email, subject, content):
+    from email.mime.text import MIMEText
+    message = MIMEText(content)
+    message["Subject"] = subject
+    message["From"] = from_email
+    message["To"] = to_email
+    return message
 
 
 class PrintAction:
@@ -15,12 +30,150 @@ class EmailAction:
         self.to_email = to
 
     def execute(self, content):
-        message = MIMEText(content)
-        message["Subject"] = "New Stock Alert"
-        message["From"] = "alerts@stocks.com"
-        message["To"] = self.to_email
+        message = _create_message("alerts@stocks.com", self.to_email,
+                                  "New Stock Alert", content)
+        import smtplib
         smtp = smtplib.SMTP("email.stocks.com")
         try:
             smtp.send_message(message)
         finally:
             smtp.quit()
+
+
+class AsyncEmailAction(EmailAction):
+    """Send an email when a rule is matched, as an asynchronous action
+
+    The email is sent on a thread from the event loop's default executor,
+    so the event loop carries on while the email is being sent"""
+
+    async def execute(self, content):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, super().execute, content)
+
+
+class EmailDelivery:
+    """Sends emails from a background thread, so that whoever sends them
+    doesn't wait on the network
+
+    Emails wait in a queue of at most max_queue_size emails. When the queue
+    is full, new emails are dropped and counted in dropped, rather than
+    holding up the sender. The worker keeps one SMTP connection open
+    between emails, and reconnects once if sending fails. Emails to the
+    same address that are queued within batch_window seconds of each other
+    are sent together as a single digest. Emails that can't be sent are
+    counted in failed"""
+    from_email = "alerts@stocks.com"
+
+    def __init__(self, host="email.stocks.com", port=0, batch_window=0,
+                 max_queue_size=1000):
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.queue = queue.Queue(max_queue_size)
+        self.smtp = None
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._stop = object()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def send(self, to_email, content):
+        """Queues an email, returning False if it was dropped because the
+        queue is full"""
+        try:
+            self.queue.put_nowait((to_email, content))
+            if metrics.enabled:
+                metrics.gauge("queue_depth", queue="email_delivery").set(
+                    self.queue.qsize())
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Waits until every queued email has been sent"""
+        self.queue.join()
+
+    def close(self):
+        """Sends the queued emails, then stops the worker and closes the
+        connection"""
+        self.queue.put(self._stop)
+        self._worker.join()
+
+    def _collect_batch(self, item):
+        batch = {}
+        count = 0
+        deadline = time.monotonic() + self.batch_window
+        while item is not self._stop:
+            to_email, content = item
+            batch.setdefault(to_email, []).append(content)
+            count += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch, count, False
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, count, False
+        return batch, count + 1, True
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            batch, count, stopped = self._collect_batch(self.queue.get())
+            try:
+                for to_email, contents in batch.items():
+                    self._send_digest(to_email, contents)
+            finally:
+                for _ in range(count):
+                    self.queue.task_done()
+        self._disconnect()
+
+    def _send_digest(self, to_email, contents):
+        if len(contents) == 1:
+            subject = "New Stock Alert"
+        else:
+            subject = "{0} New Stock Alerts".format(len(contents))
+        try:
+            self._deliver(_create_message(self.from_email, to_email,
+                                          subject, "\n".join(contents)))
+        except Exception:
+            # a bad address or content, rather than a network error, so
+            # the email is given up on, but the worker carries on
+            self.failed += 1
+            self._disconnect()
+
+    def _deliver(self, message):
+        import smtplib
+        for attempt in range(2):
+            try:
+                if self.smtp is None:
+                    self.smtp = smtplib.SMTP(self.host, self.port)
+                self.smtp.send_message(message)
+                self.sent += 1
+                return
+            except (smtplib.SMTPException, OSError):
+                self._disconnect()
+        self.failed += 1
+
+    def _disconnect(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                self.smtp.close()
+            self.smtp = None
+
+
+class QueuedEmailAction:
+    """Send an email through an EmailDelivery when a rule is matched,
+    without waiting for it to be sent"""
+
+    def __init__(self, to, delivery):
+        self.to_email = to
+        self.delivery = delivery
+
+    def execute(self, content):
+        self.delivery.send(self.to_email, content)
@@ -1,11 +1,39 @@
+import bisect
+
+from . import metrics
+from .event import is_awaitable
+from .rule import PriceThresholdRule, AndRule
+from .timeseries import _numpy
+
+
 class Alert:
     """Maps a Rule to an Action, and triggers the action if the rule
-    matches on any stock update"""
+    matches on any stock update
+
+    An edge_triggered alert only triggers when the rule starts matching,
+    and then waits for the rule to stop matching before it can trigger
+    again. If rearm_after is given, an alert whose rule keeps matching
+    triggers again once that much time has passed since it last did, going
+    by the timestamp of the updates. A hysteresis margin keeps the alert
+    from re-arming until the price has moved that far past the threshold
+    of its PriceThresholdRule, so a price hovering around the threshold
+    doesn't trigger it over and over"""
+    __slots__ = ("description", "rule", "action", "edge_triggered",
+                 "rearm_after", "hysteresis", "armed", "triggered_at",
+                 "exchange")
 
-    def __init__(self, description, rule, action):
+    def __init__(self, description, rule, action, edge_triggered=False,
+                 rearm_after=None, hysteresis=0):
+        if hysteresis and not hasattr(rule, "matches_with_margin"):
+            raise ValueError("hysteresis needs a PriceThresholdRule")
         self.description = description
         self.rule = rule
         self.action = action
+        self.edge_triggered = edge_triggered
+        self.rearm_after = rearm_after
+        self.hysteresis = hysteresis
+        self.armed = True
+        self.triggered_at = None
 
     def connect(self, exchange):
         self.exchange = exchange
@@ -14,5 +42,263 @@ class Alert:
             exchange[stock].updated.connect(self.check_rule)
 
     def check_rule(self, stock):
-        if self.rule.matches(self.exchange):
-            self.action.execute(self.description)
+        """Executes the action if the rule matches, returning the result of
+        the action, so that asynchronous actions can be awaited"""
+        # connect hands out the bound method, which keeps its function, so
+        # this checks the flag rather than being swapped by metrics.enable
+        if metrics.enabled:
+            start = metrics.clock()
+            try:
+                return self._check_rule(stock)
+            finally:
+                metrics.record("check_rule_seconds", start,
+                               **metrics.alert_labels(self))
+        return self._check_rule(stock)
+
+    def _check_rule(self, stock):
+        if not self.edge_triggered:
+            if self.rule.matches(self.exchange):
+                return self.trigger()
+        elif self.rule.matches(self.exchange):
+            if self.armed or self._is_due_to_rearm(stock):
+                self.armed = False
+                if self.rearm_after is not None:
+                    self.triggered_at = stock.history[-1].timestamp
+                return self.trigger()
+        elif not self.armed:
+            self.armed = not (self.hysteresis and
+                              self.rule.matches_with_margin(
+                                  self.exchange, self.hysteresis))
+
+    def trigger(self):
+        """Executes the action, returning its result"""
+        return self.action.execute(self.description)
+
+    def _is_due_to_rearm(self, stock):
+        return (self.rearm_after is not None and
+                stock.history[-1].timestamp - self.triggered_at >= self.rearm_after)
+
+
+@metrics.instrumented(Alert, "trigger")
+def _measured_trigger(self):
+    metrics.counter("alert_fired_total", **metrics.alert_labels(self)).inc()
+    start = metrics.clock()
+    result = self.action.execute(self.description)
+    metrics.record("action_execute_seconds", start,
+                   action=metrics.name_of(self.action))
+    return result
+
+
+class AlertEngine:
+    """Dispatches stock updates to the alerts that depend on them
+
+    The engine listens once to each stock that its alerts depend on,
+    instead of every alert listening on its own. Alerts with a
+    PriceThresholdRule are kept sorted by threshold for each stock and
+    comparison, so an update only looks at the alerts that match the new
+    price. Other alerts, including edge triggered ones, which have to see
+    every update, are checked on every update of the stocks they depend
+    on, as if they were connected to the exchange"""
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.threshold_alerts = {}
+        self.alerts = {}
+
+    def _listen_to(self, symbol):
+        if symbol not in self.threshold_alerts and symbol not in self.alerts:
+            self.exchange[symbol].updated.connect(self.on_update)
+
+    def add(self, alert):
+        rule = alert.rule
+        if isinstance(rule, PriceThresholdRule) and not alert.edge_triggered:
+            self._listen_to(rule.symbol)
+            thresholds, alerts = self.threshold_alerts.setdefault(
+                rule.symbol, {}).setdefault(rule.comparison, ([], []))
+            index = bisect.bisect_right(thresholds, rule.threshold)
+            thresholds.insert(index, rule.threshold)
+            alerts.insert(index, alert)
+        else:
+            alert.exchange = self.exchange
+            for symbol in rule.depends_on():
+                self._listen_to(symbol)
+                self.alerts.setdefault(symbol, []).append(alert)
+
+    def remove(self, alert):
+        rule = alert.rule
+        if isinstance(rule, PriceThresholdRule) and not alert.edge_triggered:
+            thresholds, alerts = \
+                self.threshold_alerts[rule.symbol][rule.comparison]
+            index = alerts.index(alert)
+            del thresholds[index]
+            del alerts[index]
+        else:
+            for symbol in rule.depends_on():
+                self.alerts[symbol].remove(alert)
+
+    def matching_threshold_alerts(self, symbol, price):
+        """Returns the threshold alerts for the symbol that match price"""
+        matching = []
+        for comparison, (thresholds, alerts) in \
+                self.threshold_alerts.get(symbol, {}).items():
+            if comparison == ">":
+                matching.extend(alerts[:bisect.bisect_left(thresholds, price)])
+            elif comparison == ">=":
+                matching.extend(alerts[:bisect.bisect_right(thresholds, price)])
+            elif comparison == "<":
+                matching.extend(alerts[bisect.bisect_right(thresholds, price):])
+            else:
+                matching.extend(alerts[bisect.bisect_left(thresholds, price):])
+        return matching
+
+    def on_update(self, stock):
+        """Executes the actions of the alerts that match. If any of the
+        actions are asynchronous, returns an awaitable for all of them"""
+        results = []
+        if stock.price:
+            for alert in self.matching_threshold_alerts(stock.symbol,
+                                                        stock.price):
+                results.append(alert.trigger())
+        for alert in self.alerts.get(stock.symbol, []):
+            results.append(alert.check_rule(stock))
+        awaitables = [result for result in results if is_awaitable(result)]
+        if awaitables:
+            return self._wait_for(awaitables)
+
+    async def _wait_for(self, awaitables):
+        import asyncio
+        await asyncio.gather(*awaitables)
+
+
+class BulkAlertEvaluator:
+    """Checks a large number of alerts against the exchange in one go
+
+    The latest price of every stock in the exchange is kept in an array,
+    indexed by symbol, which is updated as the stocks are. Stocks need to
+    be in the exchange when the evaluator is created. Alerts whose
+    rule is a PriceThresholdRule, or an AndRule made up of them, are
+    checked all at once: with numpy, as array comparisons followed by an
+    and-reduction for each alert, and otherwise by bisecting the sorted
+    thresholds of each stock. Other alerts are checked with rule.matches"""
+
+    def __init__(self, exchange, alerts):
+        self.exchange = exchange
+        self.symbols = list(exchange)
+        self.symbol_index = {symbol: index
+                             for index, symbol in enumerate(self.symbols)}
+        self.prices = [exchange[symbol].price for symbol in self.symbols]
+        self.alerts = []
+        self.other_alerts = []
+        self.leaves = []
+        self.alert_starts = []
+        for alert in alerts:
+            leaves = self._threshold_rules(alert.rule)
+            if leaves is None:
+                self.other_alerts.append(alert)
+            else:
+                self.alert_starts.append(len(self.leaves))
+                self.leaves.extend(leaves)
+                self.alerts.append(alert)
+        self.use_numpy = _numpy() is not None
+        if self.use_numpy:
+            self._prepare_arrays()
+        else:
+            self._prepare_sorted_thresholds()
+        for symbol in self.symbols:
+            exchange[symbol].updated.connect(self._price_updated)
+
+    def _threshold_rules(self, rule):
+        if isinstance(rule, PriceThresholdRule):
+            return [rule] if rule.symbol in self.symbol_index else None
+        if isinstance(rule, AndRule) and rule.rules:
+            leaves = []
+            for component in rule.rules:
+                component_leaves = self._threshold_rules(component)
+                if component_leaves is None:
+                    return None
+                leaves.extend(component_leaves)
+            return leaves
+        return None
+
+    def _price_updated(self, stock):
+        price = stock.price
+        self.prices[self.symbol_index[stock.symbol]] = \
+            price if price else self.no_price
+
+    def _prepare_arrays(self):
+        numpy = _numpy()
+        self.no_price = numpy.nan
+        self.prices = numpy.array(
+            [price if price else numpy.nan for price in self.prices],
+            dtype=numpy.float64)
+        self.leaf_symbols = numpy.array(
+            [self.symbol_index[leaf.symbol] for leaf in self.leaves],
+            dtype=numpy.intp)
+        self.leaf_thresholds = numpy.array(
+            [leaf.threshold for leaf in self.leaves], dtype=numpy.float64)
+        self.leaf_groups = {
+            comparison: numpy.array(
+                [i for i, leaf in enumerate(self.leaves)
+                 if leaf.comparison == comparison], dtype=numpy.intp)
+            for comparison in PriceThresholdRule.COMPARISONS}
+
+    def _prepare_sorted_thresholds(self):
+        self.no_price = None
+        self.sorted_thresholds = {}
+        for i, leaf in enumerate(self.leaves):
+            self.sorted_thresholds.setdefault(
+                (self.symbol_index[leaf.symbol], leaf.comparison),
+                []).append((leaf.threshold, i))
+        for key, thresholds in self.sorted_thresholds.items():
+            thresholds.sort()
+            self.sorted_thresholds[key] = (
+                [threshold for threshold, _ in thresholds],
+                [i for _, i in thresholds])
+
+    def _matching_leaves_with_numpy(self):
+        numpy = _numpy()
+        prices = self.prices[self.leaf_symbols]
+        matched = numpy.zeros(len(self.leaves), dtype=bool)
+        for comparison, group in self.leaf_groups.items():
+            compare = PriceThresholdRule.COMPARISONS[comparison]
+            matched[group] = compare(prices[group], self.leaf_thresholds[group])
+        return matched
+
+    def _matching_leaves_by_bisection(self):
+        matched = bytearray(len(self.leaves))
+        for (index, comparison), (thresholds, leaves) in \
+                self.sorted_thresholds.items():
+            price = self.prices[index]
+            if not price:
+                continue
+            if comparison == ">":
+                matching = leaves[:bisect.bisect_left(thresholds, price)]
+            elif comparison == ">=":
+                matching = leaves[:bisect.bisect_right(thresholds, price)]
+            elif comparison == "<":
+                matching = leaves[bisect.bisect_right(thresholds, price):]
+            else:
+                matching = leaves[bisect.bisect_left(thresholds, price):]
+            for leaf in matching:
+                matched[leaf] = 1
+        return matched
+
+    def matching_alerts(self):
+        """Returns the alerts whose rules match the exchange right now"""
+        matching = []
+        if self.alerts:
+            if self.use_numpy:
+                numpy = _numpy()
+                matched = numpy.logical_and.reduceat(
+                    self._matching_leaves_with_numpy(), self.alert_starts)
+                matching.extend(self.alerts[i]
+                                for i in numpy.flatnonzero(matched).tolist())
+            else:
+                matched = self._matching_leaves_by_bisection()
+                ends = self.alert_starts[1:] + [len(self.leaves)]
+                matching.extend(alert for alert, start, end in
+                                zip(self.alerts, self.alert_starts, ends)
+                                if all(matched[start:end]))
+        matching.extend(alert for alert in self.other_alerts
+                        if alert.rule.matches(self.exchange))
+        return matching
@@ -0,0 +1,209 @@
+"""Replays history to see which alerts and crossover signals it gives
+
+A Backtest replays the updates from a reader as fast as they can be
+applied, keeping a simulated clock at the timestamp of the latest update.
+Instead of executing the actions of the alerts, it records every time an
+alert triggers, along with every buy and sell crossover signal, as rows of
+a results table
+
+>>> from datetime import datetime
+>>> from stock_alerter.reader import ListReader
+>>> from stock_alerter.alert import Alert
+>>> from stock_alerter.rule import PriceRule
+>>> from stock_alerter.action import PrintAction
+>>> reader = ListReader([("GOOG", datetime(2014, 2, 8), 5),
+...                      ("GOOG", datetime(2014, 2, 9), 2)])
+>>> alert = Alert("GOOG > $3", PriceRule("GOOG", lambda s: s.price > 3),
+...               PrintAction())
+>>> Backtest(reader, [alert]).run()
+[BacktestResult(timestamp=datetime.datetime(2014, 2, 8, 0, 0), kind='alert', symbol='GOOG', detail='GOOG > $3')]
+
+sweep runs a backtest for every combination of parameters in a grid, in a
+pool of processes. The updates are read once, into shared memory, which
+every process replays them from"""
+import collections
+import itertools
+import os
+
+from .alert import Alert, AlertEngine
+from .exchange import Exchange
+from .reader import SharedTicks, SharedMemoryReader, _context
+from .stock import StockSignal
+
+BacktestResult = collections.namedtuple(
+    "BacktestResult", ["timestamp", "kind", "symbol", "detail"])
+BacktestResult.__doc__ = """A row of the results of a backtest
+
+kind is "alert" for an alert that triggered, with the description of the
+alert as the detail, and "signal" for a crossover signal, with the
+StockSignal as the detail. The timestamp of a signal is the start of the
+day it is for"""
+
+
+class _RecordingAction:
+    """Stands in for the action of an alert, and records a row in results
+    each time the alert triggers"""
+    __slots__ = ("backtest", "results")
+
+    def __init__(self, backtest, results):
+        self.backtest = backtest
+        self.results = results
+
+    def execute(self, description):
+        backtest = self.backtest
+        self.results.append(BacktestResult(
+            backtest.now, "alert", backtest.symbol, description))
+
+
+def _recording(alert, action):
+    """Returns a copy of alert with action in place of its own"""
+    return Alert(alert.description, alert.rule, action,
+                 edge_triggered=alert.edge_triggered,
+                 rearm_after=alert.rearm_after, hysteresis=alert.hysteresis)
+
+
+def _in_order(results):
+    return sorted(results, key=lambda result: result.timestamp)
+
+
+class Backtest:
+    """Replays the updates from a reader into a new Exchange, with the
+    alerts connected to it
+
+    Copies of the alerts are connected, with actions that record a row in
+    the results in place of their own, so the actions are not executed and
+    the alerts themselves are left as they were. now is the timestamp of
+    the update being applied, and symbol is its stock"""
+
+    def __init__(self, reader, alerts=()):
+        self.reader = reader
+        self.exchange = Exchange()
+        self.engine = AlertEngine(self.exchange)
+        self.results = []
+        self.now = None
+        self.symbol = None
+        self.replayed = False
+        self.record(alerts, self.results)
+
+    def record(self, alerts, results):
+        """Connects more alerts, which record the rows for the times they
+        trigger in results, rather than in the results of the backtest.
+        Alerts don't change the stocks, so backtesting several sets of
+        alerts in one replay gives the same results as replaying for each
+
+        The alerts are added to an AlertEngine, so that only the threshold
+        alerts that match an update are looked at"""
+        action = _RecordingAction(self, results)
+        for alert in alerts:
+            self.engine.add(_recording(alert, action))
+
+    def replay(self):
+        """Applies the updates, recording the alerts that trigger"""
+        exchange = self.exchange
+        for symbol, timestamp, price in self.reader.get_updates():
+            self.now = timestamp
+            self.symbol = symbol
+            exchange[symbol].update(timestamp, price)
+        self.replayed = True
+
+    def signals(self, short_term_timespan=None, long_term_timespan=None):
+        """Returns a row for every buy and sell crossover signal of every
+        stock, on each day from its first update to its last"""
+        results = []
+        for symbol, stock in self.exchange.items():
+            if not len(stock.history):
+                continue
+            first = stock.history[0].timestamp
+            first = first.replace(hour=0, minute=0, second=0, microsecond=0)
+            for date, signal in stock.get_crossover_signals(
+                    first, stock.history[-1].timestamp,
+                    short_term_timespan, long_term_timespan):
+                if signal != StockSignal.neutral:
+                    results.append(BacktestResult(date, "signal", symbol,
+                                                  signal))
+        return results
+
+    def run(self, short_term_timespan=None, long_term_timespan=None):
+        """Replays the updates, if that hasn't been done yet, and returns
+        the results, in timestamp order. The crossover signals use the
+        given timespans, or those of Stock if they aren't given"""
+        if not self.replayed:
+            self.replay()
+        return _in_order(self.results + self.signals(short_term_timespan,
+                                                     long_term_timespan))
+
+
+def parameter_grid(grid):
+    """Returns a dict of parameters for every combination of the values in
+    grid, a dict of parameter names to lists of values
+
+    >>> parameter_grid({"threshold": [1, 2], "long_term_timespan": [10]})
+    [{'threshold': 1, 'long_term_timespan': 10}, {'threshold': 2, 'long_term_timespan': 10}]
+    """
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+_worker = {}
+
+
+def _start_worker(name, make_alerts):
+    _worker.clear()
+    _worker.update(name=name, make_alerts=make_alerts)
+
+
+def _run_backtests(combinations):
+    """Backtests every set of parameters in one replay of the shared
+    ticks, working out the crossover signals once for each pair of
+    timespans"""
+    backtest = Backtest(SharedMemoryReader(_worker["name"]))
+    recorded = []
+    for parameters in combinations:
+        results = []
+        if _worker["make_alerts"] is not None:
+            backtest.record(_worker["make_alerts"](parameters), results)
+        recorded.append(results)
+    backtest.replay()
+    signals = {}
+    for parameters, results in zip(combinations, recorded):
+        timespans = (parameters.get("short_term_timespan"),
+                     parameters.get("long_term_timespan"))
+        if timespans not in signals:
+            signals[timespans] = backtest.signals(*timespans)
+        results.extend(signals[timespans])
+    return [_in_order(results) for results in recorded]
+
+
+def sweep(reader, grid, make_alerts=None, num_workers=None):
+    """Runs a backtest of the updates from reader for every combination of
+    parameters in grid, and returns a list of (parameters, results) pairs
+
+    make_alerts is called with the dict of parameters, and returns the
+    alerts to backtest with them. The short_term_timespan and
+    long_term_timespan parameters, if there are any, are used for the
+    crossover signals
+
+    The parameter sets are split between a pool of num_workers processes,
+    which are forked where possible, so make_alerts doesn't need to be
+    picklable. Each process backtests all of its parameter sets in a
+    single replay, so a sweep takes little longer than a backtest per
+    process"""
+    combinations = parameter_grid(grid)
+    num_workers = max(1, min(num_workers or os.cpu_count() or 1,
+                             len(combinations)))
+    size = max(1, -(-len(combinations) // num_workers))
+    chunks = [combinations[i:i + size]
+              for i in range(0, len(combinations), size)]
+    with SharedTicks(reader.get_updates()) as ticks:
+        if num_workers == 1:
+            _start_worker(ticks.name, make_alerts)
+            try:
+                results = list(map(_run_backtests, chunks))
+            finally:
+                _worker.clear()
+        else:
+            with _context().Pool(num_workers, _start_worker,
+                                 (ticks.name, make_alerts)) as pool:
+                results = pool.map(_run_backtests, chunks)
+    return list(zip(combinations, itertools.chain.from_iterable(results)))
@@ -0,0 +1,293 @@
+"""Benchmarks for the path from reading updates to executing actions
+
+Run them with
+
+    python -m stock_alerter.benchmark --output results.json
+
+and compare them against the results of an earlier commit with
+
+    python -m stock_alerter.benchmark --baseline results.json
+
+which exits with a non-zero status if any benchmark got slower than the
+threshold allows. Each benchmark runs on synthetic updates in the same
+format as updates.csv, generated from a fixed seed, so results taken on
+the same machine are comparable"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from .alert import Alert, AlertEngine
+from .processor import Processor
+from .reader import FileReader
+from .rule import PriceRule, PriceThresholdRule
+from .stock import Stock
+
+
+def synthetic_updates(num_symbols, num_ticks, days=60, seed=0):
+    """Returns num_ticks updates, in timestamp order, spread over
+    num_symbols stocks and the given number of days. The price of each
+    stock is a random walk"""
+    rng = random.Random(seed)
+    symbols = ["S{0:04}".format(i) for i in range(num_symbols)]
+    prices = {symbol: rng.randrange(50, 150) for symbol in symbols}
+    start = datetime(2014, 2, 1)
+    interval = timedelta(days=days) / max(num_ticks, 1)
+    for i in range(num_ticks):
+        symbol = rng.choice(symbols)
+        prices[symbol] = max(1, prices[symbol] + rng.randrange(-2, 3))
+        yield symbol, start + interval * i, prices[symbol]
+
+
+def write_updates(filename, updates):
+    """Writes updates to a file in the format that FileReader reads"""
+    with open(filename, "w") as fp:
+        for symbol, timestamp, price in updates:
+            fp.write("{0},{1},{2}\n".format(
+                symbol, timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f"), price))
+
+
+class _CountAction:
+    def __init__(self):
+        self.count = 0
+
+    def execute(self, description):
+        self.count += 1
+
+
+def _best_of(repeat, setup, run):
+    """Returns the shortest time that run took, out of repeat runs, with
+    the value returned by setup passed to it, and not timed"""
+    best = None
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _exchange_for(updates):
+    return {symbol: Stock(symbol) for symbol in {update[0] for update in updates}}
+
+
+def _updated_exchange(updates):
+    exchange = _exchange_for(updates)
+    for symbol, timestamp, price in updates:
+        exchange[symbol].update(timestamp, price)
+    return exchange
+
+
+def _rate(count, seconds, unit):
+    return {"value": count / seconds, "unit": unit, "higher_is_better": True}
+
+
+def _latency(count, seconds):
+    return {"value": seconds / count, "unit": "s", "higher_is_better": False}
+
+
+def bench_parse(filename, updates, repeat):
+    def run(_):
+        for update in FileReader(filename).get_updates():
+            pass
+    return _rate(len(updates), _best_of(repeat, lambda: None, run),
+                 "updates/s")
+
+
+def bench_stock_update(filename, updates, repeat):
+    def run(exchange):
+        for symbol, timestamp, price in updates:
+            exchange[symbol].update(timestamp, price)
+    return _rate(len(updates),
+                 _best_of(repeat, lambda: _exchange_for(updates), run),
+                 "updates/s")
+
+
+def bench_crossover_signal(filename, updates, repeat):
+    exchange = _updated_exchange(updates)
+    last_day = max(update[1] for update in updates)
+    days = [last_day - timedelta(days) for days in range(20)]
+
+    def setup():
+        for stock in exchange.values():
+            stock.moving_averages.clear()
+
+    def run(_):
+        for stock in exchange.values():
+            for day in days:
+                stock.get_crossover_signal(day)
+    return _latency(len(exchange) * len(days), _best_of(repeat, setup, run))
+
+
+def _fanout_exchange(updates, num_alerts, connect):
+    exchange = _exchange_for(updates)
+    symbol = updates[0][0]
+    prices = [price for s, _, price in updates if s == symbol]
+    low, high = min(prices), max(prices) + 1
+    for i in range(num_alerts):
+        threshold = low + (high - low) * i / num_alerts
+        connect(exchange, Alert("{0} > {1}".format(symbol, threshold),
+                                PriceThresholdRule(symbol, ">", threshold),
+                                _CountAction()))
+    return exchange
+
+
+def _bench_fanout(updates, repeat, connect, num_alerts=100):
+    symbol = updates[0][0]
+    ticks = [update for update in updates if update[0] == symbol]
+
+    def run(exchange):
+        stock = exchange[symbol]
+        for _, timestamp, price in ticks:
+            stock.update(timestamp, price)
+    return _rate(len(ticks), _best_of(
+        repeat, lambda: _fanout_exchange(updates, num_alerts, connect), run),
+        "updates/s")
+
+
+def bench_alert_fanout(filename, updates, repeat):
+    return _bench_fanout(updates, repeat,
+                         lambda exchange, alert: alert.connect(exchange))
+
+
+def bench_price_rule_fanout(filename, updates, repeat):
+    def connect(exchange, alert):
+        threshold = alert.rule.threshold
+        Alert(alert.description,
+              PriceRule(alert.rule.symbol,
+                        lambda stock: stock.price > threshold),
+              alert.action).connect(exchange)
+    return _bench_fanout(updates, repeat, connect)
+
+
+def bench_alert_engine_fanout(filename, updates, repeat):
+    engines = {}
+
+    def connect(exchange, alert):
+        if id(exchange) not in engines:
+            engines.clear()
+            engines[id(exchange)] = AlertEngine(exchange)
+        engines[id(exchange)].add(alert)
+    return _bench_fanout(updates, repeat, connect)
+
+
+def bench_processor(filename, updates, repeat):
+    def setup():
+        exchange = _fanout_exchange(
+            updates, 10, lambda exchange, alert: alert.connect(exchange))
+        return Processor(FileReader(filename), exchange)
+    return _rate(len(updates), _best_of(
+        repeat, setup, lambda processor: processor.process()), "updates/s")
+
+
+def bench_processor_batched(filename, updates, repeat):
+    def setup():
+        exchange = _fanout_exchange(
+            updates, 10, lambda exchange, alert: alert.connect(exchange))
+        return Processor(FileReader(filename), exchange, batch_size=1000)
+    return _rate(len(updates), _best_of(
+        repeat, setup, lambda processor: processor.process()), "updates/s")
+
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "stock_update": bench_stock_update,
+    "crossover_signal": bench_crossover_signal,
+    "alert_fanout": bench_alert_fanout,
+    "price_rule_fanout": bench_price_rule_fanout,
+    "alert_engine_fanout": bench_alert_engine_fanout,
+    "processor": bench_processor,
+    "processor_batched": bench_processor_batched,
+}
+
+
+def run_benchmarks(num_symbols=100, num_ticks=100000, repeat=3, names=None,
+                   seed=0):
+    """Runs the benchmarks and returns their results, along with the
+    parameters they were run with, as a dict that can be saved as JSON"""
+    if num_symbols < 1 or num_ticks < 1:
+        raise ValueError("the benchmarks need at least one symbol and tick")
+    updates = list(synthetic_updates(num_symbols, num_ticks, seed=seed))
+    fd, filename = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        write_updates(filename, updates)
+        results = {name: benchmark(filename, updates, repeat)
+                   for name, benchmark in BENCHMARKS.items()
+                   if names is None or name in names}
+    finally:
+        os.remove(filename)
+    return {"parameters": {"symbols": num_symbols, "ticks": num_ticks,
+                           "repeat": repeat, "seed": seed},
+            "python": platform.python_version(),
+            "results": results}
+
+
+def compare(baseline, current, threshold=0.1):
+    """Returns the benchmarks that are more than threshold, as a fraction,
+    slower in current than in baseline, as (name, baseline value, current
+    value, slowdown) tuples"""
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before, after = baseline["results"][name]["value"], result["value"]
+        if result["higher_is_better"]:
+            slowdown = (before - after) / before
+        else:
+            slowdown = (after - before) / before
+        if slowdown > threshold:
+            regressions.append((name, before, after, slowdown))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS),
+                        help="run only these benchmarks")
+    parser.add_argument("--output", help="file to save the results to")
+    parser.add_argument("--baseline",
+                        help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown, as a fraction, that counts as a "
+                             "regression")
+    parser.add_argument("--write-updates", metavar="FILE",
+                        help="only write the synthetic updates to FILE")
+    args = parser.parse_args(argv)
+    if args.symbols < 1 or args.ticks < 1:
+        parser.error("--symbols and --ticks should be positive")
+    if args.write_updates:
+        write_updates(args.write_updates, synthetic_updates(
+            args.symbols, args.ticks, seed=args.seed))
+        return 0
+    results = run_benchmarks(args.symbols, args.ticks, args.repeat,
+                             args.only, args.seed)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(json.load(fp), results, args.threshold)
+        for name, before, after, slowdown in regressions:
+            print("{0} regressed by {1:.0%}: {2:.6g} -> {3:.6g}".format(
+                name, slowdown, before, after), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
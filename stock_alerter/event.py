@@ -1,5 +1,18 @@
+from . import metrics
+
+
+def is_awaitable(value):
+    """Like inspect.isawaitable, but inspect, which is slow to import, is
+    only imported once there is a value that could be awaitable"""
+    if value is None:
+        return False
+    import inspect
+    return inspect.isawaitable(value)
+
+
 class Event:
     """A generic class that provides signal/slot functionality"""
+    __slots__ = ("listeners",)
 
     def __init__(self):
         self.listeners = []
@@ -10,3 +23,25 @@ class Event:
     def fire(self, *args, **kwargs):
         for listener in self.listeners:
             listener(*args, **kwargs)
+
+    async def fire_async(self, *args, **kwargs):
+        """Like fire, but listeners may also be coroutine functions, or
+        return awaitables. These are awaited together, so that they run
+        at the same time"""
+        import asyncio
+        awaitables = []
+        for listener in self.listeners:
+            result = listener(*args, **kwargs)
+            if is_awaitable(result):
+                awaitables.append(result)
+        if awaitables:
+            await asyncio.gather(*awaitables)
+
+
+@metrics.instrumented(Event, "fire")
+def _measured_fire(self, *args, **kwargs):
+    for listener in self.listeners:
+        start = metrics.clock()
+        listener(*args, **kwargs)
+        metrics.record("event_listener_seconds", start,
+                       listener=metrics.name_of(listener))
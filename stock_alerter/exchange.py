@@ -0,0 +1,68 @@
+import sys
+
+from .stock import Stock
+
+
+class Exchange(dict):
+    """The stocks of an exchange, by symbol
+
+    An Exchange is a dict, so it can be used wherever a dict of stocks is.
+    Unlike a dict, looking up a symbol that isn't in the exchange adds a
+    new Stock for it, with the exchange's retention policy, so updates for
+    symbols that haven't been seen before are accepted
+
+    >>> exchange = Exchange()
+    >>> exchange["GOOG"].symbol
+    'GOOG'
+    >>> "AAPL" in exchange, exchange.get("AAPL")
+    (False, None)
+
+    Symbols are interned, and each one is given an integer id in the order
+    they are added, so that data about every symbol can be kept in arrays.
+    Ids are never reused, even if a stock is removed
+
+    >>> exchange.symbol_id("GOOG"), exchange.symbols[0]
+    (0, 'GOOG')
+    """
+
+    def __init__(self, stocks=(), retention=None):
+        super().__init__()
+        self.retention = retention
+        self.symbols = []
+        self.ids = {}
+        self.update(stocks)
+
+    def __missing__(self, symbol):
+        stock = Stock(sys.intern(symbol), self.retention)
+        self[stock.symbol] = stock
+        return stock
+
+    def __setitem__(self, symbol, stock):
+        symbol = sys.intern(symbol)
+        self.symbol_id(symbol)
+        super().__setitem__(symbol, stock)
+
+    def update(self, stocks=(), **kwargs):
+        if hasattr(stocks, "keys"):
+            stocks = [(symbol, stocks[symbol]) for symbol in stocks.keys()]
+        for symbol, stock in list(stocks) + list(kwargs.items()):
+            self[symbol] = stock
+
+    def setdefault(self, symbol, stock=None):
+        if symbol not in self:
+            self[symbol] = stock
+        return self[symbol]
+
+    def symbol_id(self, symbol):
+        """Returns the id of a symbol, giving it the next id if it doesn't
+        have one yet"""
+        try:
+            return self.ids[symbol]
+        except KeyError:
+            symbol = sys.intern(symbol)
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self.ids[symbol]
+
+    def __reduce__(self):
+        return (type(self), (dict(self), self.retention))
@@ -0,0 +1,349 @@
+"""A small language for rule conditions
+
+Conditions are built up as expressions, either in Python
+
+>>> condition = (price("GOOG") > 10) & ~increasing_trend("AAPL")
+
+or parsed from text, which is also what the expressions turn back into
+
+>>> condition == parse('price("GOOG") > 10 and not increasing_trend("AAPL")')
+True
+>>> print(condition)
+price("GOOG") > 10 and not increasing_trend("AAPL")
+
+Unlike a lambda, an expression can be inspected, compared, stored as text
+and compiled. ExpressionCompiler compiles expressions into closures, and
+compiles identical sub-expressions only once, so that they are shared."""
+import operator
+import weakref
+
+from .timeseries import NotEnoughDataException
+
+
+class Expression:
+    """Base class of expressions. Expressions are immutable, and compare
+    equal when they have the same structure"""
+    __slots__ = ("args",)
+    precedence = 4
+
+    def __init__(self, *args):
+        self.args = args
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.args == other.args
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self), self.args))
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, str(self))
+
+    def children(self):
+        return [arg for arg in self.args if isinstance(arg, Expression)]
+
+    def depends_on(self):
+        depends = set()
+        for child in self.children():
+            depends = depends.union(child.depends_on())
+        return depends
+
+    def history_needed(self):
+        """Returns how many updates, and how many days of closes, of the
+        history of a stock the expression needs, as a pair"""
+        return most_history(child.history_needed()
+                            for child in self.children())
+
+    def _format(self, child):
+        if child.precedence <= self.precedence:
+            return "(" + str(child) + ")"
+        return str(child)
+
+    def __gt__(self, other):
+        return Compare(">", self, _as_expression(other))
+
+    def __ge__(self, other):
+        return Compare(">=", self, _as_expression(other))
+
+    def __lt__(self, other):
+        return Compare("<", self, _as_expression(other))
+
+    def __le__(self, other):
+        return Compare("<=", self, _as_expression(other))
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+def most_history(needs):
+    """Returns the most history needed by any of the (num_ticks, num_days)
+    pairs in needs, as a pair. At least the latest update is needed. A need
+    of None stands for the whole history, and makes the result None"""
+    num_ticks, num_days = 1, 0
+    for need in needs:
+        if need is None:
+            return None
+        ticks, days = need
+        num_ticks, num_days = max(num_ticks, ticks), max(num_days, days)
+    return num_ticks, num_days
+
+
+def _as_expression(value):
+    return value if isinstance(value, Expression) else Constant(value)
+
+
+class Constant(Expression):
+    __slots__ = ()
+    precedence = 5
+
+    def __str__(self):
+        return repr(self.args[0])
+
+    def build(self, children):
+        value = self.args[0]
+        return lambda exchange: value
+
+
+class _StockExpression(Expression):
+    __slots__ = ()
+    precedence = 5
+    name = None
+
+    def depends_on(self):
+        return {self.args[0]}
+
+    def __str__(self):
+        return "{0}({1})".format(self.name, ", ".join(
+            '"{0}"'.format(arg) if isinstance(arg, str) else repr(arg)
+            for arg in self.args))
+
+    def build(self, children):
+        symbol = self.args[0]
+        value_of = self.value_of
+
+        def evaluate(exchange):
+            stock = exchange.get(symbol)
+            if stock is None:
+                return None
+            return value_of(stock)
+        return evaluate
+
+
+class Price(_StockExpression):
+    """The current price of a stock"""
+    __slots__ = ()
+    name = "price"
+
+    def value_of(self, stock):
+        return stock.price
+
+
+class MovingAverageValue(_StockExpression):
+    """The moving average of a stock over a number of days, on the day of
+    its latest update"""
+    __slots__ = ()
+    name = "moving_average"
+
+    def history_needed(self):
+        return 1, self.args[1]
+
+    def value_of(self, stock):
+        if stock._history is None:
+            return None
+        try:
+            latest = stock.history[-1].timestamp
+            return stock.moving_average(self.args[1]).value_on(latest)
+        except (IndexError, NotEnoughDataException):
+            return None
+
+
+class IncreasingTrend(_StockExpression):
+    """Whether the last three prices of a stock have been increasing"""
+    __slots__ = ()
+    name = "increasing_trend"
+
+    def history_needed(self):
+        return 3, 0
+
+    def value_of(self, stock):
+        return stock.is_increasing_trend()
+
+
+class Compare(Expression):
+    """Compares two expressions. The comparison is False if either side
+    has no value, like the price of a stock without updates"""
+    __slots__ = ()
+    precedence = 3
+    OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt,
+                 "<=": operator.le, "==": operator.eq, "!=": operator.ne}
+
+    def __init__(self, comparison, left, right):
+        if comparison not in self.OPERATORS:
+            raise ValueError("Unknown comparison {0}".format(comparison))
+        super().__init__(comparison, left, right)
+
+    def __str__(self):
+        comparison, left, right = self.args
+        return "{0} {1} {2}".format(self._format(left), comparison,
+                                    self._format(right))
+
+    def build(self, children):
+        compare = self.OPERATORS[self.args[0]]
+        left, right = children
+
+        def evaluate(exchange):
+            left_value = left(exchange)
+            if left_value is None:
+                return False
+            right_value = right(exchange)
+            if right_value is None:
+                return False
+            return compare(left_value, right_value)
+        return evaluate
+
+
+class Not(Expression):
+    __slots__ = ()
+    precedence = 2
+
+    def __str__(self):
+        return "not " + self._format(self.args[0])
+
+    def build(self, children):
+        operand, = children
+        return lambda exchange: not operand(exchange)
+
+
+class And(Expression):
+    __slots__ = ()
+    precedence = 1
+
+    def __str__(self):
+        return " and ".join(self._format(arg) for arg in self.args)
+
+    def build(self, children):
+        return lambda exchange: all(child(exchange) for child in children)
+
+
+class Or(Expression):
+    __slots__ = ()
+    precedence = 0
+
+    def __str__(self):
+        return " or ".join(self._format(arg) for arg in self.args)
+
+    def build(self, children):
+        return lambda exchange: any(child(exchange) for child in children)
+
+
+def price(symbol):
+    return Price(symbol)
+
+
+def moving_average(symbol, timespan):
+    return MovingAverageValue(symbol, timespan)
+
+
+def increasing_trend(symbol):
+    return IncreasingTrend(symbol)
+
+
+FUNCTIONS = {"price": price, "moving_average": moving_average,
+             "increasing_trend": increasing_trend}
+_COMPARISONS = {"Gt": ">", "GtE": ">=", "Lt": "<", "LtE": "<=", "Eq": "==",
+                "NotEq": "!="}
+
+
+def _convert(node):
+    import ast
+    if isinstance(node, ast.BoolOp):
+        operands = [_convert(value) for value in node.values]
+        return And(*operands) if isinstance(node.op, ast.And) else Or(*operands)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return Not(_convert(node.operand))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        operand = _convert(node.operand)
+        if isinstance(operand, Constant):
+            return Constant(-operand.args[0])
+    if isinstance(node, ast.Compare) and \
+            all(type(op).__name__ in _COMPARISONS for op in node.ops):
+        operands = [_convert(node.left)] + [_convert(value)
+                                            for value in node.comparators]
+        comparisons = [Compare(_COMPARISONS[type(op).__name__], left, right)
+                       for op, left, right in zip(node.ops, operands, operands[1:])]
+        return comparisons[0] if len(comparisons) == 1 else And(*comparisons)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+            node.func.id in FUNCTIONS and not node.keywords:
+        args = [_convert(arg) for arg in node.args]
+        if all(isinstance(arg, Constant) for arg in args):
+            return FUNCTIONS[node.func.id](*[arg.args[0] for arg in args])
+    if isinstance(node, ast.Constant) and \
+            isinstance(node.value, (int, float, str, bool)):
+        return Constant(node.value)
+    raise ValueError("Unsupported expression: {0}".format(ast.dump(node)))
+
+
+def parse(text):
+    """Parses the text form of an expression, as given by str"""
+    import ast
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError as e:
+        raise ValueError("Invalid expression: {0}".format(e))
+    return _convert(tree.body)
+
+
+class ExpressionCompiler:
+    """Compiles expressions into functions that take an exchange
+
+    Each distinct sub-expression is compiled once, however many expressions
+    it appears in. Its value is remembered along with the history revision
+    of the stocks it depends on, so a sub-expression shared by many rules
+    is evaluated once per update of its stocks. Only weak references to
+    the histories are kept, so a compiler that outlives an exchange, like
+    the one ExpressionRule shares, doesn't keep its stocks alive
+
+    A compiled expression is kept only while something, such as a rule,
+    holds on to it or to an expression it is part of, so that compiling
+    expressions for rules that come and go doesn't fill up the compiler"""
+
+    def __init__(self):
+        self.compiled = weakref.WeakValueDictionary()
+
+    def compile(self, expression):
+        try:
+            return self.compiled[expression]
+        except KeyError:
+            pass
+        children = [self.compile(child) for child in expression.children()]
+        evaluate = expression.build(children)
+        if not isinstance(expression, Constant):
+            evaluate = self._remembered(evaluate, sorted(expression.depends_on()))
+        self.compiled[expression] = evaluate
+        return evaluate
+
+    def _remembered(self, evaluate, symbols):
+        # the value only depends on the histories of the stocks, so it is
+        # remembered by a weak reference to each history and its revision.
+        # Live references compare equal when their histories are the same
+        last = [None, None]
+
+        def remembered(exchange):
+            # _history, so that stocks without updates don't get one made
+            histories = [exchange[symbol]._history if symbol in exchange
+                         else None for symbol in symbols]
+            key = [None if history is None else
+                   (weakref.ref(history), history.revision)
+                   for history in histories]
+            if last[0] != key:
+                last[:] = key, evaluate(exchange)
+            return last[1]
+        return remembered
@@ -1,5 +1,4 @@
-from datetime import datetime
-
+from .reader import parse_timestamp
 from .stock import Stock
 from .rule import PriceRule
 
@@ -13,9 +12,7 @@ class FileReader:
         with open(self.filename, "r") as fp:
             for line in fp.readlines():
                 symbol, timestamp, price = line.split(",")
-                updates.append((symbol,
-                                datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f"),
-                                int(price)))
+                updates.append((symbol, parse_timestamp(timestamp), int(price)))
         return updates
 
 
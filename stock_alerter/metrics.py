@@ -0,0 +1,251 @@
+"""Optional instrumentation of the update path
+
+Instrumentation is off by default. Call enable() to start recording
+
+- how long Processor.process spends reading, and applying, each update
+- how long each Stock.update takes, including its listeners
+- how long each listener of an Event takes
+- how long Alert.check_rule and the execute method of actions take
+- how many times alerts fired
+- how many updates and emails are waiting in queues
+
+into the registry, and dump() to get them as text
+
+>>> enable()
+>>> counter("updates_total").inc()
+>>> print(dump())
+# TYPE updates_total counter
+updates_total 1
+>>> disable()
+>>> registry.reset()
+
+The instrumented versions of the methods are swapped in by enable(), and
+the plain ones back by disable(), so while instrumentation is off the
+update path runs exactly as it would without it. Alert.check_rule, which
+alerts connect to stocks as a bound method, checks the enabled flag
+instead, so that it follows enable() and disable() after it is connected
+
+The alert metrics are totals for all alerts, unless enable is called with
+per_alert=True, which labels them with the description of each alert.
+That adds a histogram and a counter per alert, so it is best kept for
+when there are few alerts"""
+import functools
+import threading
+import time
+
+enabled = False
+per_alert_labels = False
+clock = time.perf_counter_ns
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram:
+    """Counts values in buckets whose width grows with the value, like an
+    HDR histogram, so that any value is off by less than 1% when read back
+    without storing every value. Values are integers, like nanoseconds
+
+    Each power of two is split into 2 ** (SUB_BUCKET_BITS - 1) buckets, so
+    a value reads back at most 1/128 below what was recorded"""
+    SUB_BUCKET_BITS = 8
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        half = 1 << (self.SUB_BUCKET_BITS - 1)
+        if value < 2 * half:
+            return value
+        shift = value.bit_length() - self.SUB_BUCKET_BITS
+        return shift * half + (value >> shift)
+
+    def _lowest_value(self, index):
+        half = 1 << (self.SUB_BUCKET_BITS - 1)
+        if index < 2 * half:
+            return index
+        shift = index // half - 1
+        return (index - shift * half) << shift
+
+    def record(self, value):
+        value = max(value, 0)
+        index = self._index(value)
+        if index >= len(self.counts):
+            self.counts.extend([0] * (index + 1 - len(self.counts)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, quantile):
+        """Returns the value below which the given fraction of the recorded
+        values fall, or None if nothing has been recorded"""
+        if not self.count:
+            return None
+        target = max(1, quantile * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(max(self._lowest_value(index), self.min), self.max)
+        return self.max
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """A value that goes up and down, like the length of a queue, along
+    with the highest value it has had"""
+    def __init__(self):
+        self.value = 0
+        self.max = 0
+
+    def set(self, value):
+        self.value = value
+        self.max = max(self.max, value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace('"', r'\"'))
+                          for name, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """Holds metrics by name and labels, creating them when they are first
+    used"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, kind, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        try:
+            metric = self.metrics[key]
+        except KeyError:
+            with self.lock:
+                metric = self.metrics.setdefault(key, kind())
+        if not isinstance(metric, kind):
+            raise ValueError("{0} is not a {1}".format(name, kind.__name__))
+        return metric
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, **labels):
+        return self._get(Histogram, name, labels)
+
+    def reset(self):
+        self.metrics = {}
+
+    def dump(self):
+        """Returns the metrics in the Prometheus text format. Histograms of
+        durations in nanoseconds, named ..._seconds, are given in seconds"""
+        lines = []
+        typed = set()
+        for (name, labels), metric in sorted(self.metrics.items(),
+                                             key=lambda item: item[0]):
+            if isinstance(metric, Histogram):
+                kind = "summary"
+            else:
+                kind = type(metric).__name__.lower()
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {0} {1}".format(name, kind))
+            if isinstance(metric, Counter):
+                lines.append("{0}{1} {2}".format(
+                    name, _format_labels(labels), metric.value))
+            elif isinstance(metric, Gauge):
+                lines.append("{0}{1} {2}".format(
+                    name, _format_labels(labels), metric.value))
+                lines.append("{0}_max{1} {2}".format(
+                    name, _format_labels(labels), metric.max))
+            else:
+                scale = 1e-9 if name.endswith("_seconds") else 1
+                for quantile in QUANTILES:
+                    value = metric.percentile(quantile)
+                    lines.append("{0}{1} {2:.9g}".format(
+                        name,
+                        _format_labels(labels + (("quantile", quantile),)),
+                        (value or 0) * scale))
+                lines.append("{0}_sum{1} {2:.9g}".format(
+                    name, _format_labels(labels), metric.total * scale))
+                lines.append("{0}_count{1} {2}".format(
+                    name, _format_labels(labels), metric.count))
+        return "\n".join(lines)
+
+
+registry = MetricsRegistry()
+_instrumented = []
+
+
+def instrumented(cls, name):
+    """Registers the decorated function as the instrumented version of the
+    method name of cls, for enable() to swap in"""
+    def register(function):
+        plain = cls.__dict__[name]
+        functools.update_wrapper(function, plain)
+        _instrumented.append((cls, name, plain, function))
+        if enabled:
+            setattr(cls, name, function)
+        return function
+    return register
+
+
+def enable(per_alert=False):
+    global enabled, per_alert_labels
+    enabled = True
+    per_alert_labels = per_alert
+    for cls, name, plain, function in _instrumented:
+        setattr(cls, name, function)
+
+
+def disable():
+    global enabled
+    enabled = False
+    for cls, name, plain, function in _instrumented:
+        setattr(cls, name, plain)
+
+
+def counter(name, **labels):
+    return registry.counter(name, **labels)
+
+
+def gauge(name, **labels):
+    return registry.gauge(name, **labels)
+
+
+def record(name, start, **labels):
+    """Records the time since start, a value of clock(), in a histogram"""
+    registry.histogram(name, **labels).record(clock() - start)
+
+
+def alert_labels(alert):
+    """Returns the labels for the metrics of an alert"""
+    return {"alert": alert.description} if per_alert_labels else {}
+
+
+def name_of(function):
+    """Returns a readable name for a listener or action"""
+    function = getattr(function, "__func__", function)
+    return getattr(function, "__qualname__", type(function).__qualname__)
+
+
+def dump():
+    return registry.dump()
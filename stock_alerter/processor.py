@@ -1,9 +1,413 @@
+import os
+import time
+import zlib
+
+from . import metrics
+from .exchange import Exchange
+from .reader import _context
+
+
+def _read_in_background(reader, updates):
+    """Starts a thread that puts the updates from reader into the queue
+    updates, followed by None, or by the exception that reading raised.
+    Returns an Event that stops the thread once it is set"""
+    import queue
+    import threading
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                updates.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for update in reader.get_updates():
+                if not put(update):
+                    return
+        except Exception as e:
+            put(e)
+        else:
+            put(None)
+    threading.Thread(target=read, daemon=True).start()
+    return stop
+
+
 class Processor:
+    """Reads updates from the reader and applies them to the stocks in the
+    exchange
+
+    By default every update is applied as it is read. With a batch_size
+    above one, or a batch_window in seconds, updates are collected per
+    stock and applied with Stock.update_many once batch_size updates have
+    been read, or once batch_window seconds have passed since the first
+    one in the batch was read. Listeners of a stock are notified once per
+    batch. Larger batches give more throughput at the cost of latency
+
+    With a batch_window, the reader is read in a background thread, so
+    that a batch is applied when its window is up even if the feed has
+    gone quiet. The stocks are still only updated in this thread
+
+    Updates for symbols that aren't in the exchange raise a KeyError,
+    unless the exchange is an Exchange, which adds a stock for them. As
+    when updates aren't batched, the updates read before the error, or
+    before an error from the reader, are applied first"""
+    QUEUE_SIZE = 10000
+
+    def __init__(self, reader, exchange, batch_size=1, batch_window=None):
+        self.reader = reader
+        self.exchange = exchange
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+
+    def process(self):
+        if self.batch_size <= 1 and self.batch_window is None:
+            if metrics.enabled:
+                self._process_measured()
+                return
+            for symbol, timestamp, price in self.reader.get_updates():
+                stock = self.exchange[symbol]
+                stock.update(timestamp, price)
+            return
+        if self.batch_window is not None:
+            self._process_in_windows()
+            return
+        batch = {}
+        count = 0
+        try:
+            for symbol, timestamp, price in self.reader.get_updates():
+                batch.setdefault(self.exchange[symbol], []).append(
+                    (timestamp, price))
+                count += 1
+                if count >= self.batch_size:
+                    pending, batch, count = batch, {}, 0
+                    self._apply(pending)
+        except Exception:
+            self._apply(batch)
+            raise
+        self._apply(batch)
+
+    def _process_in_windows(self):
+        import queue
+        updates = queue.Queue(self.QUEUE_SIZE)
+        stop = _read_in_background(self.reader, updates)
+        batch = {}
+        count = 0
+        deadline = None
+        try:
+            while True:
+                try:
+                    update = updates.get(timeout=None if deadline is None else
+                                         max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    pending, batch, count, deadline = batch, {}, 0, None
+                    self._apply(pending)
+                    continue
+                if update is None:
+                    break
+                if isinstance(update, Exception):
+                    raise update
+                symbol, timestamp, price = update
+                batch.setdefault(self.exchange[symbol], []).append(
+                    (timestamp, price))
+                count += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_window
+                if count >= self.batch_size or time.monotonic() >= deadline:
+                    pending, batch, count, deadline = batch, {}, 0, None
+                    self._apply(pending)
+        except Exception:
+            self._apply(batch)
+            raise
+        finally:
+            stop.set()
+        self._apply(batch)
+
+    def _process_measured(self):
+        read = metrics.registry.histogram("processor_read_seconds")
+        apply = metrics.registry.histogram("processor_apply_seconds")
+        processed = metrics.counter("processor_updates_total")
+        updates = iter(self.reader.get_updates())
+        while True:
+            start = metrics.clock()
+            try:
+                symbol, timestamp, price = next(updates)
+            except StopIteration:
+                break
+            applying = metrics.clock()
+            read.record(applying - start)
+            self.exchange[symbol].update(timestamp, price)
+            apply.record(metrics.clock() - applying)
+            processed.inc()
+
+    def _apply(self, batch):
+        for stock, updates in batch.items():
+            stock.update_many(updates)
+
+
+_apply = Processor._apply
+
+
+@metrics.instrumented(Processor, "_apply")
+def _measured_apply(self, batch):
+    start = metrics.clock()
+    _apply(self, batch)
+    metrics.record("processor_batch_seconds", start)
+    metrics.counter("processor_updates_total").inc(
+        sum(len(updates) for updates in batch.values()))
+
+
+class BatchProcessor:
+    """Applies the updates from a reader that gives them in batches of
+    columns by symbol, like ParallelFileReader, to the stocks in the
+    exchange with Stock.update_columns"""
+
     def __init__(self, reader, exchange):
         self.reader = reader
         self.exchange = exchange
 
     def process(self):
-        for symbol, timestamp, price in self.reader.get_updates():
-            stock = self.exchange[symbol]
-            stock.update(timestamp, price)
+        for batches in self.reader.get_batches():
+            for symbol, (timestamps, prices) in batches.items():
+                self.exchange[symbol].update_columns(timestamps, prices)
+
+
+def shard_of(symbol, num_shards):
+    """Returns the shard that a symbol belongs to. Unlike hash, this is the
+    same in every process"""
+    return zlib.crc32(symbol.encode("utf-8")) % num_shards
+
+
+def _process_shard(connection, exchange, alerts):
+    error = None
+    try:
+        for alert in alerts:
+            alert.connect(exchange)
+    except Exception:
+        import traceback
+        error = traceback.format_exc()
+    while True:
+        batch = connection.recv()
+        if batch is None:
+            break
+        if error is not None:
+            continue
+        try:
+            for symbol, timestamp, price in batch:
+                exchange[symbol].update(timestamp, price)
+        except Exception:
+            import traceback
+            error = traceback.format_exc()
+    if error is None:
+        connection.send((True, {symbol: stock.history
+                                for symbol, stock in exchange.items()}))
+    else:
+        connection.send((False, error))
+    connection.close()
+
+
+def _stop_workers(workers, timeout=5):
+    """Makes sure that the workers have exited, after an error or once
+    their results are in. Workers still running are told to stop, and what
+    they send back is read and thrown away, so that none is left blocked
+    on a full pipe. Workers that haven't exited after timeout seconds are
+    terminated"""
+    for worker, connection in workers:
+        if worker.is_alive():
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+    for worker, connection in workers:
+        try:
+            while connection.poll(timeout):
+                connection.recv()
+        except (EOFError, OSError):
+            pass
+        worker.join(timeout)
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+        connection.close()
+
+
+class ShardedProcessor:
+    """Processes updates in a pool of worker processes, with the stocks in
+    the exchange partitioned across the workers by symbol
+
+    Each worker owns the stocks of its shard, and the alerts whose rules
+    only depend on those stocks. The alerts should not be connected to the
+    exchange beforehand, as the processor connects them where they will be
+    checked. Alerts whose rules depend on stocks in more than one shard are
+    checked in this process, which keeps its own copy of those stocks up to
+    date. Updates are sent to the workers in batches of batch_size.
+
+    Workers are forked where possible, so that the exchange and the alerts
+    don't need to be pickled. At the end, the history of every stock in
+    the exchange is replaced with the one built up by its worker"""
+
+    def __init__(self, reader, exchange, alerts=(), num_workers=None,
+                 batch_size=1000):
+        self.reader = reader
+        self.exchange = exchange
+        self.alerts = list(alerts)
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+
+    def _partition(self):
+        if isinstance(self.exchange, Exchange):
+            shard_exchanges = [Exchange(retention=self.exchange.retention)
+                               for _ in range(self.num_workers)]
+        else:
+            shard_exchanges = [{} for _ in range(self.num_workers)]
+        for symbol, stock in self.exchange.items():
+            shard_exchanges[shard_of(symbol, self.num_workers)][symbol] = stock
+        shard_alerts = [[] for _ in range(self.num_workers)]
+        coordinator_alerts = []
+        for alert in self.alerts:
+            shards = {shard_of(symbol, self.num_workers)
+                      for symbol in alert.rule.depends_on()}
+            if len(shards) == 1:
+                shard_alerts[shards.pop()].append(alert)
+            else:
+                coordinator_alerts.append(alert)
+        return shard_exchanges, shard_alerts, coordinator_alerts
+
+    def _start_workers(self, shard_exchanges, shard_alerts):
+        context = _context()
+        workers = []
+        for exchange, alerts in zip(shard_exchanges, shard_alerts):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(target=_process_shard, daemon=True,
+                                     args=(worker_connection, exchange, alerts))
+            worker.start()
+            worker_connection.close()
+            workers.append((worker, connection))
+        return workers
+
+    def process(self):
+        shard_exchanges, shard_alerts, coordinator_alerts = self._partition()
+        workers = self._start_workers(shard_exchanges, shard_alerts)
+        try:
+            coordinator_exchange = {}
+            for alert in coordinator_alerts:
+                for symbol in alert.rule.depends_on():
+                    coordinator_exchange[symbol] = self.exchange[symbol]
+                alert.connect(coordinator_exchange)
+            self._send_updates(workers, coordinator_exchange)
+            for worker, connection in workers:
+                connection.send(None)
+            results = []
+            for worker, connection in workers:
+                results.append(connection.recv())
+                worker.join()
+        finally:
+            _stop_workers(workers)
+        errors = []
+        for succeeded, result in results:
+            if succeeded:
+                for symbol, history in result.items():
+                    self.exchange[symbol].history = history
+                    self.exchange[symbol].moving_averages.clear()
+            else:
+                errors.append(result)
+        if errors:
+            raise RuntimeError("Worker failed to process updates\n" +
+                               "\n".join(errors))
+
+    def _send_updates(self, workers, coordinator_exchange):
+        shards = {}
+        batches = [[] for _ in workers]
+        for update in self.reader.get_updates():
+            symbol = update[0]
+            try:
+                shard = shards[symbol]
+            except KeyError:
+                self.exchange[symbol]
+                shard = shards[symbol] = shard_of(symbol, len(workers))
+            batch = batches[shard]
+            batch.append(update)
+            if len(batch) >= self.batch_size:
+                workers[shard][1].send(batch)
+                batches[shard] = []
+            if symbol in coordinator_exchange:
+                coordinator_exchange[symbol].update(update[1], update[2])
+        for (worker, connection), batch in zip(workers, batches):
+            if batch:
+                connection.send(batch)
+
+
+class AsyncProcessor:
+    """Processes updates on an asyncio event loop
+
+    The reader can be asynchronous, with get_updates returning an async
+    iterator like SocketReader does, or an ordinary reader. Updates are
+    read into a queue of at most queue_size updates, and the stocks are
+    updated in order from the queue. Asynchronous listeners of the stocks,
+    such as alerts with an AsyncEmailAction, run in the background while
+    the next updates are processed, with up to max_pending of them at a
+    time. When either limit is reached, the stage before it waits"""
+
+    def __init__(self, reader, exchange, queue_size=1000, max_pending=100):
+        self.reader = reader
+        self.exchange = exchange
+        self.queue_size = queue_size
+        self.max_pending = max_pending
+
+    async def _read(self, queue):
+        updates = self.reader.get_updates()
+        if hasattr(updates, "__aiter__"):
+            async for update in updates:
+                await queue.put(update)
+        else:
+            for update in updates:
+                await queue.put(update)
+        await queue.put(None)
+
+    async def process(self):
+        import asyncio
+        queue = asyncio.Queue(self.queue_size)
+        pending = asyncio.Semaphore(self.max_pending)
+        tasks = set()
+        errors = []
+
+        def finished(task):
+            tasks.discard(task)
+            pending.release()
+            if not task.cancelled() and task.exception() is not None:
+                errors.append(task.exception())
+
+        reader = asyncio.ensure_future(self._read(queue))
+        try:
+            while True:
+                update = await queue.get()
+                if update is None:
+                    break
+                if metrics.enabled:
+                    metrics.gauge("queue_depth", queue="async_processor").set(
+                        queue.qsize())
+                    metrics.gauge("pending_listeners").set(len(tasks))
+                symbol, timestamp, price = update
+                stock = self.exchange[symbol]
+                await pending.acquire()
+                task = asyncio.ensure_future(stock.update_async(timestamp, price))
+                tasks.add(task)
+                task.add_done_callback(finished)
+                if errors:
+                    raise errors[0]
+            await reader
+            if tasks:
+                await asyncio.wait(set(tasks))
+        finally:
+            # on an error, stop the reader and the listeners still running,
+            # and wait for them, so that none are left behind
+            unfinished = [reader] + list(tasks)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        if errors:
+            raise errors[0]
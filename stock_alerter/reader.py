@@ -1,4 +1,89 @@
-from datetime import datetime
+import heapq
+import io
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+from .timeseries import to_epoch_micros, from_epoch_micros
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+_FRACTION_SCALE = (None, 100000, 10000, 1000, 100, 10, 1)
+_date_cache = {}
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _is_feed_timestamp(timestamp):
+    return (21 <= len(timestamp) <= 26 and timestamp[10:20:3] == "T::."
+            and timestamp.isascii() and timestamp[20:].isdigit())
+
+
+def _parse_with_date_cache(timestamp):
+    try:
+        year, month, day = _date_cache[timestamp[:10]]
+    except KeyError:
+        date = datetime.strptime(timestamp[:10], "%Y-%m-%d")
+        year, month, day = _date_cache[timestamp[:10]] = \
+            date.year, date.month, date.day
+    return datetime(year, month, day,
+                    int(timestamp[11:13]),
+                    int(timestamp[14:16]),
+                    int(timestamp[17:19]),
+                    int(timestamp[20:]) * _FRACTION_SCALE[len(timestamp) - 20])
+
+
+def _fromisoformat_handles_feed_timestamps():
+    try:
+        return datetime.fromisoformat("2014-02-11T14:10:22.13") == \
+            datetime(2014, 2, 11, 14, 10, 22, 130000)
+    except (AttributeError, ValueError):
+        return False
+
+
+_parse_feed_timestamp = datetime.fromisoformat \
+    if _fromisoformat_handles_feed_timestamps() else _parse_with_date_cache
+
+
+def parse_timestamp(timestamp):
+    """Parses a timestamp in the feed format, like 2014-02-11T14:10:22.13
+
+    Well formed timestamps take a fast path that avoids strptime. Anything
+    else is handed to strptime, so odd inputs are parsed, or rejected,
+    exactly as before
+
+    >>> parse_timestamp("2014-02-11T14:10:22.13")
+    datetime.datetime(2014, 2, 11, 14, 10, 22, 130000)
+    """
+    if _is_feed_timestamp(timestamp):
+        try:
+            return _parse_feed_timestamp(timestamp)
+        except ValueError:
+            pass
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+
+def parse_timestamp_micros(timestamp):
+    """Like parse_timestamp, but returns the timestamp in microseconds since
+    the epoch
+
+    >>> parse_timestamp_micros("1970-01-01T00:01:02.5")
+    62500000
+    """
+    if _is_feed_timestamp(timestamp):
+        try:
+            return (_parse_feed_timestamp(timestamp) - _EPOCH) // _MICROSECOND
+        except ValueError:
+            pass
+    return to_epoch_micros(datetime.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def parse_update(line):
+    """Parses a line of the feed into a (symbol, timestamp, price) update"""
+    symbol, timestamp, price = line.split(",")
+    return (symbol, parse_timestamp(timestamp), int(price))
 
 
 class ListReader:
@@ -12,17 +97,385 @@ class ListReader:
 
 
 class FileReader:
-    """Reads a series of stock updates from a file"""
-    def __init__(self, filename):
+    """Reads a series of stock updates from a file
+
+    The file is read in chunks of buffer_size characters, so only one chunk
+    is held in memory at a time, no matter how large the file is"""
+    def __init__(self, filename, buffer_size=io.DEFAULT_BUFFER_SIZE):
+        if buffer_size <= 0:
+            raise ValueError("buffer_size should be positive")
         self.filename = filename
+        self.buffer_size = buffer_size
+
+    def _read_lines(self, fp):
+        remainder = ""
+        while True:
+            chunk = fp.read(self.buffer_size)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split("\n")
+            remainder = lines.pop()
+            yield from lines
+        yield remainder
 
     def get_updates(self):
         """Returns the next update everytime the method is called"""
         with open(self.filename, "r") as fp:
-            data = fp.read()
-            lines = data.split()
-            for line in lines:
-                symbol, timestamp, price = line.split(",")
-                yield (symbol,
-                       datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f"),
-                       int(price))
+            for line in self._read_lines(fp):
+                line = line.strip()
+                if not line:
+                    continue
+                yield parse_update(line)
+
+
+def split_file(filename, num_ranges):
+    """Splits a file into at most num_ranges (start, end) byte ranges of
+    about the same size. Each range starts at the beginning of a line, and
+    ends just after a newline or at the end of the file"""
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, "rb") as fp:
+        for i in range(1, num_ranges):
+            offset = size * i // num_ranges
+            if offset <= boundaries[-1]:
+                continue
+            fp.seek(offset - 1)
+            fp.readline()
+            if boundaries[-1] < fp.tell() < size:
+                boundaries.append(fp.tell())
+    boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _micros_column(timestamps):
+    """Returns an array of parse_timestamp_micros of each of timestamps
+
+    This is where parse_range spends most of its time, so rather than
+    checking that each timestamp is well formed up front, fromisoformat is
+    left to reject the ones it can't parse. Those with a time zone parse,
+    but can't be taken from the naive epoch. If any timestamp fails, the
+    column is parsed again one by one, to get the same result or error as
+    parse_timestamp_micros"""
+    parse = _parse_feed_timestamp
+    try:
+        return array("q", [
+            (parse(timestamp) - _EPOCH) // _MICROSECOND
+            if 21 <= len(timestamp) <= 26 and timestamp[10:20:3] == "T::."
+            else parse_timestamp_micros(timestamp)
+            for timestamp in timestamps])
+    except (TypeError, ValueError):
+        return array("q", map(parse_timestamp_micros, timestamps))
+
+
+def parse_range(filename, start, end):
+    """Parses the lines in a byte range of a file, as given by split_file,
+    into a dict of symbol to a pair of arrays: the timestamps, in
+    microseconds since the epoch, and the prices, in file order. Prices
+    that don't fit in an array are returned in a list"""
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        data = fp.read(end - start).decode("utf-8")
+    columns = {}
+    for line in data.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        symbol, timestamp, price = line.split(",")
+        try:
+            timestamps, prices = columns[symbol]
+        except KeyError:
+            timestamps, prices = columns[symbol] = [], []
+        timestamps.append(timestamp)
+        prices.append(price)
+    batches = {}
+    for symbol, (timestamps, prices) in columns.items():
+        try:
+            prices = array("q", map(int, prices))
+        except OverflowError:
+            prices = list(map(int, prices))
+        batches[symbol] = (_micros_column(timestamps), prices)
+    return batches
+
+
+def _context():
+    """Returns the multiprocessing context to start worker processes with,
+    forking them where possible so that they don't need to import and
+    unpickle what they are given. multiprocessing is imported when this
+    is first called"""
+    import multiprocessing
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def _parse_range(byte_range):
+    return parse_range(*byte_range)
+
+
+class ParallelFileReader:
+    """Parses a large file in the same format as FileReader in a pool of
+    processes
+
+    The file is split into ranges of about chunk_size bytes, on line
+    boundaries, and each range is parsed by one of num_workers processes.
+    Rather than single updates, get_batches returns the updates of each
+    range grouped by symbol, as columns that Stock.update_columns takes,
+    so no datetime is made for them. Every symbol's updates stay in file order, but
+    the order of updates across symbols is lost, so this is meant for
+    loading history, as BatchProcessor does, rather than for alerts that
+    depend on more than one stock"""
+    def __init__(self, filename, num_workers=None, chunk_size=16 * 2**20):
+        self.filename = filename
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def get_batches(self):
+        """Returns, for each range of the file in order, a dict of symbol
+        to the updates in that range, as parse_range gives them"""
+        size = os.path.getsize(self.filename)
+        num_ranges = max(self.num_workers, -(-size // self.chunk_size))
+        ranges = [(self.filename, start, end)
+                  for start, end in split_file(self.filename, num_ranges)]
+        with _context().Pool(self.num_workers) as pool:
+            yield from pool.imap(_parse_range, ranges)
+
+
+class MergedReader:
+    """Merges the updates from several readers into one stream in
+    timestamp order
+
+    Each reader should give its updates in timestamp order, like a feed
+    from a single exchange does. The readers are merged as they are read,
+    holding one update per reader, so any number of updates can be merged.
+
+    Updates with the same timestamp are ordered by tie_break, which is
+    one of
+
+    - "reader": in the order of the readers, so earlier readers come first
+    - "symbol": by symbol, and then in the order of the readers
+    - a function that takes an update and returns a sort key, and then
+      in the order of the readers
+
+    With drop_duplicates, an update with the same symbol, timestamp and
+    price as one that was already given, such as one that came in from
+    two feeds, is dropped"""
+    TIE_BREAKS = {"reader": None, "symbol": lambda update: update[0]}
+
+    def __init__(self, readers, tie_break="reader", drop_duplicates=False):
+        if not callable(tie_break):
+            if tie_break not in self.TIE_BREAKS:
+                raise ValueError("Unknown tie_break {0!r}".format(tie_break))
+            tie_break = self.TIE_BREAKS[tie_break]
+        self.readers = list(readers)
+        self.tie_break = tie_break
+        self.drop_duplicates = drop_duplicates
+
+    def _merged(self):
+        tie_break = self.tie_break
+        if tie_break is None:
+            key = lambda update: update[1]
+        else:
+            key = lambda update: (update[1], tie_break(update))
+        return heapq.merge(*[reader.get_updates() for reader in self.readers],
+                           key=key)
+
+    def get_updates(self):
+        """Returns the next update everytime the method is called"""
+        if not self.drop_duplicates:
+            yield from self._merged()
+            return
+        timestamp = None
+        seen = set()
+        for update in self._merged():
+            if update[1] != timestamp:
+                timestamp = update[1]
+                seen.clear()
+            if update not in seen:
+                seen.add(update)
+                yield update
+
+
+class SocketReader:
+    """Reads a series of stock updates, one per line in the same format as
+    FileReader, from a TCP connection
+
+    This is an asynchronous reader: get_updates is an async generator, to
+    be used with async for, as AsyncProcessor does"""
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    async def get_updates(self):
+        """Returns the next update as it arrives, until the connection is
+        closed"""
+        import asyncio
+        stream, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            async for line in stream:
+                line = line.decode("utf-8").strip()
+                if line:
+                    yield parse_update(line)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+TICK_FILE_MAGIC = b"TICK"
+TICK_FILE_VERSION = 1
+_TICK_FILE_HEADER = struct.Struct("<4sBBHIQ")
+_BYTE_ORDERS = {"little": 0, "big": 1}
+
+
+def _align(offset, size=8):
+    return (offset + size - 1) // size * size
+
+
+def _pack_ticks(updates):
+    """Returns the parts of a tick file holding the updates, in order"""
+    symbol_ids = {}
+    ids, timestamps, prices = array("I"), array("q"), array("q")
+    for symbol, timestamp, price in updates:
+        ids.append(symbol_ids.setdefault(symbol, len(symbol_ids)))
+        timestamps.append(to_epoch_micros(timestamp))
+        prices.append(price)
+    symbol_table = b"".join(
+        struct.pack("<H", len(encoded)) + encoded
+        for encoded in (symbol.encode("utf-8") for symbol in symbol_ids))
+    header = _TICK_FILE_HEADER.pack(
+        TICK_FILE_MAGIC, TICK_FILE_VERSION, _BYTE_ORDERS[sys.byteorder],
+        0, len(symbol_ids), len(timestamps))
+    offset = len(header) + len(symbol_table)
+    return [header + symbol_table + bytes(_align(offset) - offset),
+            timestamps, prices, ids]
+
+
+def write_tick_file(filename, updates):
+    """Writes updates to a binary tick file that MmapReader can replay
+
+    The file has a header, a table of symbols, and then three columns, one
+    entry per update: the timestamp in microseconds since the epoch, the
+    price and the index of the symbol in the symbol table. The columns are
+    stored in native byte order, so that they can be used in place. To
+    convert a csv file, pass in the updates from a FileReader, as in
+    write_tick_file("updates.tick", FileReader("updates.csv").get_updates())
+    """
+    header, *columns = _pack_ticks(updates)
+    with open(filename, "wb") as fp:
+        fp.write(header)
+        for column in columns:
+            column.tofile(fp)
+
+
+class MmapReader:
+    """Reads a series of stock updates from a tick file written by
+    write_tick_file
+
+    The file is memory mapped and its columns are read in place, so there
+    is no parsing, and processes replaying the same file share its pages"""
+    def __init__(self, filename):
+        self.filename = filename
+
+    def _map_columns(self, buffer):
+        if len(buffer) < _TICK_FILE_HEADER.size:
+            raise ValueError("{0} is not a tick file".format(self.filename))
+        magic, version, byte_order, _, symbol_count, tick_count = \
+            _TICK_FILE_HEADER.unpack_from(buffer)
+        if magic != TICK_FILE_MAGIC or version != TICK_FILE_VERSION:
+            raise ValueError("{0} is not a tick file".format(self.filename))
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError("{0} was written on a machine with a different "
+                             "byte order".format(self.filename))
+        symbols = []
+        offset = _TICK_FILE_HEADER.size
+        try:
+            for _ in range(symbol_count):
+                length, = struct.unpack_from("<H", buffer, offset)
+                offset += 2
+                symbols.append(
+                    bytes(buffer[offset:offset + length]).decode("utf-8"))
+                offset += length
+        except struct.error:
+            raise ValueError("{0} is truncated".format(self.filename))
+        offset = _align(offset)
+        if len(buffer) < offset + 20 * tick_count:
+            raise ValueError("{0} is truncated".format(self.filename))
+        views = [memoryview(buffer)]
+        try:
+            for size, code in ((8, "q"), (8, "q"), (4, "I")):
+                views.append(views[0][offset:offset + size * tick_count]
+                             .cast(code))
+                offset += size * tick_count
+        except BaseException:
+            for view in reversed(views):
+                view.release()
+            raise
+        return symbols, views
+
+    def _replay(self, buffer):
+        symbols, views = self._map_columns(buffer)
+        _, timestamps, prices, ids = views
+        try:
+            for symbol_id, timestamp, price in zip(ids, timestamps, prices):
+                yield (symbols[symbol_id], from_epoch_micros(timestamp), price)
+        finally:
+            for view in reversed(views):
+                view.release()
+
+    def get_updates(self):
+        """Returns the next update everytime the method is called"""
+        with open(self.filename, "rb") as fp, \
+                mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from self._replay(buffer)
+
+
+class SharedTicks:
+    """Updates kept in a block of shared memory, laid out like a tick file,
+    so that other processes can replay them without parsing or copying
+    them. The updates are read once, when the SharedTicks is created
+
+    The shared memory stays until close is called, or the with block that
+    the SharedTicks is used in ends. Replay the updates with a
+    SharedMemoryReader for name, in this or any other process"""
+    def __init__(self, updates):
+        from multiprocessing import shared_memory
+        header, *columns = _pack_ticks(updates)
+        parts = [header] + [memoryview(column).cast("B") for column in columns]
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=max(1, sum(len(part) for part in parts)))
+        self.name = self.memory.name
+        offset = 0
+        for part in parts:
+            self.memory.buf[offset:offset + len(part)] = part
+            offset += len(part)
+
+    def reader(self):
+        return SharedMemoryReader(self.name)
+
+    def close(self):
+        """Frees the shared memory"""
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SharedMemoryReader(MmapReader):
+    """Reads a series of stock updates from the shared memory of a
+    SharedTicks, by its name"""
+    def __init__(self, name):
+        self.filename = self.name = name
+
+    def get_updates(self):
+        """Returns the next update everytime the method is called"""
+        from multiprocessing import shared_memory
+        memory = shared_memory.SharedMemory(self.name)
+        try:
+            yield from self._replay(memory.buf)
+        finally:
+            memory.close()
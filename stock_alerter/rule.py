@@ -1,27 +1,139 @@
+import operator
+
+from .expression import ExpressionCompiler, parse, most_history
+
+
 class PriceRule:
     """PriceRule is a rule that triggers when a stock price satisfies a
     condition (usually greater, equal or lesser than a given value)"""
+    __slots__ = ("symbol", "condition")
 
     def __init__(self, symbol, condition):
         self.symbol = symbol
         self.condition = condition
 
     def matches(self, exchange):
-        try:
-            stock = exchange[self.symbol]
-        except KeyError:
+        stock = exchange.get(self.symbol)
+        if stock is None:
             return False
         return self.condition(stock) if stock.price else False
 
     def depends_on(self):
         return {self.symbol}
 
+    def history_needed(self):
+        """Returns how many updates, and how many days of closes, of the
+        history of a stock the rule needs, as a pair. An arbitrary condition
+        could look at any of the history, so this returns None, meaning all
+        of it, unless a subclass knows better"""
+        return None
+
+
+class PriceThresholdRule(PriceRule):
+    """PriceThresholdRule is a PriceRule whose condition compares the stock
+    price against a fixed threshold, with one of >, >=, < or <=. Unlike an
+    arbitrary condition, the threshold can be indexed"""
+    COMPARISONS = {">": operator.gt, ">=": operator.ge,
+                   "<": operator.lt, "<=": operator.le}
+    __slots__ = ("comparison", "threshold")
+
+    def __init__(self, symbol, comparison, threshold):
+        try:
+            compare = self.COMPARISONS[comparison]
+        except KeyError:
+            raise ValueError("comparison should be one of >, >=, < or <=")
+        super().__init__(symbol, lambda stock: compare(stock.price, threshold))
+        self.comparison = comparison
+        self.threshold = threshold
+
+    def matches_with_margin(self, exchange, margin):
+        """Like matches, but with the threshold moved by margin in favour
+        of matching, so > 10 with a margin of 1 matches prices above 9"""
+        if self.comparison in (">", ">="):
+            threshold = self.threshold - margin
+        else:
+            threshold = self.threshold + margin
+        return PriceThresholdRule(self.symbol, self.comparison,
+                                  threshold).matches(exchange)
+
+    def history_needed(self):
+        return 1, 0
+
+
+class TrendRule(PriceRule):
+    """TrendRule is a PriceRule that triggers when the last num_ticks prices
+    of a stock have been strictly increasing, or strictly decreasing. The
+    stock keeps track of its trends as it is updated, so checking a long
+    trend is as quick as checking a short one"""
+    DIRECTIONS = ("increasing", "decreasing")
+    __slots__ = ("direction", "num_ticks")
+
+    def __init__(self, symbol, direction, num_ticks=3):
+        if direction not in self.DIRECTIONS:
+            raise ValueError("direction should be increasing or decreasing")
+        if direction == "increasing":
+            condition = lambda stock: stock.is_increasing_trend(num_ticks)
+        else:
+            condition = lambda stock: stock.is_decreasing_trend(num_ticks)
+        super().__init__(symbol, condition)
+        self.direction = direction
+        self.num_ticks = num_ticks
+
+    def history_needed(self):
+        return self.num_ticks, 0
+
+
+class DailyTrendRule(PriceRule):
+    """DailyTrendRule is like TrendRule, but over the closing prices of the
+    last num_days days with updates"""
+    __slots__ = ("direction", "num_days")
+
+    def __init__(self, symbol, direction, num_days):
+        if direction not in TrendRule.DIRECTIONS:
+            raise ValueError("direction should be increasing or decreasing")
+        if direction == "increasing":
+            condition = lambda stock: stock.is_increasing_daily_trend(num_days)
+        else:
+            condition = lambda stock: stock.is_decreasing_daily_trend(num_days)
+        super().__init__(symbol, condition)
+        self.direction = direction
+        self.num_days = num_days
+
+    def history_needed(self):
+        return 1, self.num_days
+
 
 class AndRule:
-    def __init__(self, *args):
+    """AndRule matches when all its component rules match
+
+    With cache_results, the result of each component rule is remembered
+    along with the revision of the history of the stocks it depends on.
+    Only the rules whose stocks have been updated since are evaluated
+    again"""
+    __slots__ = ("rules", "cache_results", "cached_results")
+
+    def __init__(self, *args, cache_results=False):
         self.rules = args
+        self.cache_results = cache_results
+        self.cached_results = [(None, None)] * len(args)
+
+    def _revisions(self, rule, exchange):
+        return tuple(exchange[symbol].history.revision
+                     if symbol in exchange else None
+                     for symbol in sorted(rule.depends_on()))
+
+    def _cached_matches(self, index, rule, exchange):
+        revisions = (id(exchange), self._revisions(rule, exchange))
+        cached_revisions, result = self.cached_results[index]
+        if cached_revisions != revisions:
+            result = rule.matches(exchange)
+            self.cached_results[index] = (revisions, result)
+        return result
 
     def matches(self, exchange):
+        if self.cache_results:
+            return all([self._cached_matches(index, rule, exchange)
+                        for index, rule in enumerate(self.rules)])
         return all([rule.matches(exchange) for rule in self.rules])
 
     def depends_on(self):
@@ -29,3 +141,34 @@ class AndRule:
         for rule in self.rules:
             depends = depends.union(rule.depends_on())
         return depends
+
+    def history_needed(self):
+        return most_history(rule.history_needed() for rule in self.rules)
+
+
+class ExpressionRule:
+    """ExpressionRule matches when a condition written as an expression is
+    true. The condition can be an expression or its text form, such as
+    'price("GOOG") > 10 and moving_average("GOOG", 5) > 8'
+
+    Rules that share a compiler share the compiled forms of identical
+    sub-expressions, and the values they evaluate to. By default all rules
+    share one compiler"""
+    default_compiler = ExpressionCompiler()
+    __slots__ = ("condition", "compiler", "_evaluate")
+
+    def __init__(self, condition, compiler=None):
+        if isinstance(condition, str):
+            condition = parse(condition)
+        self.condition = condition
+        self.compiler = compiler if compiler is not None else self.default_compiler
+        self._evaluate = self.compiler.compile(condition)
+
+    def matches(self, exchange):
+        return bool(self._evaluate(exchange))
+
+    def depends_on(self):
+        return self.condition.depends_on()
+
+    def history_needed(self):
+        return self.condition.history_needed()
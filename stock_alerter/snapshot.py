@@ -0,0 +1,198 @@
+"""Snapshots of an exchange, so that a restarted process doesn't have to
+replay every update to rebuild its stocks
+
+save_snapshot writes the history of every stock, and the state of the
+alerts, to a single binary file. load_snapshot maps the file into memory
+and reads the history of each stock only when it is first used. Updates
+made after the snapshot are then replayed with a NewerUpdatesReader,
+which skips the updates the snapshot already has
+
+    save_snapshot("exchange.snapshot", exchange, alerts)
+    ...
+    exchange = load_snapshot("exchange.snapshot", alerts=alerts)
+    reader = NewerUpdatesReader(FileReader("updates.csv"), exchange)
+    Processor(reader, exchange).process()
+
+The index of a snapshot is pickled, so only load snapshots that you wrote
+"""
+import mmap
+import os
+import pickle
+import struct
+import sys
+from array import array
+
+from .reader import _BYTE_ORDERS, _align
+from .stock import Stock
+from .timeseries import TimeSeries, to_epoch_micros, from_epoch_micros
+
+SNAPSHOT_MAGIC = b"SNAP"
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_HEADER = struct.Struct("<4sBBHQ")
+_COLUMNS = ("timestamps", "values", "close_days", "close_timestamps",
+            "close_values")
+_SCALARS = ("revision", "close_revision", "dropped_ticks_until",
+            "dropped_closes_until", "rising_ticks", "falling_ticks",
+            "rising_closes", "falling_closes", "previous_close_runs")
+
+
+def _encode_column(column):
+    """Returns the kind of a column, and its contents as bytes. Integer and
+    float columns are stored as they are in memory, anything else is
+    pickled"""
+    if isinstance(column, array):
+        return column.typecode, column.tobytes()
+    if all(type(value) is float for value in column):
+        return "d", array("d", column).tobytes()
+    return "p", pickle.dumps(column, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_column(kind, data):
+    if kind == "p":
+        return pickle.loads(data)
+    column = array(kind)
+    column.frombytes(data)
+    return column if kind == "q" else list(column)
+
+
+class LazyTimeSeries(TimeSeries):
+    """A TimeSeries restored from a snapshot
+
+    Its columns are only read from the snapshot the first time any of them
+    is used, after which it behaves like any other TimeSeries"""
+
+    def __init__(self, load_columns, retention=None):
+        super().__init__(retention)
+        for name in _COLUMNS:
+            delattr(self, name)
+        self._load_columns = load_columns
+
+    def __getattr__(self, name):
+        if name not in _COLUMNS or "_load_columns" not in self.__dict__:
+            raise AttributeError(name)
+        self.__dict__.update(self.__dict__.pop("_load_columns")())
+        return getattr(self, name)
+
+    def __getstate__(self):
+        self.timestamps
+        return self.__dict__
+
+
+class _SnapshotFile:
+    def __init__(self, filename):
+        with open(filename, "rb") as fp:
+            self.buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, byte_order, _, index_size = \
+            _SNAPSHOT_HEADER.unpack_from(self.buffer)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("{0} is not a snapshot".format(filename))
+        if byte_order != _BYTE_ORDERS[sys.byteorder]:
+            raise ValueError("{0} was written on a machine with a different "
+                             "byte order".format(filename))
+        start = _SNAPSHOT_HEADER.size
+        self.index = pickle.loads(self.buffer[start:start + index_size])
+        self.data_offset = _align(start + index_size)
+
+    def column_loader(self, columns):
+        def load_columns():
+            loaded = {}
+            for name, (kind, offset, size) in columns.items():
+                offset += self.data_offset
+                with memoryview(self.buffer)[offset:offset + size] as data:
+                    loaded[name] = _decode_column(kind, data)
+            return loaded
+        return load_columns
+
+
+def save_snapshot(filename, exchange, alerts=()):
+    """Writes the history of every stock in the exchange, and the state of
+    the given alerts, to a snapshot file
+
+    The snapshot is written to a temporary file which then replaces the
+    file, so a crash while saving leaves the previous snapshot intact"""
+    stocks = {}
+    blocks = []
+    offset = 0
+    for symbol, stock in exchange.items():
+        history = stock.history
+        columns = {}
+        for name in _COLUMNS:
+            kind, data = _encode_column(getattr(history, name))
+            columns[name] = (kind, offset, len(data))
+            blocks.append(data)
+            blocks.append(bytes(_align(len(data)) - len(data)))
+            offset += _align(len(data))
+        stocks[symbol] = {
+            "columns": columns,
+            "scalars": {name: getattr(history, name) for name in _SCALARS}}
+    alert_states = [(alert.description, alert.armed,
+                     None if alert.triggered_at is None
+                     else to_epoch_micros(alert.triggered_at))
+                    for alert in alerts]
+    index = pickle.dumps({"stocks": stocks, "alerts": alert_states},
+                         pickle.HIGHEST_PROTOCOL)
+    header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                   _BYTE_ORDERS[sys.byteorder], 0, len(index))
+    temporary = filename + ".tmp"
+    with open(temporary, "wb") as fp:
+        fp.write(header)
+        fp.write(index)
+        fp.write(bytes(_align(len(header) + len(index)) -
+                       len(header) - len(index)))
+        for block in blocks:
+            fp.write(block)
+    os.replace(temporary, filename)
+
+
+def load_snapshot(filename, exchange=None, alerts=()):
+    """Restores the stocks and alert states saved by save_snapshot, and
+    returns the exchange
+
+    Stocks already in the given exchange get the history from the snapshot
+    and keep their listeners and retention policy, other stocks in the
+    snapshot are added to it. The history of each stock is read from the
+    file when it is first used. The alerts should be the same ones, in the
+    same order, as were saved"""
+    snapshot = _SnapshotFile(filename)
+    if exchange is None:
+        exchange = {}
+    alert_states = snapshot.index["alerts"]
+    if alerts and [alert.description for alert in alerts] != \
+            [description for description, _, _ in alert_states]:
+        raise ValueError("The alerts don't match the ones in the snapshot")
+    for symbol, saved in snapshot.index["stocks"].items():
+        if symbol not in exchange:
+            exchange[symbol] = Stock(symbol)
+        stock = exchange[symbol]
+        history = LazyTimeSeries(snapshot.column_loader(saved["columns"]),
+                                 stock.history.retention)
+        history.__dict__.update(saved["scalars"])
+        stock.history = history
+        stock.moving_averages.clear()
+    for alert, (_, armed, triggered_at) in zip(alerts, alert_states):
+        alert.armed = armed
+        alert.triggered_at = None if triggered_at is None \
+            else from_epoch_micros(triggered_at)
+    return exchange
+
+
+class NewerUpdatesReader:
+    """Passes on only the updates from a reader that are newer than the
+    latest update each stock in the exchange already had when reading
+    started, so that updates made after a snapshot can be replayed from the
+    same feed. Every update is compared with that timestamp, so updates
+    that come out of order are only passed on if they are newer than it"""
+    def __init__(self, reader, exchange):
+        self.reader = reader
+        self.exchange = exchange
+
+    def get_updates(self):
+        latest = {}
+        for symbol, timestamp, price in self.reader.get_updates():
+            if symbol not in latest:
+                stock = self.exchange.get(symbol)
+                latest[symbol] = stock.history.timestamps[-1] \
+                    if stock is not None and len(stock.history) else None
+            if latest[symbol] is None or \
+                    to_epoch_micros(timestamp) > latest[symbol]:
+                yield symbol, timestamp, price
@@ -1,8 +1,11 @@
 from datetime import timedelta
 from enum import Enum
 
+from . import metrics
 from .event import Event
 from .timeseries import TimeSeries, MovingAverage, NotEnoughDataException
+from .timeseries import to_epoch_day, from_epoch_micros
+from .timeseries import moving_average_list, moving_average_array
 
 
 class StockSignal(Enum):
@@ -14,11 +17,61 @@ class StockSignal(Enum):
 class Stock:
     LONG_TERM_TIMESPAN = 10
     SHORT_TERM_TIMESPAN = 5
+    __slots__ = ("symbol", "retention", "_history", "_updated", "_ticked",
+                 "_moving_averages")
 
-    def __init__(self, symbol):
+    def __init__(self, symbol, retention=None):
+        """Creates a stock. A RetentionPolicy can be given to limit the
+        history that is kept, for example
+        RetentionPolicy.for_timespan(Stock.LONG_TERM_TIMESPAN) keeps what
+        the price, trend and crossover signal need, and
+        RetentionPolicy.for_rules(rules, Stock.LONG_TERM_TIMESPAN) also
+        keeps what the rules need
+
+        The history, the events and the moving averages are only created
+        when they are first used, so that stocks that are never updated,
+        or never listened to, stay small"""
         self.symbol = symbol
-        self.history = TimeSeries()
-        self.updated = Event()
+        self.retention = retention
+        self._history = None
+        self._updated = None
+        self._ticked = None
+        self._moving_averages = None
+
+    @property
+    def history(self):
+        """The TimeSeries of the prices of the stock"""
+        if self._history is None:
+            self._history = TimeSeries(self.retention)
+        return self._history
+
+    @history.setter
+    def history(self, history):
+        self._history = history
+
+    @property
+    def moving_averages(self):
+        """The MovingAverage of the stock for each timespan that has been
+        asked for, by timespan"""
+        if self._moving_averages is None:
+            self._moving_averages = {}
+        return self._moving_averages
+
+    @property
+    def updated(self):
+        """Event fired with the stock after every update, or batch of
+        updates"""
+        if self._updated is None:
+            self._updated = Event()
+        return self._updated
+
+    @property
+    def ticked(self):
+        """Event fired with the stock, timestamp and price of every
+        update"""
+        if self._ticked is None:
+            self._ticked = Event()
+        return self._ticked
 
     @property
     def price(self):
@@ -50,10 +103,9 @@ class Stock:
         >>> print(stock.price)
         None
         """
-        try:
-            return self.history[-1].value
-        except IndexError:
+        if self._history is None:
             return None
+        return self._history.last_value
 
     def update(self, timestamp, price):
         """Updates the stock with the price at the given timestamp
@@ -72,29 +124,122 @@ class Stock:
         if price < 0:
             raise ValueError("price should not be negative")
         self.history.update(timestamp, price)
-        self.updated.fire(self)
+        if self._ticked is not None:
+            self._ticked.fire(self, timestamp, price)
+        if self._updated is not None:
+            self._updated.fire(self)
+
+    def update_many(self, updates):
+        """Updates the stock with a batch of (timestamp, price) pairs
 
-    def is_increasing_trend(self):
-        """Returns True if the past three values have been strictly increasing
+        The updated event is fired once, after the whole batch has been
+        added. Listeners that need to see every update can connect to the
+        ticked event instead, which is fired with the stock, timestamp and
+        price of each update, for single updates as well as batches
 
-        Returns False if there have been less than three updates so far
+        >>> stock.update_many([(datetime(2014, 10, 2), 10),
+        ...                    (datetime(2014, 10, 3), 12)])
+        >>> stock.price
+        12
+
+        The method raises a ValueError exception if any price is negative,
+        in which case none of the updates are made
+
+        >>> stock.update_many([(datetime(2014, 10, 4), 10),
+        ...                    (datetime(2014, 10, 5), -1)])
+        Traceback (most recent call last):
+            ...
+        ValueError: price should not be negative
+        """
+        updates = list(updates)
+        if any(price < 0 for _, price in updates):
+            raise ValueError("price should not be negative")
+        self.history.update_many(updates)
+        if self._ticked is not None:
+            for timestamp, price in updates:
+                self._ticked.fire(self, timestamp, price)
+        if self._updated is not None:
+            self._updated.fire(self)
+
+    def update_columns(self, timestamps, prices):
+        """Like update_many, but with the timestamps, in microseconds since
+        the epoch, and the prices in two columns, such as the arrays that
+        ParallelFileReader gives. No datetime is made for them, unless the
+        ticked event has listeners"""
+        if prices and min(prices) < 0:
+            raise ValueError("price should not be negative")
+        self.history.update_columns(timestamps, prices)
+        if self._ticked is not None:
+            for micros, price in zip(timestamps, prices):
+                self._ticked.fire(self, from_epoch_micros(micros), price)
+        if self._updated is not None:
+            self._updated.fire(self)
+
+    async def update_async(self, timestamp, price):
+        """Like update, but waits for any listeners that return awaitables,
+        such as alerts with asynchronous actions"""
+        if price < 0:
+            raise ValueError("price should not be negative")
+        self.history.update(timestamp, price)
+        if self._ticked is not None:
+            self._ticked.fire(self, timestamp, price)
+        if self._updated is not None:
+            await self._updated.fire_async(self)
+
+    def is_increasing_trend(self, num_ticks=3):
+        """Returns True if the past num_ticks values have been strictly
+        increasing
+
+        Returns False if there have been less than num_ticks updates so far
 
         >>> stock.is_increasing_trend()
         False
         """
-        try:
-            return self.history[-3].value < self.history[-2].value < self.history[-1].value
-        except IndexError:
+        if self._history is None:
+            return False
+        return self._history.rising_ticks >= num_ticks - 1
+
+    def is_decreasing_trend(self, num_ticks=3):
+        """Returns True if the past num_ticks values have been strictly
+        decreasing"""
+        if self._history is None:
+            return False
+        return self._history.falling_ticks >= num_ticks - 1
+
+    def is_increasing_daily_trend(self, num_days):
+        """Returns True if the closes of the past num_days days with updates
+        have been strictly increasing"""
+        if self._history is None:
             return False
+        return self._history.rising_closes >= num_days - 1
+
+    def is_decreasing_daily_trend(self, num_days):
+        """Returns True if the closes of the past num_days days with updates
+        have been strictly decreasing"""
+        if self._history is None:
+            return False
+        return self._history.falling_closes >= num_days - 1
 
     def _is_crossover_below_to_above(self, on_date, ma, reference_ma):
         prev_date = on_date - timedelta(1)
         return (ma.value_on(prev_date) < reference_ma.value_on(prev_date)
                 and ma.value_on(on_date) > reference_ma.value_on(on_date))
 
+    def moving_average(self, timespan):
+        """Returns the MovingAverage of the stock history over timespan days
+
+        The same object is returned every time, so that it can reuse the
+        values it has already calculated"""
+        try:
+            return self.moving_averages[timespan]
+        except KeyError:
+            moving_average = MovingAverage(self.history, timespan)
+            self.moving_averages[timespan] = moving_average
+            return moving_average
+
     def get_crossover_signal(self, on_date):
-        long_term_ma = MovingAverage(self.history, self.LONG_TERM_TIMESPAN)
-        short_term_ma = MovingAverage(self.history, self.SHORT_TERM_TIMESPAN)
+        long_term_ma = self.moving_average(self.LONG_TERM_TIMESPAN)
+        short_term_ma = self.moving_average(self.SHORT_TERM_TIMESPAN)
         try:
             if self._is_crossover_below_to_above(on_date, short_term_ma, long_term_ma):
                     return StockSignal.buy
@@ -105,3 +250,76 @@ class Stock:
             return StockSignal.neutral
 
         return StockSignal.neutral
+
+    def get_crossover_signals(self, start_date, end_date,
+                              short_term_timespan=None,
+                              long_term_timespan=None):
+        """Returns a list of (date, signal) pairs, one for each day from
+        start_date to end_date, with the same signals as calling
+        get_crossover_signal on each of those days
+
+        The daily closes and both moving averages are calculated once for
+        the whole range, with numpy if it is available. Timespans other
+        than SHORT_TERM_TIMESPAN and LONG_TERM_TIMESPAN can be given, to try
+        them out"""
+        if short_term_timespan is None:
+            short_term_timespan = self.SHORT_TERM_TIMESPAN
+        if long_term_timespan is None:
+            long_term_timespan = self.LONG_TERM_TIMESPAN
+        start_day = to_epoch_day(start_date)
+        num_days = to_epoch_day(end_date) - start_day + 1
+        if num_days <= 0:
+            return []
+        dates = [start_date + timedelta(i) for i in range(num_days)]
+        timespan = max(short_term_timespan, long_term_timespan)
+        closes = self.history.get_daily_closes(start_day - timespan,
+                                               start_day + num_days - 1)
+        short_term_ma = moving_average_array(closes, short_term_timespan)
+        long_term_ma = moving_average_array(closes, long_term_timespan)
+        if short_term_ma is not None and long_term_ma is not None:
+            short_term_ma = short_term_ma[timespan - 1:]
+            long_term_ma = long_term_ma[timespan - 1:]
+            buy = ((short_term_ma[:-1] < long_term_ma[:-1]) &
+                   (short_term_ma[1:] > long_term_ma[1:]))
+            sell = ((long_term_ma[:-1] < short_term_ma[:-1]) &
+                    (long_term_ma[1:] > short_term_ma[1:]))
+            signals = [StockSignal.buy if is_buy else
+                       StockSignal.sell if is_sell else StockSignal.neutral
+                       for is_buy, is_sell in zip(buy.tolist(), sell.tolist())]
+            return list(zip(dates, signals))
+
+        short_term_ma = moving_average_list(
+            closes, short_term_timespan)[timespan - 1:]
+        long_term_ma = moving_average_list(
+            closes, long_term_timespan)[timespan - 1:]
+        signals = []
+        for i in range(num_days):
+            prev_short, prev_long = short_term_ma[i], long_term_ma[i]
+            short, long = short_term_ma[i + 1], long_term_ma[i + 1]
+            if prev_short is None or prev_long is None:
+                signals.append(StockSignal.neutral)
+            elif prev_short < prev_long and short > long:
+                signals.append(StockSignal.buy)
+            elif prev_long < prev_short and long > short:
+                signals.append(StockSignal.sell)
+            else:
+                signals.append(StockSignal.neutral)
+        return list(zip(dates, signals))
+
+
+_update = Stock.update
+
+
+@metrics.instrumented(Stock, "update")
+def _measured_update(self, timestamp, price):
+    start = metrics.clock()
+    _update(self, timestamp, price)
+    metrics.record("stock_update_seconds", start)
+
+
+def get_crossover_signals(exchange, start_date, end_date):
+    """Returns the crossover signals of every stock in the exchange for each
+    day from start_date to end_date, as a dict of symbol to the list that
+    Stock.get_crossover_signals returns"""
+    return {symbol: stock.get_crossover_signals(start_date, end_date)
+            for symbol, stock in exchange.items()}
@@ -1,8 +1,12 @@
+import asyncio
 import smtplib
+import socketserver
+import threading
 import unittest
 from unittest import mock
 
-from ..action import PrintAction, EmailAction
+from ..action import PrintAction, EmailAction, EmailDelivery, QueuedEmailAction
+from ..action import AsyncEmailAction
 
 
 class MessageMatcher:
@@ -68,3 +72,139 @@ class EmailActionTest(unittest.TestCase):
         self.action.execute("MSFT has crossed $10 price level")
         self.mock_smtp.send_message.assert_called_with(
             MessageMatcher(expected_message))
+
+
+class AsyncEmailActionTest(unittest.TestCase):
+    @mock.patch("smtplib.SMTP")
+    def test_email_is_sent_when_action_is_awaited(self, mock_smtp_class):
+        action = AsyncEmailAction(to="siddharta@silverstripesoftware.com")
+        asyncio.run(action.execute("MSFT has crossed $10 price level"))
+        mock_smtp_class.assert_called_with("email.stocks.com")
+        self.assertTrue(mock_smtp_class.return_value.send_message.called)
+
+
+class EmailDeliveryTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch("smtplib.SMTP")
+        self.addCleanup(patcher.stop)
+        self.mock_smtp_class = patcher.start()
+        self.mock_smtp = self.mock_smtp_class.return_value
+
+    def given_delivery(self, **kwargs):
+        delivery = EmailDelivery(**kwargs)
+        self.addCleanup(delivery.close)
+        return delivery
+
+    def test_connection_is_reused_between_emails(self):
+        delivery = self.given_delivery()
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        delivery.flush()
+        delivery.send("siddharta@silverstripesoftware.com", "AAPL > $10")
+        delivery.flush()
+        self.assertEqual(1, self.mock_smtp_class.call_count)
+        self.assertEqual(2, self.mock_smtp.send_message.call_count)
+
+    def test_connection_is_reopened_if_send_fails(self):
+        self.mock_smtp.send_message.side_effect = [
+            smtplib.SMTPServerDisconnected(), None]
+        delivery = self.given_delivery()
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        delivery.flush()
+        self.assertEqual(2, self.mock_smtp_class.call_count)
+        self.assertEqual(1, delivery.sent)
+
+    def test_email_is_counted_as_failed_if_it_cant_be_sent(self):
+        self.mock_smtp.send_message.side_effect = smtplib.SMTPServerDisconnected()
+        delivery = self.given_delivery()
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        delivery.flush()
+        self.assertEqual(1, delivery.failed)
+
+    def test_unexpected_errors_are_counted_and_the_worker_carries_on(self):
+        self.mock_smtp.send_message.side_effect = [
+            UnicodeEncodeError("ascii", "\u20ac", 0, 1, "bad character"),
+            None]
+        delivery = self.given_delivery()
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > \u20ac10")
+        delivery.flush()
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        delivery.flush()
+        self.assertEqual(1, delivery.failed)
+        self.assertEqual(1, delivery.sent)
+
+    def test_emails_within_the_batch_window_are_sent_as_a_digest(self):
+        delivery = self.given_delivery(batch_window=0.5)
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        delivery.send("siddharta@silverstripesoftware.com", "AAPL > $10")
+        delivery.flush()
+        call_args, _ = self.mock_smtp.send_message.call_args
+        self.assertEqual("2 New Stock Alerts", call_args[0]["Subject"])
+        self.assertEqual("GOOG > $10\nAAPL > $10", call_args[0]._payload)
+
+    def test_emails_are_dropped_when_the_queue_is_full(self):
+        sending = threading.Event()
+        release = threading.Event()
+
+        def block(message):
+            sending.set()
+            release.wait()
+        self.mock_smtp.send_message.side_effect = block
+        delivery = self.given_delivery(max_queue_size=1)
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        sending.wait()
+        self.assertTrue(delivery.send("siddharta@silverstripesoftware.com", "AAPL > $10"))
+        self.assertFalse(delivery.send("siddharta@silverstripesoftware.com", "MSFT > $10"))
+        release.set()
+        self.assertEqual(1, delivery.dropped)
+
+    def test_queued_email_action_sends_through_the_delivery(self):
+        delivery = mock.MagicMock()
+        action = QueuedEmailAction("siddharta@silverstripesoftware.com", delivery)
+        action.execute("GOOG > $10")
+        delivery.send.assert_called_with("siddharta@silverstripesoftware.com",
+                                         "GOOG > $10")
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of an SMTP server to accept mail from smtplib"""
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost")
+        for line in self.rfile:
+            command = line.decode("ascii").strip().upper()
+            if command == "DATA":
+                self.reply("354 end with .")
+                lines = []
+                for data in self.rfile:
+                    if data.rstrip(b"\r\n") == b".":
+                        break
+                    lines.append(data)
+                self.server.messages.append(b"".join(lines))
+                self.reply("250 ok")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class EmailDeliveryServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(("localhost", 0),
+                                                      SMTPHandler)
+        self.server.messages = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_emails_are_delivered_to_the_server(self):
+        delivery = EmailDelivery("localhost", self.server.server_address[1])
+        delivery.send("siddharta@silverstripesoftware.com", "GOOG > $10")
+        delivery.send("siddharta@silverstripesoftware.com", "AAPL > $10")
+        delivery.close()
+        self.assertEqual(2, delivery.sent)
+        self.assertEqual(2, len(self.server.messages))
+        self.assertIn(b"AAPL > $10", self.server.messages[1])
@@ -1,9 +1,10 @@
+import random
 import unittest
 from unittest import mock
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from ..alert import Alert
-from ..rule import PriceRule
+from ..alert import Alert, AlertEngine, BulkAlertEvaluator
+from ..rule import PriceRule, PriceThresholdRule, AndRule
 from ..stock import Stock
 from ..event import Event
 
@@ -50,3 +51,145 @@ class AlertTest(unittest.TestCase):
                           mock.call.rule.matches(exchange),
                           mock.call.action.execute("sample alert")],
                          main_mock.mock_calls)
+
+
+class EdgeTriggeredAlertTest(unittest.TestCase):
+    def setUp(self):
+        self.goog = Stock("GOOG")
+        self.action = mock.MagicMock()
+
+    def given_alert(self, **kwargs):
+        alert = Alert("GOOG > 10", PriceThresholdRule("GOOG", ">", 10),
+                      self.action, edge_triggered=True, **kwargs)
+        alert.connect({"GOOG": self.goog})
+
+    def given_prices(self, prices):
+        for minute, price in enumerate(prices):
+            self.goog.update(datetime(2014, 2, 10, 10, minute), price)
+
+    def test_action_is_executed_when_rule_starts_matching(self):
+        self.given_alert()
+        self.given_prices([9, 11, 12, 13])
+        self.assertEqual(1, self.action.execute.call_count)
+
+    def test_action_is_executed_again_after_rule_stops_matching(self):
+        self.given_alert()
+        self.given_prices([11, 12, 9, 11])
+        self.assertEqual(2, self.action.execute.call_count)
+
+    def test_hysteresis_keeps_alert_from_rearming_near_the_threshold(self):
+        self.given_alert(hysteresis=2)
+        self.given_prices([11, 9, 11, 7, 11])
+        self.assertEqual(2, self.action.execute.call_count)
+
+    def test_alert_rearms_after_time_while_rule_keeps_matching(self):
+        self.given_alert(rearm_after=timedelta(minutes=2))
+        self.given_prices([11, 12, 13, 14, 15])
+        self.assertEqual(3, self.action.execute.call_count)
+
+    def test_hysteresis_needs_a_threshold_rule(self):
+        with self.assertRaises(ValueError):
+            Alert("GOOG > 10", PriceRule("GOOG", lambda stock: stock.price > 10),
+                  self.action, edge_triggered=True, hysteresis=2)
+
+
+class AlertEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.goog = Stock("GOOG")
+        self.exchange = {"GOOG": self.goog, "MSFT": Stock("MSFT")}
+        self.engine = AlertEngine(self.exchange)
+
+    def given_threshold_alerts(self, comparison, thresholds):
+        actions = []
+        for threshold in thresholds:
+            action = mock.MagicMock()
+            self.engine.add(Alert("GOOG {0} {1}".format(comparison, threshold),
+                                  PriceThresholdRule("GOOG", comparison,
+                                                     threshold),
+                                  action))
+            actions.append(action)
+        return actions
+
+    def test_only_alerts_matching_the_price_are_executed(self):
+        dataset = [(">", [True, False, False]), (">=", [True, True, False]),
+                   ("<", [False, False, True]), ("<=", [False, True, True])]
+        for comparison, fired in dataset:
+            with self.subTest(comparison=comparison):
+                self.setUp()
+                actions = self.given_threshold_alerts(comparison, [5, 10, 15])
+                self.goog.update(datetime(2014, 2, 10), 10)
+                self.assertEqual(fired, [action.execute.called
+                                         for action in actions])
+
+    def test_engine_listens_once_to_each_stock(self):
+        self.given_threshold_alerts(">", [5, 10, 15])
+        self.assertEqual(1, len(self.goog.updated.listeners))
+
+    def test_other_alerts_are_checked_on_updates(self):
+        rule = AndRule(PriceRule("GOOG", lambda stock: stock.price > 8),
+                       PriceRule("MSFT", lambda stock: stock.price > 8))
+        action = mock.MagicMock()
+        self.engine.add(Alert("sample alert", rule, action))
+        self.exchange["MSFT"].update(datetime(2014, 2, 10), 10)
+        self.assertFalse(action.execute.called)
+        self.goog.update(datetime(2014, 2, 10), 10)
+        action.execute.assert_called_with("sample alert")
+
+    def test_removed_alerts_are_not_executed(self):
+        action = mock.MagicMock()
+        alert = Alert("GOOG > 5", PriceThresholdRule("GOOG", ">", 5), action)
+        self.engine.add(alert)
+        self.engine.remove(alert)
+        self.goog.update(datetime(2014, 2, 10), 10)
+        self.assertFalse(action.execute.called)
+
+    def test_edge_triggered_threshold_alerts_only_fire_on_the_edge(self):
+        action = mock.MagicMock()
+        self.engine.add(Alert("GOOG > 5", PriceThresholdRule("GOOG", ">", 5),
+                              action, edge_triggered=True))
+        self.goog.update(datetime(2014, 2, 10), 10)
+        self.goog.update(datetime(2014, 2, 11), 11)
+        self.assertEqual(1, action.execute.call_count)
+
+
+class BulkAlertEvaluatorTest(unittest.TestCase):
+    def setUp(self):
+        self.exchange = {symbol: Stock(symbol)
+                         for symbol in ["GOOG", "AAPL", "MSFT"]}
+        self.exchange["GOOG"].update(datetime(2014, 2, 10), 10)
+        self.exchange["AAPL"].update(datetime(2014, 2, 10), 5)
+
+    def given_alerts(self, rules):
+        return [Alert("alert {0}".format(i), rule, mock.MagicMock())
+                for i, rule in enumerate(rules)]
+
+    def assert_evaluator_matches_rules(self):
+        rng = random.Random(3)
+        rules = []
+        for i in range(200):
+            leaves = [PriceThresholdRule(rng.choice(list(self.exchange)),
+                                         rng.choice([">", ">=", "<", "<="]),
+                                         rng.randrange(15))
+                      for j in range(rng.randrange(1, 3))]
+            rules.append(leaves[0] if len(leaves) == 1 else AndRule(*leaves))
+        rules.append(PriceRule("GOOG", lambda stock: stock.price == 11))
+        alerts = self.given_alerts(rules)
+        evaluator = BulkAlertEvaluator(self.exchange, alerts)
+        for price in [11, 3]:
+            self.exchange["GOOG"].update(datetime(2014, 2, 11, price), price)
+            with self.subTest(price=price):
+                expected = {alert for alert in alerts
+                            if alert.rule.matches(self.exchange)}
+                self.assertEqual(expected, set(evaluator.matching_alerts()))
+
+    def test_matching_alerts_are_the_ones_whose_rules_match(self):
+        self.assert_evaluator_matches_rules()
+
+    @mock.patch("stock_alerter.timeseries.numpy", None)
+    def test_matching_alerts_without_numpy(self):
+        self.assert_evaluator_matches_rules()
+
+    def test_stocks_without_a_price_never_match(self):
+        alerts = self.given_alerts([PriceThresholdRule("MSFT", "<", 10)])
+        self.assertEqual([], BulkAlertEvaluator(self.exchange,
+                                                alerts).matching_alerts())
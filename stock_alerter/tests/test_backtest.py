@@ -0,0 +1,154 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from ..alert import Alert
+from ..backtest import Backtest, BacktestResult, sweep, parameter_grid
+from ..backtest import _worker
+from ..benchmark import synthetic_updates
+from ..processor import Processor
+from ..reader import ListReader
+from ..rule import PriceThresholdRule
+from ..stock import Stock, StockSignal
+
+
+class FailingAction:
+    def execute(self, description):
+        raise AssertionError("actions should not run in a backtest")
+
+
+def threshold_alerts(parameters):
+    return [Alert("S0000 > {0}".format(parameters["threshold"]),
+                  PriceThresholdRule("S0000", ">", parameters["threshold"]),
+                  FailingAction(), edge_triggered=True)]
+
+
+class BacktestTest(unittest.TestCase):
+    def setUp(self):
+        self.updates = [("GOOG", datetime(2014, 2, 1) + timedelta(days=i), price)
+                        for i, price in enumerate(
+                            [10, 11, 12, 13, 14, 15, 14, 13, 12, 11] * 3)]
+
+    def test_alerts_are_recorded_instead_of_executed(self):
+        alert = Alert("GOOG > 14", PriceThresholdRule("GOOG", ">", 14),
+                      FailingAction())
+        results = Backtest(ListReader(self.updates), [alert]).run()
+        alerts = [result for result in results if result.kind == "alert"]
+        self.assertEqual(
+            [BacktestResult(datetime(2014, 2, 6 + 10 * i), "alert", "GOOG",
+                            "GOOG > 14") for i in range(3)], alerts)
+
+    def test_the_alerts_given_are_left_as_they_were(self):
+        action = FailingAction()
+        alert = Alert("GOOG > 14", PriceThresholdRule("GOOG", ">", 14),
+                      action, edge_triggered=True)
+        Backtest(ListReader(self.updates), [alert]).run()
+        self.assertIs(action, alert.action)
+        self.assertTrue(alert.armed)
+        self.assertFalse(hasattr(alert, "exchange"))
+
+    def test_signals_match_those_of_the_stock(self):
+        stock = Stock("GOOG")
+        Processor(ListReader(self.updates), {"GOOG": stock}).process()
+        expected = [(date, signal) for date, signal in
+                    stock.get_crossover_signals(datetime(2014, 2, 1),
+                                                datetime(2014, 3, 2), 3, 6)
+                    if signal != StockSignal.neutral]
+        results = Backtest(ListReader(self.updates)).run(3, 6)
+        self.assertTrue(expected)
+        self.assertEqual(expected, [(result.timestamp, result.detail)
+                                    for result in results])
+
+    def test_results_are_in_timestamp_order(self):
+        alert = Alert("GOOG < 12", PriceThresholdRule("GOOG", "<", 12),
+                      FailingAction())
+        results = Backtest(ListReader(self.updates), [alert]).run(2, 4)
+        timestamps = [result.timestamp for result in results]
+        self.assertEqual(sorted(timestamps), timestamps)
+        self.assertEqual({"alert", "signal"},
+                         {result.kind for result in results})
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.updates = list(synthetic_updates(3, 600, days=30, seed=2))
+        self.grid = {"threshold": [90, 100, 110],
+                     "long_term_timespan": [6, 10]}
+
+    def serial_results(self):
+        return [Backtest(ListReader(self.updates),
+                         threshold_alerts(parameters))
+                .run(None, parameters["long_term_timespan"])
+                for parameters in parameter_grid(self.grid)]
+
+    def test_every_combination_of_parameters_is_run(self):
+        self.assertEqual(
+            [{"threshold": threshold, "long_term_timespan": timespan}
+             for threshold in [90, 100, 110] for timespan in [6, 10]],
+            parameter_grid(self.grid))
+
+    def test_sweep_gives_the_same_results_as_separate_backtests(self):
+        for num_workers in [1, 2]:
+            with self.subTest(num_workers=num_workers):
+                results = sweep(ListReader(self.updates), self.grid,
+                                threshold_alerts, num_workers=num_workers)
+                self.assertEqual(parameter_grid(self.grid),
+                                 [parameters for parameters, _ in results])
+                self.assertEqual(self.serial_results(),
+                                 [rows for _, rows in results])
+
+    def test_sweep_without_alerts_gives_the_signals(self):
+        results = sweep(ListReader(self.updates),
+                        {"short_term_timespan": [3, 5]}, num_workers=2)
+        for parameters, rows in results:
+            self.assertEqual(
+                Backtest(ListReader(self.updates)).run(
+                    parameters["short_term_timespan"]), rows)
+
+    def test_the_worker_state_is_cleared_when_a_backtest_fails(self):
+        def make_alerts(parameters):
+            raise RuntimeError("bad parameters")
+        with self.assertRaises(RuntimeError):
+            sweep(ListReader(self.updates), self.grid, make_alerts,
+                  num_workers=1)
+        self.assertEqual({}, _worker)
+
+
+class SweepBenchmark(unittest.TestCase):
+    def test_a_100_point_sweep_takes_a_few_single_runs(self):
+        updates = list(synthetic_updates(20, 20000, seed=4))
+        grid = {"threshold": list(range(60, 160, 4)),
+                "long_term_timespan": [6, 8, 10, 12]}
+        start = time.perf_counter()
+        Backtest(ListReader(updates), threshold_alerts({"threshold": 100})).run()
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        results = sweep(ListReader(updates), grid, threshold_alerts)
+        swept = time.perf_counter() - start
+        self.assertEqual(100, len(results))
+        self.assertLess(swept, 10 * single,
+                        "single run: {0:.2f}s, sweep: {1:.2f}s".format(
+                            single, swept))
+    test_a_100_point_sweep_takes_a_few_single_runs.slow = True
+
+    @unittest.skipIf((os.cpu_count() or 1) < 2, "needs more than one core")
+    def test_a_sweep_scales_with_the_number_of_workers(self):
+        updates = list(synthetic_updates(20, 20000, seed=4))
+        grid = {"threshold": list(range(60, 160, 4)),
+                "long_term_timespan": [6, 8, 10, 12]}
+        num_workers = min(os.cpu_count(), 4)
+
+        def time_sweep(num_workers):
+            start = time.perf_counter()
+            sweep(ListReader(updates), grid, threshold_alerts,
+                  num_workers=num_workers)
+            return time.perf_counter() - start
+        serial = time_sweep(1)
+        parallel = time_sweep(num_workers)
+        # every worker replays the ticks once, so allow for some of the
+        # time not being split between them
+        self.assertLess(parallel, serial / (0.6 * num_workers),
+                        "1 worker: {0:.2f}s, {1} workers: {2:.2f}s".format(
+                            serial, num_workers, parallel))
+    test_a_sweep_scales_with_the_number_of_workers.slow = True
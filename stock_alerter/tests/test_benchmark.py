@@ -0,0 +1,93 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+
+from ..benchmark import synthetic_updates, write_updates, run_benchmarks
+from ..benchmark import compare, main, BENCHMARKS
+from ..reader import FileReader
+
+
+class SyntheticUpdatesTest(unittest.TestCase):
+    def test_updates_are_reproducible(self):
+        self.assertEqual(list(synthetic_updates(5, 100, seed=3)),
+                         list(synthetic_updates(5, 100, seed=3)))
+
+    def test_written_updates_can_be_read_back(self):
+        updates = list(synthetic_updates(5, 100))
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        write_updates(filename, updates)
+        self.assertEqual(updates, list(FileReader(filename).get_updates()))
+
+    def test_updates_are_in_timestamp_order(self):
+        timestamps = [timestamp for _, timestamp, _ in
+                      synthetic_updates(5, 100)]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+
+class RunBenchmarksTest(unittest.TestCase):
+    def test_every_benchmark_gives_a_result(self):
+        results = run_benchmarks(num_symbols=3, num_ticks=300, repeat=1)
+        self.assertEqual(set(BENCHMARKS), set(results["results"]))
+        for result in results["results"].values():
+            self.assertGreater(result["value"], 0)
+        json.dumps(results)
+
+    def test_only_the_chosen_benchmarks_are_run(self):
+        results = run_benchmarks(num_symbols=3, num_ticks=300, repeat=1,
+                                 names=["parse"])
+        self.assertEqual(["parse"], list(results["results"]))
+
+    def test_benchmarks_need_at_least_one_tick(self):
+        with self.assertRaises(ValueError):
+            run_benchmarks(num_symbols=3, num_ticks=0, repeat=1)
+
+
+class CompareTest(unittest.TestCase):
+    def results(self, **values):
+        return {"results": {
+            name: {"value": value, "unit": "",
+                   "higher_is_better": name != "latency"}
+            for name, value in values.items()}}
+
+    def test_lower_throughput_beyond_threshold_is_a_regression(self):
+        self.assertEqual(
+            [("parse", 100, 80, 0.2)],
+            compare(self.results(parse=100), self.results(parse=80), 0.1))
+
+    def test_higher_latency_beyond_threshold_is_a_regression(self):
+        self.assertEqual(1, len(compare(self.results(latency=1.0),
+                                        self.results(latency=1.5), 0.1)))
+
+    def test_changes_within_the_threshold_are_not_regressions(self):
+        self.assertEqual([], compare(self.results(parse=100, latency=1.0),
+                                     self.results(parse=95, latency=0.5), 0.1))
+
+    def test_benchmarks_missing_from_the_baseline_are_skipped(self):
+        self.assertEqual([], compare(self.results(),
+                                     self.results(parse=1), 0.1))
+
+
+class MainTest(unittest.TestCase):
+    def test_exits_with_an_error_on_regressions(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, "baseline.json")
+        with open(baseline, "w") as fp:
+            json.dump({"results": {"parse": {
+                "value": 1e12, "unit": "updates/s",
+                "higher_is_better": True}}}, fp)
+        stderr = io.StringIO()
+        with redirect_stdout(io.StringIO()), redirect_stderr(stderr):
+            status = main(["--symbols", "3", "--ticks", "300", "--repeat",
+                           "1", "--only", "parse", "--baseline", baseline])
+        self.assertEqual(1, status)
+        self.assertIn("parse regressed", stderr.getvalue())
+
+    def test_rejects_a_tick_count_of_zero(self):
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            main(["--ticks", "0"])
@@ -1,6 +1,7 @@
 import doctest
 from datetime import datetime
 
+from stock_alerter import backtest, exchange, expression, metrics, reader
 from stock_alerter import stock
 
 
@@ -14,6 +15,11 @@ def load_tests(loader, tests, pattern):
         "datetime": datetime,
         "Stock": stock.Stock
     }, setUp=setup_stock_doctest))
+    tests.addTests(doctest.DocTestSuite(reader))
+    tests.addTests(doctest.DocTestSuite(expression))
+    tests.addTests(doctest.DocTestSuite(metrics))
+    tests.addTests(doctest.DocTestSuite(exchange))
+    tests.addTests(doctest.DocTestSuite(backtest))
     options = doctest.ELLIPSIS | doctest.NORMALIZE_WHITESPACE
     tests.addTests(doctest.DocFileSuite("readme.txt", package="stock_alerter", optionflags=options))
     return tests
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from unittest import mock
 
@@ -18,3 +19,24 @@ class EventTest(unittest.TestCase):
         event.connect(listener)
         event.fire(5, shape="square")
         listener.assert_has_calls([mock.call(5, shape="square")])
+
+    def test_awaitable_listeners_are_awaited_together(self):
+        order = []
+
+        async def listener(name, delay):
+            order.append("start " + name)
+            await asyncio.sleep(delay)
+            order.append("end " + name)
+        event = Event()
+        event.connect(lambda: listener("slow", 0.02))
+        event.connect(lambda: listener("fast", 0.01))
+        asyncio.run(event.fire_async())
+        self.assertEqual(["start slow", "start fast", "end fast", "end slow"],
+                         order)
+
+    def test_ordinary_listeners_are_called_by_fire_async(self):
+        listener = mock.Mock()
+        event = Event()
+        event.connect(listener)
+        asyncio.run(event.fire_async(5))
+        listener.assert_called_with(5)
@@ -0,0 +1,119 @@
+import pickle
+import tracemalloc
+import unittest
+from datetime import datetime
+
+from ..exchange import Exchange
+from ..processor import Processor, ShardedProcessor
+from ..reader import ListReader
+from ..rule import PriceRule, ExpressionRule
+from ..stock import Stock
+from ..timeseries import RetentionPolicy
+
+
+class ExchangeTest(unittest.TestCase):
+    def test_stocks_are_created_when_first_looked_up(self):
+        exchange = Exchange()
+        goog = exchange["GOOG"]
+        self.assertEqual("GOOG", goog.symbol)
+        self.assertIs(goog, exchange["GOOG"])
+        self.assertEqual(["GOOG"], list(exchange))
+
+    def test_membership_and_get_do_not_create_stocks(self):
+        exchange = Exchange()
+        self.assertNotIn("GOOG", exchange)
+        self.assertIsNone(exchange.get("GOOG"))
+        self.assertEqual(0, len(exchange))
+
+    def test_stocks_can_be_given_up_front(self):
+        goog = Stock("GOOG")
+        exchange = Exchange({"GOOG": goog})
+        self.assertIs(goog, exchange["GOOG"])
+        self.assertEqual(0, exchange.symbol_id("GOOG"))
+
+    def test_symbols_are_interned_with_ids_in_order(self):
+        exchange = Exchange()
+        exchange["".join(["GO", "OG"])]
+        exchange.setdefault("AAPL", Stock("AAPL"))
+        exchange.update({"MSFT": Stock("MSFT")})
+        self.assertEqual(["GOOG", "AAPL", "MSFT"], exchange.symbols)
+        self.assertEqual(2, exchange.symbol_id("MSFT"))
+        self.assertIs(exchange["GOOG"].symbol, list(exchange)[0])
+        self.assertIs("GOOG", exchange.symbols[0])
+
+    def test_new_stocks_get_the_retention_policy(self):
+        policy = RetentionPolicy(max_ticks=10)
+        exchange = Exchange(retention=policy)
+        self.assertIs(policy, exchange["GOOG"].history.retention)
+
+    def test_exchange_can_be_pickled(self):
+        exchange = Exchange({"GOOG": Stock("GOOG")})
+        exchange["GOOG"].update(datetime(2014, 2, 11), 5)
+        copy = pickle.loads(pickle.dumps(exchange))
+        self.assertIsInstance(copy, Exchange)
+        self.assertEqual(5, copy["GOOG"].price)
+
+
+class ExchangeProcessingTest(unittest.TestCase):
+    def setUp(self):
+        self.updates = [("GOOG", datetime(2014, 2, 11), 5),
+                        ("NEW", datetime(2014, 2, 11), 8),
+                        ("GOOG", datetime(2014, 2, 12), 6)]
+
+    def test_unknown_symbols_are_added_during_processing(self):
+        exchange = Exchange()
+        Processor(ListReader(self.updates), exchange).process()
+        self.assertEqual(8, exchange["NEW"].price)
+        self.assertEqual(6, exchange["GOOG"].price)
+
+    def test_unknown_symbols_are_added_by_the_sharded_processor(self):
+        exchange = Exchange()
+        ShardedProcessor(ListReader(self.updates), exchange,
+                         num_workers=2).process()
+        self.assertEqual(8, exchange["NEW"].price)
+        self.assertEqual(6, exchange["GOOG"].price)
+
+    def test_checking_rules_does_not_create_stocks(self):
+        exchange = Exchange()
+        rules = [PriceRule("TYPO", lambda stock: stock.price > 10),
+                 ExpressionRule('price("TYPO") > 10 or '
+                                'moving_average("TYPO", 5) > 10')]
+        for rule in rules:
+            with self.subTest(rule=rule):
+                self.assertFalse(rule.matches(exchange))
+        self.assertEqual({}, exchange)
+        self.assertEqual([], exchange.symbols)
+
+    def test_unknown_symbols_still_raise_with_a_dict(self):
+        with self.assertRaises(KeyError):
+            Processor(ListReader(self.updates), {"GOOG": Stock("GOOG")}).process()
+
+
+class StockLazinessTest(unittest.TestCase):
+    def test_stocks_have_no_history_or_events_until_used(self):
+        goog = Stock("GOOG")
+        self.assertIsNone(goog.price)
+        self.assertIsNone(goog._history)
+        self.assertIsNone(goog._updated)
+        self.assertIsNone(goog._moving_averages)
+        goog.update(datetime(2014, 2, 11), 5)
+        self.assertIsNone(goog._updated)
+        self.assertEqual(5, goog.price)
+
+
+class ExchangeMemoryBenchmark(unittest.TestCase):
+    def test_stocks_that_are_never_updated_are_small(self):
+        symbols = ["SYM{0}".format(i) for i in range(10000)]
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            exchange = Exchange()
+            for symbol in symbols:
+                exchange[symbol].updated
+            per_symbol = (tracemalloc.get_traced_memory()[0] - before) / \
+                len(symbols)
+        finally:
+            tracemalloc.stop()
+        self.assertLess(per_symbol, 600, "{0:.0f} bytes per symbol".format(
+            per_symbol))
+    test_stocks_that_are_never_updated_are_small.slow = True
@@ -0,0 +1,137 @@
+import gc
+import unittest
+import weakref
+from unittest import mock
+from datetime import datetime
+
+from ..expression import ExpressionCompiler, parse, price, moving_average
+from ..expression import increasing_trend, Compare, Constant, And
+from ..exchange import Exchange
+from ..rule import ExpressionRule, PriceRule, AndRule
+from ..stock import Stock
+
+
+class ExpressionTest(unittest.TestCase):
+    def test_expressions_with_the_same_structure_are_equal(self):
+        self.assertEqual(price("GOOG") > 10, price("GOOG") > 10)
+        self.assertNotEqual(price("GOOG") > 10, price("GOOG") > 11)
+        self.assertEqual(hash(price("GOOG") > 10), hash(price("GOOG") > 10))
+
+    def test_expressions_turn_into_text_that_parses_back(self):
+        expressions = [
+            price("GOOG") > 10,
+            (price("GOOG") > moving_average("GOOG", 5)) | ~increasing_trend("AAPL"),
+            ((price("GOOG") > 10) | (price("AAPL") < 5)) & (price("MSFT") >= -1.5),
+            ~((price("GOOG") > 10) & (price("GOOG") <= 20))]
+        for expression in expressions:
+            with self.subTest(expression=str(expression)):
+                self.assertEqual(expression, parse(str(expression)))
+
+    def test_chained_comparisons_are_parsed_as_and(self):
+        self.assertEqual(And(Compare("<", Constant(5), price("GOOG")),
+                             Compare("<", price("GOOG"), Constant(10))),
+                         parse('5 < price("GOOG") < 10'))
+
+    def test_unsupported_expressions_raise_ValueError(self):
+        for text in ['open("file")', 'price("GOOG") + 1', 'price(GOOG) > 1',
+                     'price("GOOG") is None', 'price("GOOG") >']:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse(text)
+
+    def test_expression_depends_on_its_stocks(self):
+        expression = parse('price("GOOG") > moving_average("AAPL", 5)')
+        self.assertEqual({"GOOG", "AAPL"}, expression.depends_on())
+
+
+class ExpressionCompilerTest(unittest.TestCase):
+    def setUp(self):
+        self.goog = Stock("GOOG")
+        self.goog.update(datetime(2014, 2, 10), 11)
+        self.exchange = {"GOOG": self.goog}
+        self.compiler = ExpressionCompiler()
+
+    def test_compiled_expression_evaluates_on_the_exchange(self):
+        self.assertTrue(self.compiler.compile(price("GOOG") > 10)(self.exchange))
+        self.assertFalse(self.compiler.compile(price("GOOG") > 11)(self.exchange))
+
+    def test_comparisons_without_a_value_are_false(self):
+        evaluate = self.compiler.compile(
+            (price("MSFT") > 10) | (moving_average("GOOG", 5) > 1))
+        self.assertFalse(evaluate(self.exchange))
+
+    def test_identical_sub_expressions_are_compiled_once(self):
+        first = self.compiler.compile((price("GOOG") > 10) & (price("GOOG") < 20))
+        second = self.compiler.compile((price("GOOG") > 10) & (price("GOOG") < 30))
+        self.assertIsNot(first, second)
+        self.assertIs(self.compiler.compile(price("GOOG") > 10),
+                      self.compiler.compile(parse('price("GOOG") > 10')))
+
+    def test_shared_sub_expressions_are_evaluated_once_per_update(self):
+        with mock.patch.object(Stock, "is_increasing_trend",
+                               return_value=True) as trend:
+            rules = [ExpressionRule(increasing_trend("GOOG") & (price("GOOG") > n),
+                                    self.compiler)
+                     for n in range(10)]
+            for rule in rules:
+                rule.matches(self.exchange)
+            self.assertEqual(1, trend.call_count)
+            self.goog.update(datetime(2014, 2, 11), 12)
+            for rule in rules:
+                rule.matches(self.exchange)
+            self.assertEqual(2, trend.call_count)
+
+    def test_values_are_not_shared_between_exchanges(self):
+        evaluate = self.compiler.compile(price("GOOG") > 10)
+        other = Stock("GOOG")
+        other.update(datetime(2014, 2, 10), 9)
+        self.assertTrue(evaluate(self.exchange))
+        self.assertFalse(evaluate({"GOOG": other}))
+        self.assertTrue(evaluate(self.exchange))
+
+    def test_the_compiler_does_not_keep_exchanges_alive(self):
+        exchange = Exchange()
+        exchange["GOOG"].update(datetime(2014, 2, 10), 11)
+        self.assertTrue(ExpressionRule('price("GOOG") > 10').matches(exchange))
+        exchange_ref = weakref.ref(exchange)
+        history_ref = weakref.ref(exchange["GOOG"].history)
+        del exchange
+        gc.collect()
+        self.assertIsNone(exchange_ref())
+        self.assertIsNone(history_ref())
+
+    def test_expressions_are_forgotten_once_no_rule_uses_them(self):
+        rules = [ExpressionRule(price("GOOG") > n, self.compiler)
+                 for n in range(100)]
+        # each comparison, its constant and the shared price
+        self.assertEqual(201, len(self.compiler.compiled))
+        self.assertTrue(rules[10].matches(self.exchange))
+        del rules
+        gc.collect()
+        self.assertEqual(0, len(self.compiler.compiled))
+
+    def test_stocks_without_updates_are_left_without_a_history(self):
+        exchange = Exchange()
+        exchange["GOOG"]
+        evaluate = self.compiler.compile(
+            (price("GOOG") > 10) | (moving_average("GOOG", 5) > 1) |
+            increasing_trend("GOOG"))
+        self.assertFalse(evaluate(exchange))
+        self.assertIsNone(exchange["GOOG"]._history)
+
+
+class ExpressionRuleTest(unittest.TestCase):
+    def setUp(self):
+        goog = Stock("GOOG")
+        goog.update(datetime(2014, 2, 10), 11)
+        self.exchange = {"GOOG": goog}
+
+    def test_rule_can_be_given_the_text_of_an_expression(self):
+        rule = ExpressionRule('price("GOOG") > 10')
+        self.assertTrue(rule.matches(self.exchange))
+        self.assertEqual({"GOOG"}, rule.depends_on())
+
+    def test_expression_rules_work_alongside_other_rules(self):
+        rule = AndRule(ExpressionRule(price("GOOG") > 10),
+                       PriceRule("GOOG", lambda stock: stock.price < 12))
+        self.assertTrue(rule.matches(self.exchange))
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import stock_alerter
+from ..stock import Stock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+MODULES = ["stock_alerter.{0}".format(name) for name in [
+    "stock", "timeseries", "event", "rule", "alert", "action", "reader",
+    "processor", "snapshot", "metrics", "backtest"]]
+
+
+def run_python(*args):
+    return subprocess.run([sys.executable] + list(args), cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+class PackageApiTest(unittest.TestCase):
+    def test_classes_can_be_imported_from_the_package(self):
+        self.assertIs(Stock, stock_alerter.Stock)
+
+    def test_every_exported_name_exists(self):
+        for name in stock_alerter.__all__:
+            with self.subTest(name=name):
+                self.assertTrue(hasattr(stock_alerter, name))
+
+    def test_unknown_names_raise_AttributeError(self):
+        with self.assertRaises(AttributeError):
+            stock_alerter.NoSuchClass
+
+    def test_exported_names_are_listed_by_dir(self):
+        self.assertIn("Processor", dir(stock_alerter))
+
+
+class LazyImportTest(unittest.TestCase):
+    def test_optional_dependencies_are_not_imported_up_front(self):
+        heavy = ["numpy", "smtplib", "email", "asyncio", "multiprocessing",
+                 "ast", "inspect", "traceback"]
+        result = run_python("-c", "import sys, {0}; print(' '.join("
+                            "name for name in {1!r} if name in sys.modules))"
+                            .format(", ".join(MODULES), heavy))
+        self.assertEqual("", result.stdout.strip())
+
+
+class ImportTimeBenchmark(unittest.TestCase):
+    BUDGET_MICROSECONDS = 100000
+
+    def import_time(self):
+        """Returns the time, in microseconds, that importing the modules
+        took, as reported by python -X importtime"""
+        result = run_python("-X", "importtime", "-c",
+                            "import " + ", ".join(MODULES))
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line.split("|")
+            # nested imports are indented, and counted in their parent
+            if name.startswith(" stock_alerter"):
+                total += int(cumulative)
+        return total
+
+    def test_importing_the_package_is_within_budget(self):
+        best = min(self.import_time() for _ in range(3))
+        self.assertLess(best, self.BUDGET_MICROSECONDS,
+                        "importing took {0}us".format(best))
+    test_importing_the_package_is_within_budget.slow = True
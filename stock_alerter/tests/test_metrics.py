@@ -0,0 +1,174 @@
+import timeit
+import unittest
+from unittest import mock
+from datetime import datetime
+
+from .. import metrics
+from ..alert import Alert, AlertEngine
+from ..event import Event
+from ..processor import Processor
+from ..reader import ListReader
+from ..rule import PriceThresholdRule
+from ..stock import Stock
+
+
+class HistogramTest(unittest.TestCase):
+    def test_small_values_are_exact(self):
+        histogram = metrics.Histogram()
+        for value in range(100):
+            histogram.record(value)
+        self.assertEqual(49, histogram.percentile(0.5))
+        self.assertEqual(99, histogram.percentile(1))
+        self.assertEqual(sum(range(100)), histogram.total)
+
+    def test_large_values_are_within_one_percent(self):
+        for value in [1000, 66559, 123456, 987654321, 2 ** 40 + 12345]:
+            with self.subTest(value=value):
+                histogram = metrics.Histogram()
+                histogram.record(1)
+                histogram.record(value)
+                histogram.record(value)
+                histogram.record(value * 3)
+                self.assertLess(abs(histogram.percentile(0.5) - value),
+                                value / 100)
+
+    def test_empty_histogram_has_no_percentile(self):
+        self.assertIsNone(metrics.Histogram().percentile(0.5))
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def test_metrics_with_the_same_name_and_labels_are_shared(self):
+        registry = metrics.MetricsRegistry()
+        self.assertIs(registry.counter("fired", alert="a"),
+                      registry.counter("fired", alert="a"))
+        self.assertIsNot(registry.counter("fired", alert="a"),
+                         registry.counter("fired", alert="b"))
+
+    def test_a_name_cannot_be_used_for_different_kinds(self):
+        registry = metrics.MetricsRegistry()
+        registry.counter("depth")
+        with self.assertRaises(ValueError):
+            registry.gauge("depth")
+
+    def test_dump_gives_durations_in_seconds(self):
+        registry = metrics.MetricsRegistry()
+        registry.histogram("update_seconds", stock="GOOG").record(2000)
+        registry.gauge("queue_depth").set(3)
+        registry.gauge("queue_depth").set(1)
+        dump = registry.dump()
+        self.assertIn('update_seconds{stock="GOOG",quantile="0.5"} 2e-06',
+                      dump)
+        self.assertIn('update_seconds_count{stock="GOOG"} 1', dump)
+        self.assertIn("queue_depth 1\nqueue_depth_max 3", dump)
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        metrics.enable()
+        self.addCleanup(metrics.disable)
+        self.addCleanup(metrics.registry.reset)
+
+    def histogram_count(self, name, **labels):
+        return metrics.registry.histogram(name, **labels).count
+
+    def test_processing_updates_is_measured(self):
+        exchange = {"GOOG": Stock("GOOG")}
+        action = mock.Mock()
+        Alert("GOOG > 10", PriceThresholdRule("GOOG", ">", 10),
+              action).connect(exchange)
+        Processor(ListReader([("GOOG", datetime(2014, 2, 11), 5),
+                              ("GOOG", datetime(2014, 2, 12), 15)]),
+                  exchange).process()
+        self.assertEqual(2, metrics.counter("processor_updates_total").value)
+        self.assertEqual(2, self.histogram_count("processor_read_seconds"))
+        self.assertEqual(2, self.histogram_count("stock_update_seconds"))
+        self.assertEqual(2, self.histogram_count("check_rule_seconds"))
+        self.assertEqual(2, self.histogram_count(
+            "event_listener_seconds", listener="Alert.check_rule"))
+        self.assertEqual(1, metrics.counter("alert_fired_total").value)
+        self.assertEqual(1, self.histogram_count(
+            "action_execute_seconds", action="Mock"))
+
+    def test_alerts_fired_by_the_engine_are_counted(self):
+        exchange = {"GOOG": Stock("GOOG")}
+        engine = AlertEngine(exchange)
+        engine.add(Alert("GOOG > 10", PriceThresholdRule("GOOG", ">", 10),
+                         mock.Mock()))
+        Processor(ListReader([("GOOG", datetime(2014, 2, 11), 15)] * 3),
+                  exchange, batch_size=2).process()
+        self.assertEqual(2, metrics.counter("alert_fired_total").value)
+        self.assertEqual(2, self.histogram_count("processor_batch_seconds"))
+        self.assertEqual(3, metrics.counter("processor_updates_total").value)
+
+    def test_alerts_are_labelled_only_when_asked_for(self):
+        metrics.enable(per_alert=True)
+        exchange = {"GOOG": Stock("GOOG")}
+        Alert("GOOG > 10", PriceThresholdRule("GOOG", ">", 10),
+              mock.Mock()).connect(exchange)
+        exchange["GOOG"].update(datetime(2014, 2, 11), 15)
+        self.assertEqual(1, self.histogram_count(
+            "check_rule_seconds", alert="GOOG > 10"))
+        self.assertEqual(1, metrics.counter(
+            "alert_fired_total", alert="GOOG > 10").value)
+        metrics.enable()
+        exchange["GOOG"].update(datetime(2014, 2, 12), 15)
+        self.assertEqual(1, self.histogram_count("check_rule_seconds"))
+
+    def test_connected_alerts_follow_enabling_and_disabling(self):
+        metrics.disable()
+        exchange = {"GOOG": Stock("GOOG"), "AAPL": Stock("AAPL")}
+        Alert("GOOG > 10", PriceThresholdRule("GOOG", ">", 10),
+              mock.Mock()).connect(exchange)
+        metrics.enable()
+        Alert("AAPL > 10", PriceThresholdRule("AAPL", ">", 10),
+              mock.Mock()).connect(exchange)
+        exchange["GOOG"].update(datetime(2014, 2, 11), 15)
+        exchange["AAPL"].update(datetime(2014, 2, 11), 15)
+        self.assertEqual(2, self.histogram_count("check_rule_seconds"))
+        metrics.disable()
+        exchange["GOOG"].update(datetime(2014, 2, 12), 15)
+        exchange["AAPL"].update(datetime(2014, 2, 12), 15)
+        self.assertEqual(2, self.histogram_count("check_rule_seconds"))
+        self.assertEqual(2, metrics.counter("alert_fired_total").value)
+
+    def test_nothing_is_recorded_when_disabled(self):
+        metrics.disable()
+        Event().fire()
+        Stock("GOOG").update(datetime(2014, 2, 11), 5)
+        self.assertEqual({}, metrics.registry.metrics)
+
+    def test_disabling_puts_back_the_plain_methods(self):
+        plain = Event.fire.__wrapped__
+        metrics.disable()
+        self.assertIs(plain, Event.fire)
+        self.assertNotIn("start", Event.fire.__code__.co_varnames)
+        self.assertNotIn("start", Stock.update.__code__.co_varnames)
+
+
+class _PlainEvent:
+    """Event.fire without the instrumentation check, for comparison"""
+    def __init__(self, listeners):
+        self.listeners = listeners
+
+    def fire(self, *args, **kwargs):
+        for listener in self.listeners:
+            listener(*args, **kwargs)
+
+
+class MetricsOverheadBenchmark(unittest.TestCase):
+    def test_disabled_instrumentation_has_near_zero_overhead(self):
+        listeners = [lambda stock: None]
+        instrumented, plain = Event(), _PlainEvent(listeners)
+        instrumented.listeners = listeners
+        for _ in range(3):
+            with_check = min(timeit.repeat(lambda: instrumented.fire(None),
+                                           number=100000, repeat=5))
+            without_check = min(timeit.repeat(lambda: plain.fire(None),
+                                              number=100000, repeat=5))
+            # timings are noisy, so give it a few tries
+            if with_check < without_check * 1.1:
+                break
+        self.assertLess(with_check, without_check * 1.1,
+                        "instrumented: {0:.4f}s, plain: {1:.4f}s".format(
+                            with_check, without_check))
+    test_disabled_instrumentation_has_near_zero_overhead.slow = True
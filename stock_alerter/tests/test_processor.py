@@ -0,0 +1,320 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+from ..alert import Alert
+from ..benchmark import write_updates
+from ..exchange import Exchange
+from ..processor import Processor, ShardedProcessor, AsyncProcessor, shard_of
+from ..processor import BatchProcessor
+from ..reader import ListReader, SocketReader, FileReader, ParallelFileReader
+from ..rule import PriceRule, AndRule
+from ..stock import Stock
+
+
+class QueueAction:
+    """An action that can report back from a worker process"""
+    def __init__(self, queue):
+        self.queue = queue
+
+    def execute(self, content):
+        self.queue.put(content)
+
+
+def generate_updates(symbols, count, seed=0):
+    rng = random.Random(seed)
+    return [(rng.choice(symbols),
+             datetime(2014, 2, 10) + timedelta(seconds=i),
+             rng.randrange(1, 100))
+            for i in range(count)]
+
+
+class ShardedProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.symbols = ["GOOG", "AAPL", "MSFT", "RHT", "IBM"]
+        self.exchange = {symbol: Stock(symbol) for symbol in self.symbols}
+
+    def test_stock_history_is_the_same_as_with_Processor(self):
+        updates = generate_updates(self.symbols, 500)
+        expected = {symbol: Stock(symbol) for symbol in self.symbols}
+        Processor(ListReader(updates), expected).process()
+        ShardedProcessor(ListReader(updates), self.exchange, num_workers=3,
+                         batch_size=7).process()
+        for symbol in self.symbols:
+            with self.subTest(symbol=symbol):
+                self.assertEqual(expected[symbol].history[:],
+                                 self.exchange[symbol].history[:])
+
+    @unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(),
+                         "needs fork to share the queue with the worker")
+    def test_alerts_are_checked_in_the_worker_that_owns_the_stock(self):
+        queue = multiprocessing.get_context("fork").Queue()
+        alert = Alert("GOOG > 10", PriceRule("GOOG", lambda s: s.price > 10),
+                      QueueAction(queue))
+        updates = [("GOOG", datetime(2014, 2, 10), 11)]
+        ShardedProcessor(ListReader(updates), self.exchange, [alert],
+                         num_workers=2).process()
+        self.assertEqual("GOOG > 10", queue.get(timeout=5))
+
+    def test_alerts_across_shards_are_checked_by_the_coordinator(self):
+        symbols = sorted(self.symbols, key=lambda symbol: shard_of(symbol, 2))
+        first, last = symbols[0], symbols[-1]
+        action = mock.MagicMock()
+        alert = Alert("both > 10",
+                      AndRule(PriceRule(first, lambda s: s.price > 10),
+                              PriceRule(last, lambda s: s.price > 10)),
+                      action)
+        updates = [(first, datetime(2014, 2, 10), 11),
+                   (last, datetime(2014, 2, 10), 12)]
+        ShardedProcessor(ListReader(updates), self.exchange, [alert],
+                         num_workers=2).process()
+        action.execute.assert_called_once_with("both > 10")
+
+    def test_unknown_symbols_raise_KeyError(self):
+        updates = [("XYZ", datetime(2014, 2, 10), 11)]
+        with self.assertRaises(KeyError):
+            ShardedProcessor(ListReader(updates), self.exchange,
+                             num_workers=2).process()
+
+    def test_workers_are_stopped_when_reading_fails(self):
+        def get_updates():
+            yield from generate_updates(self.symbols, 20000)
+            raise OSError("feed went away")
+        reader = mock.Mock()
+        reader.get_updates.side_effect = get_updates
+        processor = ShardedProcessor(reader, self.exchange, num_workers=2,
+                                     batch_size=100)
+        started = []
+        start_workers = processor._start_workers
+        def record_workers(*args):
+            started.extend(start_workers(*args))
+            return started
+        processor._start_workers = record_workers
+        with self.assertRaisesRegex(OSError, "feed went away"):
+            processor.process()
+        self.assertEqual(2, len(started))
+        for worker, connection in started:
+            self.assertEqual(0, worker.exitcode)
+            self.assertTrue(connection.closed)
+
+
+class ShardedProcessorBenchmark(unittest.TestCase):
+    def time_processing(self, create_processor, updates):
+        symbols = {update[0] for update in updates}
+        exchange = {symbol: Stock(symbol) for symbol in symbols}
+        start = time.perf_counter()
+        create_processor(ListReader(updates), exchange).process()
+        return time.perf_counter() - start
+
+    @unittest.skipIf((os.cpu_count() or 1) < 2, "needs more than one core")
+    def test_sharded_processor_scales_with_the_number_of_workers(self):
+        symbols = ["SYM{0}".format(i) for i in range(100)]
+        updates = generate_updates(symbols, 200000)
+        num_workers = min(os.cpu_count(), 4)
+        serial = self.time_processing(Processor, updates)
+        sharded = self.time_processing(
+            lambda reader, exchange: ShardedProcessor(
+                reader, exchange, num_workers=num_workers), updates)
+        # the updates are all read, and sent on, by this process, so allow
+        # for some of the time not being split between the workers
+        self.assertLess(sharded, serial / (0.5 * num_workers),
+                        "serial: {0:.2f}s, {1} workers: {2:.2f}s".format(
+                            serial, num_workers, sharded))
+    test_sharded_processor_scales_with_the_number_of_workers.slow = True
+
+
+class SlowAsyncAction:
+    def __init__(self):
+        self.executed = []
+
+    async def execute(self, content):
+        await asyncio.sleep(0.05)
+        self.executed.append(content)
+
+
+class AsyncProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.exchange = {"GOOG": Stock("GOOG"), "AAPL": Stock("AAPL")}
+
+    def test_updates_are_read_from_a_socket(self):
+        async def feed(reader, writer):
+            writer.write(b"GOOG,2014-02-11T14:10:22.13,5\n"
+                         b"AAPL,2014-02-11T00:00:00.0,8\n\n"
+                         b"GOOG,2014-02-11T14:11:22.13,3\n")
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(feed, "localhost", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                await AsyncProcessor(SocketReader("localhost", port),
+                                     self.exchange).process()
+        asyncio.run(run())
+        self.assertEqual(3, self.exchange["GOOG"].price)
+        self.assertEqual(8, self.exchange["AAPL"].price)
+
+    def test_asynchronous_actions_run_at_the_same_time(self):
+        action = SlowAsyncAction()
+        Alert("GOOG > 1", PriceRule("GOOG", lambda s: s.price > 1),
+              action).connect(self.exchange)
+        updates = [("GOOG", datetime(2014, 2, 10, 10, i), 10 + i)
+                   for i in range(10)]
+        start = time.perf_counter()
+        asyncio.run(AsyncProcessor(ListReader(updates), self.exchange).process())
+        self.assertEqual(10, len(action.executed))
+        self.assertLess(time.perf_counter() - start, 0.3)
+        self.assertEqual(19, self.exchange["GOOG"].price)
+
+    def test_errors_from_updates_are_raised(self):
+        updates = [("GOOG", datetime(2014, 2, 10), -1)]
+        with self.assertRaises(ValueError):
+            asyncio.run(AsyncProcessor(ListReader(updates), self.exchange).process())
+
+    def test_listeners_still_running_are_cancelled_on_an_error(self):
+        action = SlowAsyncAction()
+        Alert("GOOG > 1", PriceRule("GOOG", lambda s: s.price > 1),
+              action).connect(self.exchange)
+        updates = [("GOOG", datetime(2014, 2, 10, 10, i), 10 + i)
+                   for i in range(5)] + [("MSFT", datetime(2014, 2, 10), 1)]
+
+        async def run():
+            with self.assertRaises(KeyError):
+                await AsyncProcessor(ListReader(updates), self.exchange).process()
+            return asyncio.all_tasks() - {asyncio.current_task()}
+        self.assertEqual(set(), asyncio.run(run()))
+        self.assertEqual([], action.executed)
+
+
+class BatchingProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.exchange = {"GOOG": Stock("GOOG"), "AAPL": Stock("AAPL")}
+        self.listener = mock.Mock()
+        self.exchange["GOOG"].updated.connect(self.listener)
+
+    def test_listeners_are_notified_once_per_batch(self):
+        updates = [("GOOG", datetime(2014, 2, 10, 10, i), i) for i in range(10)]
+        Processor(ListReader(updates), self.exchange, batch_size=4).process()
+        self.assertEqual(3, self.listener.call_count)
+        self.assertEqual(9, self.exchange["GOOG"].price)
+
+    def test_batch_window_limits_how_long_updates_wait(self):
+        def get_updates():
+            for i in range(3):
+                time.sleep(0.05)
+                yield ("GOOG", datetime(2014, 2, 10, 10, i), i)
+        reader = mock.Mock()
+        reader.get_updates.side_effect = get_updates
+        Processor(reader, self.exchange, batch_size=100,
+                  batch_window=0.01).process()
+        self.assertEqual(3, self.listener.call_count)
+
+    def test_a_batch_is_applied_when_its_window_is_up_on_a_quiet_feed(self):
+        applied = []
+        self.listener.side_effect = lambda stock: applied.append(
+            len(stock.history))
+        seen_during_gap = []
+        def get_updates():
+            yield ("GOOG", datetime(2014, 2, 10, 10, 0), 0)
+            time.sleep(0.2)
+            seen_during_gap.extend(applied)
+            yield ("GOOG", datetime(2014, 2, 10, 10, 1), 1)
+        reader = mock.Mock()
+        reader.get_updates.side_effect = get_updates
+        Processor(reader, self.exchange, batch_size=100,
+                  batch_window=0.01).process()
+        self.assertEqual([1], seen_during_gap)
+        self.assertEqual([1, 2], applied)
+
+    def test_updates_before_an_unknown_symbol_are_applied(self):
+        updates = [("GOOG", datetime(2014, 2, 10, 10, i), i) for i in range(3)]
+        updates.append(("XYZ", datetime(2014, 2, 10, 11), 1))
+        for options in [{"batch_size": 100}, {"batch_window": 10}]:
+            with self.subTest(**options):
+                self.exchange["GOOG"] = Stock("GOOG")
+                with self.assertRaises(KeyError):
+                    Processor(ListReader(updates), self.exchange,
+                              **options).process()
+                self.assertEqual(2, self.exchange["GOOG"].price)
+
+    def test_updates_before_an_error_from_the_reader_are_applied(self):
+        def get_updates():
+            yield ("GOOG", datetime(2014, 2, 10, 10, 0), 5)
+            raise OSError("feed went away")
+        reader = mock.Mock()
+        reader.get_updates.side_effect = get_updates
+        for options in [{"batch_size": 100}, {"batch_window": 10}]:
+            with self.subTest(**options):
+                self.exchange["GOOG"] = Stock("GOOG")
+                with self.assertRaisesRegex(OSError, "feed went away"):
+                    Processor(reader, self.exchange, **options).process()
+                self.assertEqual(5, self.exchange["GOOG"].price)
+
+class BatchProcessorTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+
+    def test_stock_history_is_the_same_as_with_Processor(self):
+        symbols = ["GOOG", "AAPL", "MSFT"]
+        write_updates(self.filename, generate_updates(symbols, 500))
+        expected = {symbol: Stock(symbol) for symbol in symbols}
+        Processor(FileReader(self.filename), expected).process()
+        exchange = {symbol: Stock(symbol) for symbol in symbols}
+        BatchProcessor(ParallelFileReader(self.filename, num_workers=2,
+                                          chunk_size=2000),
+                       exchange).process()
+        for symbol in symbols:
+            with self.subTest(symbol=symbol):
+                self.assertEqual(expected[symbol].history[:],
+                                 exchange[symbol].history[:])
+
+
+class ParallelFileReaderBenchmark(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fd, cls.filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        symbols = ["SYM{0}".format(i) for i in range(100)]
+        write_updates(cls.filename, generate_updates(symbols, 400000))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.filename)
+
+    def time_loading(self, processor):
+        start = time.perf_counter()
+        processor.process()
+        return time.perf_counter() - start
+
+    def test_loading_history_in_batches_is_faster(self):
+        serial = self.time_loading(Processor(FileReader(self.filename),
+                                             Exchange()))
+        batched = self.time_loading(BatchProcessor(
+            ParallelFileReader(self.filename, chunk_size=2**20), Exchange()))
+        self.assertLess(batched, serial / 1.5,
+                        "batched: {0:.2f}s, serial: {1:.2f}s".format(
+                            batched, serial))
+    test_loading_history_in_batches_is_faster.slow = True
+
+    @unittest.skipIf((os.cpu_count() or 1) < 2, "needs more than one core")
+    def test_parallel_parsing_is_faster_with_more_cores(self):
+        def parse(num_workers):
+            start = time.perf_counter()
+            for batches in ParallelFileReader(self.filename, num_workers,
+                                              chunk_size=2**20).get_batches():
+                pass
+            return time.perf_counter() - start
+        one_worker = parse(1)
+        parallel = parse(os.cpu_count())
+        self.assertLess(parallel, one_worker * 0.75,
+                        "parallel: {0:.2f}s, one worker: {1:.2f}s".format(
+                            parallel, one_worker))
+    test_parallel_parsing_is_faster_with_more_cores.slow = True
@@ -1,8 +1,21 @@
+import itertools
+import os
+import struct
+import tempfile
+import timeit
+import tracemalloc
 import unittest
 from unittest import mock
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from ..reader import FileReader
+from ..reader import FileReader, MmapReader, write_tick_file
+from ..reader import ListReader, MergedReader
+from ..reader import SharedTicks, SharedMemoryReader
+from ..reader import ParallelFileReader, split_file, parse_range
+from ..reader import parse_timestamp, parse_timestamp_micros, TIMESTAMP_FORMAT
+from ..reader import _micros_column
+from ..reader import _parse_with_date_cache
+from ..timeseries import to_epoch_micros, from_epoch_micros
 
 
 class FileReaderTest(unittest.TestCase):
@@ -16,3 +29,290 @@ GOOG,2014-02-11T14:10:22.13,10"""))
         self.assertEqual(("GOOG",
                           datetime(2014, 2, 11, 14, 10, 22, 130000),
                           10), update)
+
+    @mock.patch("builtins.open",
+                mock.mock_open(read_data="""\
+GOOG,2014-02-11T14:10:22.13,10
+AAPL,2014-02-11T00:00:00.0,8
+"""))
+    def test_lines_split_across_chunks_are_joined(self):
+        reader = FileReader("stocks.txt", buffer_size=7)
+        self.assertEqual([
+            ("GOOG", datetime(2014, 2, 11, 14, 10, 22, 130000), 10),
+            ("AAPL", datetime(2014, 2, 11), 8)],
+            list(reader.get_updates()))
+
+    @mock.patch("builtins.open",
+                mock.mock_open(read_data="""\
+
+GOOG,2014-02-11T14:10:22.13,10
+
+"""))
+    def test_blank_lines_are_skipped(self):
+        reader = FileReader("stocks.txt")
+        self.assertEqual(1, len(list(reader.get_updates())))
+
+    def test_buffer_size_should_be_positive(self):
+        with self.assertRaises(ValueError):
+            FileReader("stocks.txt", buffer_size=0)
+
+
+class ParseTimestampTest(unittest.TestCase):
+    def test_fractions_of_any_width_match_strptime(self):
+        for timestamp in ["2014-02-11T14:10:22.1", "2014-02-11T14:10:22.13",
+                          "2014-02-11T00:00:00.0", "2014-02-11T14:10:22.123456"]:
+            with self.subTest(timestamp=timestamp):
+                expected = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+                self.assertEqual(expected, parse_timestamp(timestamp))
+                self.assertEqual(expected, _parse_with_date_cache(timestamp))
+
+    def test_micros_are_the_same_as_those_of_parse_timestamp(self):
+        for timestamp in ["2014-02-11T14:10:22.13", "2014-2-1T4:10:22.13",
+                          "2014-02-11T14:10:22.1+01", "2014-02-11T14:10:22.13Z",
+                          "2014-02-11T14:10:22.1234567", "2014-02-11T24:10:22.1",
+                          "2014-02-11T14:10:22.13 ", "2014-02-11"]:
+            with self.subTest(timestamp=timestamp):
+                try:
+                    expected = to_epoch_micros(parse_timestamp(timestamp))
+                except ValueError:
+                    with self.assertRaises(ValueError):
+                        parse_timestamp_micros(timestamp)
+                    with self.assertRaises(ValueError):
+                        _micros_column([timestamp])
+                else:
+                    self.assertEqual(expected, parse_timestamp_micros(timestamp))
+                    self.assertEqual([expected], list(_micros_column(
+                        ["2014-02-11T14:10:22.13", timestamp]))[1:])
+
+    def test_odd_timestamps_fall_back_to_strptime(self):
+        self.assertEqual(datetime(2014, 2, 1, 4, 10, 22, 130000),
+                         parse_timestamp("2014-2-1T4:10:22.13"))
+
+    def test_invalid_timestamps_raise_ValueError(self):
+        for timestamp in ["2014-13-11T14:10:22.13", "2014-02-11T14:10:22",
+                          "2014-02-11 14:10:22.13", "not a timestamp"]:
+            with self.subTest(timestamp=timestamp):
+                with self.assertRaises(ValueError):
+                    parse_timestamp(timestamp)
+
+
+class ParseTimestampBenchmark(unittest.TestCase):
+    def test_parse_timestamp_is_5x_faster_than_strptime(self):
+        timestamps = ["2014-02-11T14:{0:02}:22.13".format(i % 60)
+                      for i in range(1000)]
+        strptime = min(timeit.repeat(
+            lambda: [datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+                     for timestamp in timestamps], number=5, repeat=3))
+        fast = min(timeit.repeat(
+            lambda: [parse_timestamp(timestamp) for timestamp in timestamps],
+            number=5, repeat=3))
+        self.assertLess(fast * 5, strptime)
+    test_parse_timestamp_is_5x_faster_than_strptime.slow = True
+
+
+class FileReaderMemoryBenchmark(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, self.filename)
+        with os.fdopen(fd, "w") as fp:
+            for i in range(5000):
+                fp.write("GOOG,2014-02-11T14:10:22.13,{0}\n".format(i))
+        # warm up the timestamp parser so its one-off caches aren't counted
+        next(FileReader(self.filename).get_updates())
+
+    def read_whole_file(self):
+        with open(self.filename, "r") as fp:
+            for line in fp.read().split():
+                yield line.split(",")
+
+    def peak_memory(self, updates):
+        tracemalloc.start()
+        try:
+            for update in updates:
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_streaming_reader_peak_memory_is_bounded(self):
+        baseline = self.peak_memory(self.read_whole_file())
+        streaming = self.peak_memory(FileReader(self.filename).get_updates())
+        self.assertLess(streaming * 5, baseline,
+                        "streaming: {0} bytes, whole file: {1} bytes".format(
+                            streaming, baseline))
+    test_streaming_reader_peak_memory_is_bounded.slow = True
+
+
+class MmapReaderTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".tick")
+        os.close(fd)
+        self.addCleanup(os.remove, self.filename)
+
+    def test_MmapReader_replays_the_updates_that_were_written(self):
+        updates = [("GOOG", datetime(2014, 2, 11, 14, 10, 22, 130000), 5),
+                   ("AAPL", datetime(2014, 2, 11), 8),
+                   ("GOOG", datetime(2014, 2, 11, 14, 11, 22, 130000), 3)]
+        write_tick_file(self.filename, updates)
+        self.assertEqual(updates, list(MmapReader(self.filename).get_updates()))
+
+    def test_csv_file_can_be_converted_to_a_tick_file(self):
+        write_tick_file(self.filename, FileReader("updates.csv").get_updates())
+        self.assertEqual(list(FileReader("updates.csv").get_updates()),
+                         list(MmapReader(self.filename).get_updates()))
+
+    def test_tick_file_with_no_updates(self):
+        write_tick_file(self.filename, [])
+        self.assertEqual([], list(MmapReader(self.filename).get_updates()))
+
+    def test_reader_can_be_closed_before_the_end_of_the_file(self):
+        write_tick_file(self.filename, [("GOOG", datetime(2014, 2, 11), 5),
+                                        ("GOOG", datetime(2014, 2, 12), 6)])
+        updater = MmapReader(self.filename).get_updates()
+        next(updater)
+        updater.close()
+
+    def test_other_files_are_rejected(self):
+        with open(self.filename, "wb") as fp:
+            fp.write(b"GOOG,2014-02-11T14:10:22.13,5")
+        with self.assertRaises(ValueError):
+            list(MmapReader(self.filename).get_updates())
+
+    def test_truncated_files_are_rejected(self):
+        write_tick_file(self.filename, [("GOOG", datetime(2014, 2, 11), 5),
+                                        ("GOOG", datetime(2014, 2, 12), 6)])
+        with open(self.filename, "r+b") as fp:
+            fp.truncate(os.path.getsize(self.filename) - 4)
+        with self.assertRaisesRegex(ValueError, "truncated"):
+            list(MmapReader(self.filename).get_updates())
+
+
+class SharedTicksTest(unittest.TestCase):
+    def test_shared_ticks_replay_the_updates(self):
+        updates = [("GOOG", datetime(2014, 2, 11, 14, 10, 22, 130000), 5),
+                   ("AAPL", datetime(2014, 2, 11), 8)]
+        with SharedTicks(updates) as ticks:
+            self.assertEqual(updates, list(ticks.reader().get_updates()))
+            self.assertEqual(updates, list(SharedMemoryReader(ticks.name)
+                                           .get_updates()))
+
+    def test_shared_ticks_with_no_updates(self):
+        with SharedTicks([]) as ticks:
+            self.assertEqual([], list(ticks.reader().get_updates()))
+
+    def test_shared_memory_is_freed_on_close(self):
+        ticks = SharedTicks([("GOOG", datetime(2014, 2, 11), 5)])
+        ticks.close()
+        ticks.close()
+        with self.assertRaises(FileNotFoundError):
+            list(SharedMemoryReader(ticks.name).get_updates())
+
+    def test_more_ticks_than_the_memory_holds_are_rejected(self):
+        with SharedTicks([("GOOG", datetime(2014, 2, 11), 5)]) as ticks:
+            ticks.memory.buf[12:20] = struct.pack("<Q", 10 ** 6)
+            with self.assertRaisesRegex(ValueError, "truncated"):
+                list(ticks.reader().get_updates())
+
+
+class MergedReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.nyse = ListReader([("GOOG", datetime(2014, 2, 11, 10), 5),
+                                ("AAPL", datetime(2014, 2, 11, 12), 8),
+                                ("GOOG", datetime(2014, 2, 11, 14), 7)])
+        self.nasdaq = ListReader([("MSFT", datetime(2014, 2, 11, 9), 3),
+                                  ("GOOG", datetime(2014, 2, 11, 12), 6),
+                                  ("GOOG", datetime(2014, 2, 11, 14), 7)])
+
+    def timestamps(self, updates):
+        return [update[1].hour for update in updates]
+
+    def test_updates_are_merged_in_timestamp_order(self):
+        updates = list(MergedReader([self.nyse, self.nasdaq]).get_updates())
+        self.assertEqual([9, 10, 12, 12, 14, 14], self.timestamps(updates))
+
+    def test_ties_go_to_earlier_readers_by_default(self):
+        updates = list(MergedReader([self.nasdaq, self.nyse]).get_updates())
+        self.assertEqual(["MSFT", "GOOG", "GOOG", "AAPL", "GOOG", "GOOG"],
+                         [update[0] for update in updates])
+
+    def test_ties_can_be_broken_by_symbol(self):
+        updates = list(MergedReader([self.nasdaq, self.nyse],
+                                    tie_break="symbol").get_updates())
+        self.assertEqual(["MSFT", "GOOG", "AAPL", "GOOG", "GOOG", "GOOG"],
+                         [update[0] for update in updates])
+
+    def test_ties_can_be_broken_by_a_key_function(self):
+        updates = list(MergedReader([self.nyse, self.nasdaq],
+                                    tie_break=lambda update: -update[2])
+                       .get_updates())
+        self.assertEqual(8, updates[2][2])
+
+    def test_unknown_tie_breaks_are_rejected(self):
+        with self.assertRaises(ValueError):
+            MergedReader([self.nyse], tie_break="price")
+
+    def test_duplicates_across_feeds_can_be_dropped(self):
+        updates = list(MergedReader([self.nyse, self.nasdaq],
+                                    drop_duplicates=True).get_updates())
+        self.assertEqual([9, 10, 12, 12, 14], self.timestamps(updates))
+
+    def test_updates_are_read_as_they_are_merged(self):
+        class EndlessReader:
+            def __init__(self, symbol):
+                self.symbol = symbol
+
+            def get_updates(self):
+                for minute in itertools.count():
+                    yield (self.symbol,
+                           datetime(2014, 2, 11) + timedelta(minutes=minute),
+                           minute)
+        merged = MergedReader([EndlessReader("GOOG"), EndlessReader("AAPL")])
+        self.assertEqual(
+            ["GOOG", "AAPL", "GOOG", "AAPL"],
+            [update[0] for update in
+             itertools.islice(merged.get_updates(), 4)])
+
+
+class ParallelFileReaderTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, self.filename)
+        with os.fdopen(fd, "w") as fp:
+            for i in range(1000):
+                fp.write("{0},2014-02-11T14:{1:02}:{2:02}.13,{3}\n".format(
+                    ["GOOG", "AAPL", "MSFT"][i % 3], i // 60, i % 60, i))
+        self.expected = {}
+        for symbol, timestamp, price in FileReader(self.filename).get_updates():
+            self.expected.setdefault(symbol, []).append((timestamp, price))
+
+    def test_ranges_start_on_line_boundaries_and_cover_the_file(self):
+        with open(self.filename, "rb") as fp:
+            data = fp.read()
+        ranges = split_file(self.filename, 7)
+        self.assertEqual(7, len(ranges))
+        self.assertEqual(b"".join(data[start:end] for start, end in ranges),
+                         data)
+        for start, end in ranges:
+            self.assertTrue(data[start:end].endswith(b"\n"))
+
+    def test_small_files_give_fewer_ranges(self):
+        with open(self.filename, "w") as fp:
+            fp.write("GOOG,2014-02-11T14:10:22.13,5\n")
+        self.assertEqual([(0, 30)], split_file(self.filename, 4))
+
+    def test_range_is_parsed_into_arrays_by_symbol(self):
+        timestamps, prices = parse_range(self.filename, 0, 30)["GOOG"]
+        self.assertEqual([to_epoch_micros(datetime(2014, 2, 11, 14, 0, 0,
+                                                   130000))],
+                         list(timestamps))
+        self.assertEqual([0], list(prices))
+
+    def test_batches_keep_the_order_of_each_symbol(self):
+        reader = ParallelFileReader(self.filename, num_workers=2,
+                                    chunk_size=1000)
+        updates = {}
+        for batches in reader.get_batches():
+            for symbol, (timestamps, prices) in batches.items():
+                updates.setdefault(symbol, []).extend(
+                    zip(map(from_epoch_micros, timestamps), prices))
+        self.assertEqual(self.expected, updates)
@@ -1,8 +1,12 @@
 import unittest
-from datetime import datetime
+from unittest import mock
+from datetime import datetime, timedelta
 
+from ..exchange import Exchange
 from ..stock import Stock
-from ..rule import PriceRule, AndRule
+from ..rule import PriceRule, PriceThresholdRule, AndRule
+from ..rule import TrendRule, DailyTrendRule, ExpressionRule
+from ..timeseries import RetentionPolicy
 
 
 class PriceRuleTest(unittest.TestCase):
@@ -34,6 +38,57 @@ class PriceRuleTest(unittest.TestCase):
         self.assertEqual({"MSFT"}, rule.depends_on())
 
 
+class PriceThresholdRuleTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        goog = Stock("GOOG")
+        goog.update(datetime(2014, 2, 10), 11)
+        cls.exchange = {"GOOG": goog}
+
+    def test_a_PriceThresholdRule_compares_the_price_with_the_threshold(self):
+        dataset = [(">", 10, True), (">", 11, False), (">=", 11, True),
+                   ("<", 11, False), ("<", 12, True), ("<=", 11, True)]
+        for comparison, threshold, output in dataset:
+            with self.subTest(comparison=comparison, threshold=threshold):
+                rule = PriceThresholdRule("GOOG", comparison, threshold)
+                self.assertEqual(output, rule.matches(self.exchange))
+
+    def test_unknown_comparisons_raise_ValueError(self):
+        with self.assertRaises(ValueError):
+            PriceThresholdRule("GOOG", "==", 10)
+
+
+class TrendRuleTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        goog = Stock("GOOG")
+        for day, price in enumerate([8, 10, 12, 14]):
+            goog.update(datetime(2014, 2, 10 + day), price)
+        goog.update(datetime(2014, 2, 13, 12), 11)
+        cls.exchange = {"GOOG": goog}
+
+    def test_a_TrendRule_matches_the_trend_of_the_last_ticks(self):
+        dataset = [("increasing", 3, False), ("decreasing", 2, True),
+                   ("decreasing", 3, False)]
+        for direction, num_ticks, output in dataset:
+            with self.subTest(direction=direction, num_ticks=num_ticks):
+                rule = TrendRule("GOOG", direction, num_ticks)
+                self.assertEqual(output, rule.matches(self.exchange))
+
+    def test_a_DailyTrendRule_matches_the_trend_of_the_closes(self):
+        self.assertFalse(DailyTrendRule("GOOG", "increasing", 3)
+                         .matches(self.exchange))
+        self.assertTrue(DailyTrendRule("GOOG", "decreasing", 2)
+                        .matches(self.exchange))
+
+    def test_a_TrendRule_is_False_if_the_stock_is_not_in_the_exchange(self):
+        self.assertFalse(TrendRule("MSFT", "increasing").matches(self.exchange))
+
+    def test_unknown_directions_raise_ValueError(self):
+        with self.assertRaises(ValueError):
+            TrendRule("GOOG", "sideways")
+
+
 class AndRuleTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -53,3 +108,54 @@ class AndRuleTest(unittest.TestCase):
         rule = AndRule(PriceRule("GOOG", lambda stock: stock.price > 8),
                        PriceRule("MSFT", lambda stock: stock.price > 10))
         self.assertTrue(rule.matches(self.exchange))
+
+    def test_a_cached_AndRule_only_evaluates_rules_of_updated_stocks(self):
+        goog = Stock("GOOG")
+        goog.update(datetime(2014, 2, 10), 9)
+        msft = Stock("MSFT")
+        msft.update(datetime(2014, 2, 10), 11)
+        exchange = {"GOOG": goog, "MSFT": msft}
+        goog_rule = mock.MagicMock(wraps=PriceRule("GOOG", lambda stock: stock.price > 8))
+        goog_rule.depends_on.return_value = {"GOOG"}
+        msft_rule = mock.MagicMock(wraps=PriceRule("MSFT", lambda stock: stock.price > 10))
+        msft_rule.depends_on.return_value = {"MSFT"}
+        rule = AndRule(goog_rule, msft_rule, cache_results=True)
+        self.assertTrue(rule.matches(exchange))
+        goog.update(datetime(2014, 2, 11), 7)
+        self.assertFalse(rule.matches(exchange))
+        self.assertEqual(2, goog_rule.matches.call_count)
+        self.assertEqual(1, msft_rule.matches.call_count)
+
+
+class RetentionForRulesTest(unittest.TestCase):
+    def test_the_policy_keeps_the_most_history_any_rule_needs(self):
+        rules = [AndRule(TrendRule("GOOG", "increasing", 5),
+                         DailyTrendRule("GOOG", "decreasing", 4)),
+                 ExpressionRule('moving_average("GOOG", 30) > 5')]
+        policy = RetentionPolicy.for_rules(rules, Stock.LONG_TERM_TIMESPAN)
+        self.assertEqual(5, policy.max_ticks)
+        self.assertEqual(31, policy.max_closes)
+        policy = RetentionPolicy.for_rules([], Stock.LONG_TERM_TIMESPAN)
+        self.assertEqual(3, policy.max_ticks)
+        self.assertEqual(Stock.LONG_TERM_TIMESPAN + 1, policy.max_closes)
+
+    def test_rules_with_arbitrary_conditions_keep_the_whole_history(self):
+        rules = [TrendRule("GOOG", "increasing", 5),
+                 AndRule(PriceThresholdRule("GOOG", ">", 10),
+                         PriceRule("GOOG", lambda stock: stock.price > 10))]
+        policy = RetentionPolicy.for_rules(rules, Stock.LONG_TERM_TIMESPAN)
+        self.assertIsNone(policy.max_ticks)
+        self.assertIsNone(policy.max_closes)
+        self.assertIsNone(policy.max_age)
+
+    def test_rules_match_as_they_would_with_the_whole_history(self):
+        rule = ExpressionRule('moving_average("GOOG", 30) > 15')
+        unbounded = Exchange()
+        bounded = Exchange(retention=RetentionPolicy.for_rules([rule]))
+        for day in range(200):
+            timestamp = datetime(2014, 2, 1) + timedelta(days=day)
+            price = 10 if day % 60 < 30 else 30
+            unbounded["GOOG"].update(timestamp, price)
+            bounded["GOOG"].update(timestamp, price)
+            self.assertEqual(rule.matches(unbounded), rule.matches(bounded))
+        self.assertLess(len(bounded["GOOG"].history.close_days), 31 + 16 + 1)
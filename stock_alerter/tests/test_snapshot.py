@@ -0,0 +1,154 @@
+import os
+import tempfile
+import timeit
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+from ..alert import Alert
+from ..processor import Processor
+from ..reader import ListReader
+from ..rule import PriceThresholdRule
+from ..snapshot import save_snapshot, load_snapshot, NewerUpdatesReader
+from ..stock import Stock
+from ..timeseries import RetentionPolicy
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "exchange.snapshot")
+
+    def given_updates(self, count, symbols=("GOOG", "AAPL", "MSFT")):
+        return [(symbols[i % len(symbols)],
+                 datetime(2014, 2, 1) + timedelta(minutes=37 * i),
+                 10 + i % 23)
+                for i in range(count)]
+
+    def given_an_exchange(self, updates):
+        exchange = {}
+        for symbol, timestamp, price in updates:
+            exchange.setdefault(symbol, Stock(symbol)).update(timestamp, price)
+        return exchange
+
+
+class SnapshotTest(SnapshotTestCase):
+    def test_restored_stocks_have_the_same_history(self):
+        exchange = self.given_an_exchange(self.given_updates(500))
+        exchange["GOOG"].update(datetime(2014, 3, 1), 10.5)
+        save_snapshot(self.filename, exchange)
+        restored = load_snapshot(self.filename)
+        self.assertEqual(set(exchange), set(restored))
+        for symbol, stock in exchange.items():
+            with self.subTest(symbol=symbol):
+                self.assertEqual(stock.history[:], restored[symbol].history[:])
+                self.assertEqual(stock.history.revision,
+                                 restored[symbol].history.revision)
+                self.assertEqual(
+                    stock.get_crossover_signal(datetime(2014, 2, 10)),
+                    restored[symbol].get_crossover_signal(datetime(2014, 2, 10)))
+
+    def test_history_is_only_read_when_it_is_first_used(self):
+        save_snapshot(self.filename, self.given_an_exchange(
+            self.given_updates(10)))
+        restored = load_snapshot(self.filename)
+        self.assertNotIn("timestamps", vars(restored["GOOG"].history))
+        self.assertEqual(restored["GOOG"].price, 19)
+        self.assertIn("timestamps", vars(restored["GOOG"].history))
+        self.assertNotIn("timestamps", vars(restored["AAPL"].history))
+
+    def test_restored_stocks_can_be_updated(self):
+        save_snapshot(self.filename, self.given_an_exchange(
+            self.given_updates(10)))
+        restored = load_snapshot(self.filename)
+        restored["GOOG"].update(datetime(2014, 3, 1), 50)
+        self.assertEqual(50, restored["GOOG"].price)
+        self.assertEqual(5, len(restored["GOOG"].history))
+
+    def test_stocks_in_the_exchange_keep_their_listeners_and_retention(self):
+        save_snapshot(self.filename, self.given_an_exchange(
+            self.given_updates(10)))
+        policy = RetentionPolicy(max_ticks=2)
+        goog = Stock("GOOG", retention=policy)
+        listener = mock.Mock()
+        goog.updated.connect(listener)
+        load_snapshot(self.filename, {"GOOG": goog})
+        goog.update(datetime(2014, 3, 1), 50)
+        listener.assert_called_with(goog)
+        self.assertIs(policy, goog.history.retention)
+
+    def test_alert_states_are_restored(self):
+        exchange = self.given_an_exchange(self.given_updates(3))
+        alert = Alert("GOOG > 5", PriceThresholdRule("GOOG", ">", 5),
+                      mock.Mock(), edge_triggered=True,
+                      rearm_after=timedelta(days=1))
+        alert.connect(exchange)
+        exchange["GOOG"].update(datetime(2014, 3, 1), 50)
+        save_snapshot(self.filename, exchange, [alert])
+        restored_alert = Alert("GOOG > 5", PriceThresholdRule("GOOG", ">", 5),
+                               mock.Mock(), edge_triggered=True,
+                               rearm_after=timedelta(days=1))
+        load_snapshot(self.filename, alerts=[restored_alert])
+        self.assertFalse(restored_alert.armed)
+        self.assertEqual(datetime(2014, 3, 1), restored_alert.triggered_at)
+
+    def test_alerts_should_match_the_snapshot(self):
+        save_snapshot(self.filename, {}, [
+            Alert("GOOG > 5", PriceThresholdRule("GOOG", ">", 5), mock.Mock())])
+        with self.assertRaises(ValueError):
+            load_snapshot(self.filename, alerts=[
+                Alert("AAPL > 5", PriceThresholdRule("AAPL", ">", 5),
+                      mock.Mock())])
+
+    def test_other_files_are_rejected(self):
+        with open(self.filename, "wb") as fp:
+            fp.write(b"GOOG,2014-02-11T14:10:22.13,5" * 2)
+        with self.assertRaises(ValueError):
+            load_snapshot(self.filename)
+
+
+class NewerUpdatesReaderTest(SnapshotTestCase):
+    def test_restart_replays_only_updates_after_the_snapshot(self):
+        updates = self.given_updates(300)
+        expected = self.given_an_exchange(updates)
+        save_snapshot(self.filename, self.given_an_exchange(updates[:200]))
+        restored = load_snapshot(self.filename)
+        reader = NewerUpdatesReader(ListReader(updates), restored)
+        self.assertEqual(updates[200:], list(reader.get_updates()))
+        Processor(NewerUpdatesReader(ListReader(updates), restored),
+                  restored).process()
+        for symbol, stock in expected.items():
+            self.assertEqual(stock.history[:], restored[symbol].history[:])
+
+    def test_out_of_order_updates_from_before_the_snapshot_are_skipped(self):
+        updates = self.given_updates(300)
+        save_snapshot(self.filename, self.given_an_exchange(updates[:200]))
+        feed = updates[:190] + updates[200:250] + updates[190:200] + \
+            updates[250:]
+        restored = load_snapshot(self.filename)
+        reader = NewerUpdatesReader(ListReader(feed), restored)
+        self.assertEqual(updates[200:], list(reader.get_updates()))
+        Processor(NewerUpdatesReader(ListReader(feed), restored),
+                  restored).process()
+        expected = self.given_an_exchange(updates)
+        for symbol, stock in expected.items():
+            self.assertEqual(stock.history[:], restored[symbol].history[:])
+
+
+class SnapshotBenchmark(SnapshotTestCase):
+    def test_restoring_is_faster_than_replaying_the_updates(self):
+        updates = self.given_updates(30000, [
+            "SYM{0}".format(i) for i in range(100)])
+        save_snapshot(self.filename, self.given_an_exchange(updates))
+        replay = min(timeit.repeat(
+            lambda: self.given_an_exchange(updates), number=1, repeat=3))
+
+        def restore():
+            for stock in load_snapshot(self.filename).values():
+                stock.price
+        restored = min(timeit.repeat(restore, number=1, repeat=3))
+        self.assertLess(restored * 10, replay,
+                        "restore: {0:.3f}s, replay: {1:.3f}s".format(
+                            restored, replay))
+    test_restoring_is_faster_than_replaying_the_updates.slow = True
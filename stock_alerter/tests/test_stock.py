@@ -1,8 +1,11 @@
+import random
 import unittest
-import collections
+import collections.abc
+from unittest import mock
 from datetime import datetime, timedelta
 
-from ..stock import Stock, StockSignal
+from ..stock import Stock, StockSignal, get_crossover_signals
+from ..timeseries import RetentionPolicy
 
 
 class StockTest(unittest.TestCase):
@@ -34,6 +37,24 @@ class StockTest(unittest.TestCase):
         self.goog.update(datetime(2014, 2, 12), price=10)
         self.assertEqual(8, self.goog.price)
 
+    def test_update_many_fires_updated_once_for_the_batch(self):
+        listener = mock.Mock()
+        self.goog.updated.connect(listener)
+        self.goog.update_many([(datetime(2014, 2, 12), 10),
+                               (datetime(2014, 2, 13), 8)])
+        listener.assert_called_once_with(self.goog)
+
+    def test_ticked_is_fired_for_every_update_in_a_batch(self):
+        listener = mock.Mock()
+        self.goog.ticked.connect(listener)
+        self.goog.update_many([(datetime(2014, 2, 12), 10),
+                               (datetime(2014, 2, 13), 8)])
+        self.goog.update(datetime(2014, 2, 14), 9)
+        self.assertEqual([mock.call(self.goog, datetime(2014, 2, 12), 10),
+                          mock.call(self.goog, datetime(2014, 2, 13), 8),
+                          mock.call(self.goog, datetime(2014, 2, 14), 9)],
+                         listener.mock_calls)
+
 
 class StockTrendTest(unittest.TestCase):
     def given_a_series_of_prices(self, goog, prices):
@@ -56,20 +77,52 @@ class StockTrendTest(unittest.TestCase):
                 self.assertEqual(output, goog.is_increasing_trend())
 
 
+    def test_trends_of_any_length(self):
+        goog = Stock("GOOG")
+        for i, price in enumerate([10, 9, 8, 7, 8, 9, 10, 11, 12]):
+            goog.update(datetime(2014, 2, 10) + timedelta(i), price)
+        self.assertTrue(goog.is_increasing_trend(6))
+        self.assertFalse(goog.is_increasing_trend(7))
+        self.assertFalse(goog.is_decreasing_trend())
+        goog.update(datetime(2014, 2, 10, 12), 20)
+        self.assertTrue(goog.is_increasing_trend(6))
+
+    def test_an_out_of_order_update_can_break_a_trend(self):
+        goog = Stock("GOOG")
+        self.given_a_series_of_prices(goog, [8, 10, 12, 14])
+        goog.update(datetime(2014, 2, 12, 12), 20)
+        self.assertFalse(goog.is_increasing_trend())
+        self.assertTrue(goog.is_decreasing_trend(2))
+
+    def test_daily_trends_use_the_closing_prices(self):
+        goog = Stock("GOOG")
+        for day, price in enumerate([8, 10, 12, 14]):
+            goog.update(datetime(2014, 2, 10 + day, 12), price)
+        goog.update(datetime(2014, 2, 12, 6), 20)
+        self.assertFalse(goog.is_increasing_trend())
+        self.assertTrue(goog.is_increasing_daily_trend(4))
+        self.assertFalse(goog.is_decreasing_daily_trend(2))
+
+    def test_stock_without_updates_has_no_trend(self):
+        goog = Stock("GOOG")
+        self.assertFalse(goog.is_decreasing_trend())
+        self.assertFalse(goog.is_increasing_daily_trend(2))
+
+
 class StockCrossOverSignalTest(unittest.TestCase):
     def setUp(self):
         self.goog = Stock("GOOG")
 
     def _flatten(self, timestamps):
         for timestamp in timestamps:
-            if not isinstance(timestamp, collections.Iterable):
+            if not isinstance(timestamp, collections.abc.Iterable):
                 yield timestamp
             else:
                 for value in self._flatten(timestamp):
                     yield value
 
     def _generate_timestamp_for_date(self, date, price_list):
-        if not isinstance(price_list, collections.Iterable):
+        if not isinstance(price_list, collections.abc.Iterable):
             return date
         else:
             delta = 1.0/len(price_list)
@@ -196,3 +249,72 @@ class StockCrossOverSignalTest(unittest.TestCase):
             29, 28, 27, 26, 25, 24, 23, 22, 21, 20, 46])
         self.assertEqual(StockSignal.neutral,
                          self.goog.get_crossover_signal(date_to_check))
+
+
+class StockRetentionTest(unittest.TestCase):
+    def test_bounded_history_gives_the_same_latest_signals(self):
+        rng = random.Random(5)
+        policy = RetentionPolicy.for_timespan(Stock.LONG_TERM_TIMESPAN)
+        goog, bounded = Stock("GOOG"), Stock("GOOG", retention=policy)
+        for i in range(3000):
+            timestamp = datetime(2014, 2, 1) + timedelta(hours=i)
+            price = rng.randrange(10, 30)
+            goog.update(timestamp, price)
+            bounded.update(timestamp, price)
+            if i % 50 == 0:
+                self.assertEqual(goog.price, bounded.price)
+                self.assertEqual(goog.is_increasing_trend(),
+                                 bounded.is_increasing_trend())
+                self.assertEqual(goog.get_crossover_signal(timestamp),
+                                 bounded.get_crossover_signal(timestamp))
+        self.assertLess(len(bounded.history), 50)
+
+
+class StockCrossOverSignalsTest(unittest.TestCase):
+    def given_random_prices(self, rng, make_price):
+        goog = Stock("GOOG")
+        for i in range(rng.randrange(150)):
+            timestamp = datetime(2014, 2, 1) + timedelta(
+                minutes=rng.randrange(40 * 24 * 60))
+            goog.update(timestamp, make_price(rng))
+        return goog
+
+    def assert_matches_signal_on_each_day(self, make_price):
+        rng = random.Random(1)
+        for i in range(40):
+            goog = self.given_random_prices(rng, make_price)
+            start_date = datetime(2014, 1, 25) + timedelta(rng.randrange(30))
+            end_date = start_date + timedelta(rng.randrange(25))
+            with self.subTest(i=i):
+                expected = [
+                    (start_date + timedelta(day),
+                     goog.get_crossover_signal(start_date + timedelta(day)))
+                    for day in range((end_date - start_date).days + 1)]
+                self.assertEqual(expected,
+                                 goog.get_crossover_signals(start_date, end_date))
+
+    def test_signals_match_signal_on_each_day_for_integer_prices(self):
+        self.assert_matches_signal_on_each_day(
+            lambda rng: rng.randrange(10, 30))
+
+    def test_signals_match_signal_on_each_day_for_float_prices(self):
+        self.assert_matches_signal_on_each_day(
+            lambda rng: rng.randrange(100, 300) / 10)
+
+    @mock.patch("stock_alerter.timeseries.numpy", None)
+    def test_signals_match_signal_on_each_day_without_numpy(self):
+        self.assert_matches_signal_on_each_day(
+            lambda rng: rng.randrange(10, 30))
+
+    def test_signals_are_empty_if_the_range_is_empty(self):
+        self.assertEqual([], Stock("GOOG").get_crossover_signals(
+            datetime(2014, 2, 13), datetime(2014, 2, 12)))
+
+    def test_signals_for_every_stock_in_the_exchange(self):
+        exchange = {"GOOG": Stock("GOOG"), "AAPL": Stock("AAPL")}
+        signals = get_crossover_signals(exchange, datetime(2014, 2, 12),
+                                        datetime(2014, 2, 13))
+        self.assertEqual({"GOOG", "AAPL"}, set(signals))
+        self.assertEqual([(datetime(2014, 2, 12), StockSignal.neutral),
+                          (datetime(2014, 2, 13), StockSignal.neutral)],
+                         signals["GOOG"])
@@ -1,7 +1,13 @@
+import random
+import tracemalloc
 import unittest
-from datetime import datetime
+from array import array
+from datetime import datetime, timedelta
 
-from ..timeseries import TimeSeries
+from ..timeseries import TimeSeries, Update, NotEnoughDataException
+from ..timeseries import MovingAverage, WeightedMovingAverage
+from ..timeseries import ExponentialMovingAverage, RetentionPolicy
+from ..timeseries import to_epoch_micros
 
 
 class TimeSeriesTestCase(unittest.TestCase):
@@ -19,3 +25,340 @@ class TimeSeriesEqualityTest(TimeSeriesTestCase):
         series.update(datetime(2014, 3, 10), 5)
         series.update(datetime(2014, 3, 11), 15)
         self.assert_has_price_history([5, 15], series)
+
+    def test_out_of_order_updates_are_inserted_in_timestamp_order(self):
+        series = TimeSeries()
+        series.update(datetime(2014, 3, 12), 25)
+        series.update(datetime(2014, 3, 10), 5)
+        series.update(datetime(2014, 3, 11), 15)
+        self.assert_has_price_history([5, 15, 25], series)
+
+    def test_updates_are_ordered_like_Update_tuples(self):
+        updates = [(datetime(2014, 3, 10), 5), (datetime(2014, 3, 11), 15),
+                   (datetime(2014, 3, 11), 10), (datetime(2014, 3, 10), 7),
+                   (datetime(2014, 3, 11), 15), (datetime(2014, 3, 9), 1)]
+        series = TimeSeries()
+        for timestamp, value in updates:
+            series.update(timestamp, value)
+        self.assertEqual(sorted(Update(*update) for update in updates),
+                         series[:])
+
+    def test_series_is_the_list_of_updates(self):
+        series = TimeSeries()
+        series.update(datetime(2014, 3, 11), 15)
+        series.update(datetime(2014, 3, 10), 5)
+        self.assertEqual([Update(datetime(2014, 3, 10), 5),
+                          Update(datetime(2014, 3, 11), 15)], series.series)
+        with self.assertRaises(AttributeError):
+            series.series = []
+
+    def test_series_keeps_values_that_are_not_integers(self):
+        series = TimeSeries()
+        series.update(datetime(2014, 3, 10), 5)
+        series.update(datetime(2014, 3, 11), 8.4)
+        self.assertEqual([Update(datetime(2014, 3, 10), 5),
+                          Update(datetime(2014, 3, 11), 8.4)], series[:])
+
+    def test_length_of_series(self):
+        series = TimeSeries()
+        series.update(datetime(2014, 3, 10), 5)
+        series.update(datetime(2014, 3, 11), 15)
+        self.assertEqual(2, len(series))
+
+
+class TimeSeriesMemoryBenchmark(unittest.TestCase):
+    def allocated_memory(self, create):
+        tracemalloc.start()
+        try:
+            result = create()
+            return tracemalloc.get_traced_memory()[0], result
+        finally:
+            tracemalloc.stop()
+
+    def test_series_uses_a_fraction_of_the_memory_of_a_list(self):
+        timestamps = [datetime(2014, 3, 10) + timedelta(seconds=i)
+                      for i in range(10000)]
+
+        def create_list():
+            updates = []
+            for i, timestamp in enumerate(timestamps):
+                # every update from a reader comes with its own datetime
+                updates.append(Update(timestamp + timedelta(0), 1000 + i))
+            return updates
+
+        def create_series():
+            series = TimeSeries()
+            for i, timestamp in enumerate(timestamps):
+                series.update(timestamp, 1000 + i)
+            return series
+
+        list_memory, _ = self.allocated_memory(create_list)
+        series_memory, _ = self.allocated_memory(create_series)
+        self.assertLess(series_memory * 4, list_memory)
+    test_series_uses_a_fraction_of_the_memory_of_a_list.slow = True
+
+
+class ClosingPriceListTest(unittest.TestCase):
+    def closing_price_list_by_scanning(self, updates, on_date, num_days):
+        updates = sorted(updates)
+        closing_price_list = []
+        for i in range(num_days):
+            chk = on_date.date() - timedelta(i)
+            earlier = [update for update in updates
+                       if update.timestamp.date() <= chk]
+            if earlier:
+                closing_price_list.insert(0, earlier[-1])
+        return closing_price_list
+
+    def test_closing_price_list_matches_a_scan_of_the_series(self):
+        rng = random.Random(42)
+        updates = [Update(datetime(2014, 3, 1) +
+                          timedelta(minutes=rng.randrange(20 * 24 * 60)),
+                          rng.randrange(100))
+                   for i in range(200)]
+        series = TimeSeries()
+        for update in updates:
+            series.update(*update)
+        for day in range(-2, 25):
+            on_date = datetime(2014, 3, 1) + timedelta(day)
+            with self.subTest(on_date=on_date):
+                self.assertEqual(
+                    self.closing_price_list_by_scanning(updates, on_date, 10),
+                    series.get_closing_price_list(on_date, 10))
+
+    def test_closing_price_is_the_last_update_of_the_day(self):
+        series = TimeSeries()
+        series.update(datetime(2014, 3, 10, 15), 7)
+        series.update(datetime(2014, 3, 10, 9), 5)
+        series.update(datetime(2014, 3, 11, 9), 8.5)
+        self.assertEqual([Update(datetime(2014, 3, 10, 15), 7),
+                          Update(datetime(2014, 3, 11, 9), 8.5)],
+                         series.get_closing_price_list(datetime(2014, 3, 11), 2))
+
+
+class MovingAverageTest(unittest.TestCase):
+    def setUp(self):
+        self.series = TimeSeries()
+        for day, price in enumerate([10, 20, 30, 40, 50, 60]):
+            self.series.update(datetime(2014, 3, 1) + timedelta(day), price)
+
+    def test_moving_average_of_closing_prices(self):
+        moving_average = MovingAverage(self.series, 3)
+        self.assertEqual(20, moving_average.value_on(datetime(2014, 3, 3)))
+        self.assertEqual(30, moving_average.value_on(datetime(2014, 3, 4)))
+        self.assertEqual(50, moving_average.value_on(datetime(2014, 3, 6)))
+
+    def test_not_enough_data_raises_exception(self):
+        moving_average = MovingAverage(self.series, 3)
+        with self.assertRaises(NotEnoughDataException):
+            moving_average.value_on(datetime(2014, 3, 2))
+
+    def test_cached_values_are_recalculated_after_an_earlier_update(self):
+        moving_average = MovingAverage(self.series, 3)
+        moving_average.value_on(datetime(2014, 3, 4))
+        moving_average.value_on(datetime(2014, 3, 5))
+        self.series.update(datetime(2014, 3, 3, 12), 60)
+        self.assertEqual(40, moving_average.value_on(datetime(2014, 3, 4)))
+        self.assertEqual(50, moving_average.value_on(datetime(2014, 3, 5)))
+
+    def test_latest_value_follows_updates_on_the_same_day(self):
+        moving_average = MovingAverage(self.series, 3)
+        self.assertEqual(50, moving_average.value_on(datetime(2014, 3, 6)))
+        self.series.update(datetime(2014, 3, 6, 12), 90)
+        self.assertEqual(60, moving_average.value_on(datetime(2014, 3, 6)))
+
+    def test_weighted_moving_average(self):
+        moving_average = WeightedMovingAverage(self.series, 3)
+        for day in range(2, 6):
+            on_date = datetime(2014, 3, 1) + timedelta(day)
+            prices = [10 * (day - 1), 10 * day, 10 * (day + 1)]
+            with self.subTest(on_date=on_date):
+                self.assertAlmostEqual(
+                    (prices[0] + 2 * prices[1] + 3 * prices[2])/6,
+                    moving_average.value_on(on_date))
+
+    def test_exponential_moving_average(self):
+        moving_average = ExponentialMovingAverage(self.series, 3)
+        expected = 20
+        self.assertAlmostEqual(expected, moving_average.value_on(datetime(2014, 3, 3)))
+        for day, price in [(4, 40), (5, 50), (6, 60)]:
+            expected = 0.5 * price + 0.5 * expected
+            self.assertAlmostEqual(expected,
+                                   moving_average.value_on(datetime(2014, 3, day)))
+
+    def test_exponential_moving_average_computed_from_scratch(self):
+        self.assertAlmostEqual(
+            0.5 * 60 + 0.25 * 50 + 0.125 * 40 + 0.125 * 20,
+            ExponentialMovingAverage(self.series, 3).value_on(datetime(2014, 3, 6)))
+
+
+class TimeSeriesUpdateManyTest(unittest.TestCase):
+    def test_update_many_gives_the_same_series_as_single_updates(self):
+        rng = random.Random(7)
+        expected = TimeSeries()
+        series = TimeSeries()
+        for batch_number in range(20):
+            batch = [(datetime(2014, 3, 1) +
+                      timedelta(hours=rng.randrange(24 * 10)),
+                      rng.choice([rng.randrange(100), rng.randrange(100) / 4]))
+                     for i in range(rng.randrange(10))]
+            for timestamp, value in batch:
+                expected.update(timestamp, value)
+            series.update_many(batch)
+        self.assertEqual(expected[:], series[:])
+        self.assertEqual(expected.get_closing_price_list(datetime(2014, 3, 12), 12),
+                         series.get_closing_price_list(datetime(2014, 3, 12), 12))
+        self.assertEqual(len(expected), series.revision)
+
+
+class TrendTest(unittest.TestCase):
+    def run_lengths(self, values):
+        """Counts the rising and falling runs at the end of values the slow
+        way, to check the counts the series keeps against"""
+        rising = falling = 0
+        for i in range(len(values) - 1, 0, -1):
+            if values[i - 1] < values[i] and falling == 0:
+                rising += 1
+            elif values[i - 1] > values[i] and rising == 0:
+                falling += 1
+            else:
+                break
+        return rising, falling
+
+    def assertRunsMatch(self, series):
+        self.assertEqual(self.run_lengths([value for _, value in series]),
+                         (series.rising_ticks, series.falling_ticks))
+        self.assertEqual(self.run_lengths(list(series.close_values)),
+                         (series.rising_closes, series.falling_closes))
+
+    def random_updates(self, rng, count):
+        return [(datetime(2014, 3, 1) + timedelta(hours=rng.randrange(24 * 5)),
+                 rng.randrange(4)) for i in range(count)]
+
+    def test_runs_are_counted_from_updates_in_order(self):
+        series = TimeSeries()
+        for i, value in enumerate([5, 6, 7, 8, 8, 7, 6, 5, 4, 9]):
+            series.update(datetime(2014, 3, 1) + timedelta(hours=8 * i), value)
+            self.assertRunsMatch(series)
+        self.assertEqual((1, 0), (series.rising_ticks, series.falling_ticks))
+
+    def test_runs_are_corrected_by_out_of_order_updates(self):
+        rng = random.Random(5)
+        for trial in range(20):
+            series = TimeSeries()
+            for timestamp, value in self.random_updates(rng, 50):
+                series.update(timestamp, value)
+                self.assertRunsMatch(series)
+
+    def test_update_many_counts_the_same_runs(self):
+        rng = random.Random(9)
+        series = TimeSeries()
+        for batch_number in range(50):
+            series.update_many(self.random_updates(rng, rng.randrange(5)))
+            self.assertRunsMatch(series)
+        series.update_many([(datetime(2014, 3, 10), value)
+                            for value in range(10)])
+        self.assertRunsMatch(series)
+
+
+class TimeSeriesUpdateColumnsTest(unittest.TestCase):
+    def check_same_as_update_many(self, batches):
+        expected = TimeSeries()
+        series = TimeSeries()
+        for batch in batches:
+            expected.update_many(batch)
+            series.update_columns(array("q", [to_epoch_micros(timestamp)
+                                              for timestamp, _ in batch]),
+                                  array("q", [value for _, value in batch]))
+        self.assertEqual(expected[:], series[:])
+        self.assertEqual(list(expected.close_values), list(series.close_values))
+        self.assertEqual((expected.rising_ticks, expected.falling_ticks,
+                          expected.rising_closes, expected.falling_closes),
+                         (series.rising_ticks, series.falling_ticks,
+                          series.rising_closes, series.falling_closes))
+        self.assertEqual(expected.revision, series.revision)
+
+    def test_columns_in_order_are_appended(self):
+        start = datetime(2014, 3, 1)
+        self.check_same_as_update_many(
+            [[(start + timedelta(hours=5 * i + 50 * batch), i % 7)
+              for i in range(10)] for batch in range(5)])
+
+    def test_columns_out_of_order_are_merged(self):
+        rng = random.Random(11)
+        self.check_same_as_update_many(
+            [[(datetime(2014, 3, 1) + timedelta(hours=rng.randrange(24 * 10)),
+               rng.randrange(100)) for i in range(rng.randrange(10))]
+             for batch in range(20)])
+
+
+class RetentionPolicyTest(unittest.TestCase):
+    def given_random_updates(self, series_list, count=2000):
+        rng = random.Random(3)
+        for i in range(count):
+            timestamp = datetime(2014, 2, 1) + timedelta(minutes=20 * i)
+            value = rng.randrange(100)
+            for series in series_list:
+                series.update(timestamp, value)
+
+    def test_number_of_ticks_is_bounded(self):
+        series = TimeSeries(RetentionPolicy(max_ticks=100))
+        self.given_random_updates([series])
+        self.assertLessEqual(len(series), 100 + 16)
+        self.assertEqual(2000, series.revision)
+
+    def test_latest_ticks_and_closes_are_kept(self):
+        unbounded = TimeSeries()
+        series = TimeSeries(RetentionPolicy(max_ticks=3, max_closes=11))
+        self.given_random_updates([unbounded, series])
+        self.assertEqual(unbounded[-3:], series[-3:])
+        self.assertEqual(
+            unbounded.get_closing_price_list(datetime(2014, 3, 19), 11),
+            series.get_closing_price_list(datetime(2014, 3, 19), 11))
+        self.assertLessEqual(len(series.close_days), 11 + 16)
+
+    def test_ticks_older_than_max_age_are_dropped(self):
+        series = TimeSeries(RetentionPolicy(max_age=timedelta(days=2)))
+        self.given_random_updates([series])
+        age = series[-1].timestamp - series[0].timestamp
+        self.assertLessEqual(age, timedelta(days=2, hours=6))
+
+    def test_updates_older_than_the_dropped_history_are_ignored(self):
+        series = TimeSeries(RetentionPolicy(max_ticks=3, max_closes=11))
+        self.given_random_updates([series])
+        ticks = series[:]
+        closes = list(series.close_values)
+        series.update(datetime(2014, 2, 1), 1000)
+        self.assertEqual(ticks, series[:])
+        self.assertEqual(closes, list(series.close_values))
+
+    def test_moving_averages_slid_past_dropped_closes_need_more_data(self):
+        series = TimeSeries(RetentionPolicy(max_closes=4))
+        days = [datetime(2014, 2, 1) + timedelta(day) for day in range(60)]
+        for day in days[:40]:
+            series.update(day, 10)
+        moving_average = MovingAverage(series, 3)
+        self.assertEqual(10, moving_average.value_on(days[39]))
+        for day in days[40:]:
+            series.update(day, 10)
+        with self.assertRaises(NotEnoughDataException):
+            moving_average.value_on(days[40])
+        self.assertEqual(10, moving_average.value_on(days[59]))
+
+    def test_moving_averages_are_recalculated_when_they_cannot_slide(self):
+        series = TimeSeries(RetentionPolicy(max_closes=4))
+        days = [datetime(2014, 2, 1) + timedelta(day) for day in range(21)]
+        for price, day in enumerate(days[:20]):
+            series.update(day, price)
+        moving_average = MovingAverage(series, 3)
+        self.assertEqual(17, moving_average.value_on(days[18]))
+        series.update(days[20], 20)
+        self.assertEqual(17, series.closing_value_on_day(series.close_days[0]))
+        self.assertEqual(18, moving_average.value_on(days[19]))
+
+    def test_update_many_applies_the_policy(self):
+        series = TimeSeries(RetentionPolicy(max_ticks=10))
+        series.update_many((datetime(2014, 2, 1) + timedelta(minutes=i), i)
+                           for i in range(100))
+        self.assertEqual(10, len(series))
+        self.assertEqual(99, series[-1].value)
@@ -1,48 +1,599 @@
 import bisect
 import collections
-from datetime import timedelta
+import heapq
+import itertools
+import operator
+from array import array
+from datetime import datetime, timedelta
+
+# numpy is optional, and slow to import, so it is only imported when it is
+# first needed. Until then, numpy is _NOT_LOADED
+_NOT_LOADED = object()
+numpy = _NOT_LOADED
+
+
+def load_numpy():
+    """Returns the numpy module, or None if it isn't installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _numpy():
+    global numpy
+    if numpy is _NOT_LOADED:
+        numpy = load_numpy()
+    return numpy
 
 Update = collections.namedtuple("Update", ["timestamp", "value"])
 
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_MICROS_PER_DAY = timedelta(days=1) // _MICROSECOND
+
+
+def to_epoch_micros(timestamp):
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def to_epoch_day(timestamp):
+    return to_epoch_micros(timestamp) // _MICROS_PER_DAY
+
 
 class NotEnoughDataException(Exception):
     pass
 
 
+class RetentionPolicy:
+    """Limits how much history a TimeSeries keeps
+
+    max_ticks limits the number of updates kept, and max_age, a timedelta,
+    drops updates older than that compared to the latest one. The closing
+    value of each day is kept separately from the updates, so closing
+    prices, and the moving averages calculated from them, outlive the
+    updates. max_closes limits the number of days whose close is kept.
+    Updates older than what has already been dropped are ignored.
+
+    So that trimming stays cheap, history is trimmed in chunks, which means
+    up to an eighth more (and at least 16 more) updates or closes than the
+    limits may be kept at any time, and an eighth more than max_age"""
+
+    def __init__(self, max_ticks=None, max_age=None, max_closes=None):
+        self.max_ticks = max_ticks
+        self.max_age = max_age
+        self.max_closes = max_closes
+
+    @classmethod
+    def for_timespan(cls, num_days, max_ticks=3):
+        """Returns a policy that keeps enough history for moving averages
+        over num_days days on the latest day and the day before it, as
+        crossover signals need, and the last max_ticks updates, three of
+        which are needed for is_increasing_trend"""
+        return cls(max_ticks=max_ticks, max_closes=num_days + 1)
+
+    @classmethod
+    def for_rules(cls, rules, num_days=0, max_ticks=3):
+        """Returns a policy that keeps enough history for every rule in
+        rules, going by their history_needed methods, as well as what
+        for_timespan(num_days, max_ticks) keeps. A policy made with
+        for_timespan alone drops the closes that rules with longer moving
+        averages need, and they then quietly stop matching
+
+        If any rule needs the whole history, such as a PriceRule with an
+        arbitrary condition, the policy keeps all of it"""
+        for rule in rules:
+            need = rule.history_needed()
+            if need is None:
+                return cls()
+            ticks, days = need
+            num_days, max_ticks = max(num_days, days), max(max_ticks, ticks)
+        return cls.for_timespan(num_days, max_ticks)
+
+
+def _slack(limit):
+    return max(16, limit // 8)
+
+
+def _run_lengths(values, end, first=0):
+    """Returns how many strictly rising, and how many strictly falling,
+    steps in a row end at values[end], looking no further back than
+    values[first]"""
+    rising = falling = 0
+    while end - rising > first and \
+            values[end - rising - 1] < values[end - rising]:
+        rising += 1
+    while end - falling > first and \
+            values[end - falling - 1] > values[end - falling]:
+        falling += 1
+    return rising, falling
+
+
 class TimeSeries:
-    def __init__(self):
-        self.series = []
+    """A series of values ordered by timestamp
+
+    The timestamps are stored as microseconds since the epoch in an array,
+    so they should be naive datetimes. Values are stored in an array of
+    integers, until a value that doesn't fit comes in, after which they are
+    kept in a list. Updates that come in order are appended to the end, and
+    only out of order updates pay for an insertion
+
+    Alongside the series, the last update of every day is kept in a
+    separate index, sorted by day, for looking up closing prices. Every
+    change to a close bumps close_revision and logs the day, so that
+    anything computed from the closes can tell what to recompute. Every
+    update of any kind bumps revision
+
+    The series also keeps count of how many times in a row the value has
+    strictly risen, and strictly fallen, up to the latest update, in
+    rising_ticks and falling_ticks, and likewise for the closes of the
+    days with updates, in rising_closes and falling_closes. They are kept
+    up to date as updates come in, and only recounted when an out of order
+    update lands inside a run, so trends of any length can be looked up
+    at once. Recounting only sees the updates that are kept
+
+    A RetentionPolicy can be given to limit how much history is kept"""
+    CLOSE_CHANGE_LOG_SIZE = 256
+
+    def __init__(self, retention=None):
+        self.retention = retention
+        self.dropped_ticks_until = None
+        self.dropped_closes_until = None
+        self.revision = 0
+        self.close_revision = 0
+        self.rising_ticks = self.falling_ticks = 0
+        self.rising_closes = self.falling_closes = 0
+        self.previous_close_runs = (0, 0)
+        self.close_changes = collections.deque(maxlen=self.CLOSE_CHANGE_LOG_SIZE)
+        self.timestamps = array("q")
+        self.values = array("q")
+        self.close_days = array("q")
+        self.close_timestamps = array("q")
+        self.close_values = array("q")
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def last_value(self):
+        """The value of the latest update, or None if there are none. Unlike
+        self[-1].value, no Update is made, so it is quick to read"""
+        return self.values[-1] if self.values else None
+
+    @property
+    def series(self):
+        """The list of Updates, oldest first. It is made on every read, from
+        the columns the updates are kept in, so changing it doesn't change
+        the series, and reading it is slow for a long series"""
+        return self[:]
 
     def __getitem__(self, index):
-        return self.series[index]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Update(from_epoch_micros(self.timestamps[index]),
+                      self.values[index])
+
+    def _insert_value(self, values, index, value):
+        try:
+            values.insert(index, value)
+        except (TypeError, OverflowError):
+            values = list(values)
+            values.insert(index, value)
+        return values
+
+    def _update_close(self, micros, value):
+        day = micros // _MICROS_PER_DAY
+        if self.dropped_closes_until is not None and \
+                day <= self.dropped_closes_until:
+            return
+        index = bisect.bisect_left(self.close_days, day)
+        inserted = index == len(self.close_days) or self.close_days[index] != day
+        if inserted:
+            self.close_days.insert(index, day)
+            self.close_timestamps.insert(index, micros)
+            self.close_values = self._insert_value(self.close_values, index, value)
+        elif (micros, value) >= (self.close_timestamps[index],
+                                 self.close_values[index]):
+            self.close_timestamps[index] = micros
+            try:
+                self.close_values[index] = value
+            except (TypeError, OverflowError):
+                self.close_values = list(self.close_values)
+                self.close_values[index] = value
+        else:
+            return
+        self.close_revision += 1
+        self.close_changes.append(day)
+        self._update_close_runs(index, inserted)
+
+    def _step_tick_runs(self, previous, value):
+        self.rising_ticks = self.rising_ticks + 1 if value > previous else 0
+        self.falling_ticks = self.falling_ticks + 1 if value < previous else 0
+
+    def _update_tick_runs(self, index):
+        values = self.values
+        last = len(values) - 1
+        if index == last and last > 0:
+            self._step_tick_runs(values[-2], values[-1])
+        elif index >= last - 1 - max(self.rising_ticks, self.falling_ticks):
+            self.rising_ticks, self.falling_ticks = _run_lengths(values, last)
+
+    def _update_close_runs(self, index, inserted):
+        closes = self.close_values
+        last = len(closes) - 1
+        if index == last and last > 0:
+            # the close of the latest day changes with every update on that
+            # day, so the runs up to the day before are kept to step from
+            if inserted:
+                self.previous_close_runs = (self.rising_closes,
+                                            self.falling_closes)
+            rising, falling = self.previous_close_runs
+            previous, value = closes[-2], closes[-1]
+            self.rising_closes = rising + 1 if value > previous else 0
+            self.falling_closes = falling + 1 if value < previous else 0
+        elif index >= last - 2 - max(self.rising_closes, self.falling_closes,
+                                     *self.previous_close_runs):
+            self.previous_close_runs = _run_lengths(closes, last - 1) \
+                if last > 0 else (0, 0)
+            self.rising_closes, self.falling_closes = _run_lengths(closes, last)
+
+    def get_daily_closes(self, first_day, last_day):
+        """Returns the closing value of every day from first_day to
+        last_day, both counted from the epoch, carrying over the previous
+        close on days without updates. Days before the first update get
+        None"""
+        closes = []
+        index = bisect.bisect_right(self.close_days, first_day) - 1
+        value = self.close_values[index] if index >= 0 else None
+        index += 1
+        for day in range(first_day, last_day + 1):
+            if index < len(self.close_days) and self.close_days[index] == day:
+                value = self.close_values[index]
+                index += 1
+            closes.append(value)
+        return closes
+
+    def closing_value_on_day(self, day):
+        """Returns the closing value on a day, counted from the epoch,
+        carrying over the previous close if there were no updates that day.
+        Returns None if there were no updates up to that day"""
+        index = bisect.bisect_right(self.close_days, day) - 1
+        return self.close_values[index] if index >= 0 else None
+
+    def earliest_close_change(self, since_revision):
+        """Returns the earliest day whose close changed after since_revision,
+        None if nothing changed, or the first day of the series if the
+        changes are too old to have been kept"""
+        missed = self.close_revision - since_revision
+        if missed == 0:
+            return None
+        if missed > len(self.close_changes):
+            return self.close_days[0]
+        return min(itertools.islice(reversed(self.close_changes), missed))
+
+    def _extend_values(self, values, new_values):
+        if isinstance(values, array):
+            try:
+                new_values = array("q", new_values)
+            except (TypeError, OverflowError):
+                values = list(values)
+        values.extend(new_values)
+        return values
+
+    def _insertion_index(self, micros, value):
+        timestamps = self.timestamps
+        if not timestamps or (micros, value) >= (timestamps[-1], self.values[-1]):
+            return len(timestamps)
+        low = bisect.bisect_left(timestamps, micros)
+        high = bisect.bisect_right(timestamps, micros, low)
+        return bisect.bisect_left(self.values, value, low, high)
+
+    def _is_dropped(self, micros, value):
+        return (self.dropped_ticks_until is not None and
+                (micros, value) <= self.dropped_ticks_until)
+
+    def _drop_ticks(self, count):
+        self.dropped_ticks_until = (self.timestamps[count - 1],
+                                    self.values[count - 1])
+        del self.timestamps[:count]
+        del self.values[:count]
+
+    def _trim(self):
+        retention = self.retention
+        if retention.max_ticks is not None:
+            excess = len(self.timestamps) - retention.max_ticks
+            if excess > _slack(retention.max_ticks):
+                self._drop_ticks(excess)
+        if retention.max_age is not None and self.timestamps:
+            max_age = retention.max_age // _MICROSECOND
+            cutoff = self.timestamps[-1] - max_age
+            if self.timestamps[0] < cutoff - max_age // 8:
+                self._drop_ticks(bisect.bisect_left(self.timestamps, cutoff))
+        if retention.max_closes is not None:
+            excess = len(self.close_days) - retention.max_closes
+            if excess > _slack(retention.max_closes):
+                self.dropped_closes_until = self.close_days[excess - 1]
+                del self.close_days[:excess]
+                del self.close_timestamps[:excess]
+                del self.close_values[:excess]
 
     def update(self, timestamp, value):
-        bisect.insort_left(self.series, Update(timestamp, value))
+        micros = to_epoch_micros(timestamp)
+        if not self._is_dropped(micros, value):
+            index = self._insertion_index(micros, value)
+            self.values = self._insert_value(self.values, index, value)
+            self.timestamps.insert(index, micros)
+            self._update_tick_runs(index)
+        self.revision += 1
+        self._update_close(micros, value)
+        if self.retention is not None:
+            self._trim()
+
+    def update_many(self, updates):
+        """Updates the series with a batch of (timestamp, value) pairs
+
+        The batch is sorted and merged into the series in one pass, from
+        the point where its earliest update goes, rather than inserting
+        the updates one by one"""
+        self._merge(sorted((to_epoch_micros(timestamp), value)
+                           for timestamp, value in updates))
+
+    def update_columns(self, timestamps, values):
+        """Like update_many, but with the timestamps, in microseconds since
+        the epoch, and the values in two sequences, such as arrays
+
+        Columns in timestamp order that come after the latest update are
+        appended as they are, without making a pair for each update"""
+        if not timestamps:
+            return
+        if (self._is_dropped(timestamps[0], values[0]) or
+                self._insertion_index(timestamps[0], values[0]) !=
+                len(self.timestamps) or
+                not all(map(operator.lt, timestamps,
+                            itertools.islice(timestamps, 1, None)))):
+            self._merge(sorted(zip(timestamps, values)))
+            return
+        start = len(self.timestamps)
+        self.timestamps.extend(timestamps)
+        self.values = self._extend_values(self.values, values)
+        self._extend_tick_runs(start)
+        self.revision += len(timestamps)
+        self._update_closes(timestamps, values)
+        if self.retention is not None:
+            self._trim()
+
+    def _merge(self, batch):
+        kept = [update for update in batch if not self._is_dropped(*update)]
+        if kept:
+            start = self._insertion_index(*kept[0])
+            merged = list(heapq.merge(
+                kept, zip(self.timestamps[start:], self.values[start:])))
+            del self.timestamps[start:]
+            del self.values[start:]
+            self.timestamps.extend(micros for micros, _ in merged)
+            self.values = self._extend_values(self.values,
+                                              [value for _, value in merged])
+            if start == len(self.values) - len(kept):
+                self._extend_tick_runs(start)
+            else:
+                self.rising_ticks, self.falling_ticks = _run_lengths(
+                    self.values, len(self.values) - 1)
+        self.revision += len(batch)
+        self._update_closes([micros for micros, _ in batch],
+                            [value for _, value in batch])
+        if self.retention is not None:
+            self._trim()
+
+    def _extend_tick_runs(self, start):
+        """Brings the runs up to date after values were appended from start
+        on. Only the appended values are looked at, unless they carry on
+        the run that ended at the value before them"""
+        last = len(self.values) - 1
+        first = max(start - 1, 0)
+        rising, falling = _run_lengths(self.values, last, first)
+        if rising == last - first:
+            rising += self.rising_ticks
+        if falling == last - first:
+            falling += self.falling_ticks
+        self.rising_ticks, self.falling_ticks = rising, falling
+
+    def _update_closes(self, timestamps, values):
+        """Updates the closes with a batch of updates in timestamp order.
+        Only the last update of each day can be its close"""
+        index = 0
+        while index < len(timestamps):
+            day = timestamps[index] // _MICROS_PER_DAY
+            index = bisect.bisect_left(timestamps, (day + 1) * _MICROS_PER_DAY,
+                                       index)
+            self._update_close(timestamps[index - 1], values[index - 1])
 
     def get_closing_price_list(self, on_date, num_days):
+        """Returns the closing update of each of the num_days days up to
+        on_date, oldest first. A day without updates gets the close of the
+        day before it, and days before the first update are left out"""
         closing_price_list = []
-        for i in range(num_days):
-            chk = on_date.date() - timedelta(i)
-            for price_event in reversed(self.series):
-                if price_event.timestamp.date() > chk:
-                    pass
-                if price_event.timestamp.date() == chk:
-                    closing_price_list.insert(0, price_event)
-                    break
-                if price_event.timestamp.date() < chk:
-                    closing_price_list.insert(0, price_event)
-                    break
+        day = to_epoch_day(on_date)
+        index = bisect.bisect_right(self.close_days, day) - 1
+        for chk in range(day, day - num_days, -1):
+            while index >= 0 and self.close_days[index] > chk:
+                index -= 1
+            if index < 0:
+                break
+            closing_price_list.append(
+                Update(from_epoch_micros(self.close_timestamps[index]),
+                       self.close_values[index]))
+        closing_price_list.reverse()
         return closing_price_list
 
 
+def moving_average_list(closes, timespan):
+    """Returns the moving average over timespan days for each day in a list
+    of daily closes, as returned by TimeSeries.get_daily_closes, with None
+    where there isn't enough data. The values are the same as
+    MovingAverage.value_on gives"""
+    averages = [None] * len(closes)
+    first = next((i for i, close in enumerate(closes) if close is not None),
+                 len(closes))
+    if all(isinstance(close, int) for close in closes[first:]):
+        prefix_sums = list(itertools.accumulate(closes[first:], initial=0))
+        for i in range(first + timespan - 1, len(closes)):
+            window_end = i - first + 1
+            averages[i] = (prefix_sums[window_end] -
+                           prefix_sums[window_end - timespan])/timespan
+    else:
+        for i in range(first + timespan - 1, len(closes)):
+            averages[i] = sum(closes[i - timespan + 1:i + 1])/timespan
+    return averages
+
+
+def moving_average_array(closes, timespan):
+    """Like moving_average_list, but returns a numpy array with NaN where
+    there isn't enough data
+
+    Returns None if numpy isn't available, or if numpy can't reproduce the
+    values exactly, which is the case unless the closes are integers with
+    window sums below 2**53"""
+    if _numpy() is None:
+        return None
+    first = next((i for i, close in enumerate(closes) if close is not None),
+                 len(closes))
+    if not all(isinstance(close, int) for close in closes[first:]):
+        return None
+    try:
+        values = numpy.array(closes[first:], dtype=numpy.int64)
+    except OverflowError:
+        return None
+    prefix_sums = numpy.concatenate(([0], numpy.cumsum(values)))
+    sums = prefix_sums[timespan:] - prefix_sums[:-timespan]
+    if len(sums) and numpy.abs(sums).max() >= 2**53:
+        return None
+    averages = numpy.full(len(closes), numpy.nan)
+    averages[first + timespan - 1:] = sums/timespan
+    return averages
+
+
 class MovingAverage:
+    """The average of the closing prices over the last timespan days
+
+    Values are cached by day. The value for a day is slid from the cached
+    value of the day before in constant time, and only computed from
+    scratch when that isn't available. Updates to the series invalidate
+    the cached values from the day they change onwards
+
+    Sliding a sum of floats gives a slightly different rounding than
+    summing the window, so unless slide_floats is set, values are only
+    slid while all the closing prices are integers"""
+    CACHE_SIZE = 32
+    slide_floats = False
+
     def __init__(self, series, timespan):
         self.series = series
         self.timespan = timespan
+        self._cache = {}
+        self._revision = series.close_revision
+
+    def _invalidate_changed_days(self):
+        earliest = self.series.earliest_close_change(self._revision)
+        if earliest is not None:
+            for day in [day for day in self._cache if day >= earliest]:
+                del self._cache[day]
+            self._revision = self.series.close_revision
+
+    def _closing_prices(self, end_date, num_days):
+        closing_price_list = self.series.get_closing_price_list(end_date, num_days)
+        if len(closing_price_list) < num_days:
+            raise NotEnoughDataException("Not enough data to calculate moving average")
+        return [update.value for update in closing_price_list]
+
+    def _closing_price(self, day):
+        price = self.series.closing_value_on_day(day)
+        if price is None:
+            raise NotEnoughDataException("Not enough data to calculate moving average")
+        return price
+
+    def _initial_state(self, end_date):
+        return sum(self._closing_prices(end_date, self.timespan))
+
+    def _next_state(self, state, day):
+        return (state + self._closing_price(day) -
+                self._closing_price(day - self.timespan))
+
+    def _value(self, state):
+        return state/self.timespan
 
     def value_on(self, end_date):
-        moving_avg_series = self.series.get_closing_price_list(end_date, self.timespan)
-        if len(moving_avg_series) < self.timespan:
+        self._invalidate_changed_days()
+        day = to_epoch_day(end_date)
+        state = self._cache.get(day)
+        if state is None:
+            previous = self._cache.get(day - 1)
+            if previous is None or not (
+                    self.slide_floats or
+                    isinstance(self.series.close_values, array)):
+                state = self._initial_state(end_date)
+            else:
+                try:
+                    state = self._next_state(previous, day)
+                except NotEnoughDataException:
+                    # the close that slides out of the window may have been
+                    # dropped by the retention policy since previous was cached
+                    state = self._initial_state(end_date)
+            if len(self._cache) >= self.CACHE_SIZE:
+                del self._cache[next(iter(self._cache))]
+            self._cache[day] = state
+        return self._value(state)
+
+
+class WeightedMovingAverage(MovingAverage):
+    """Like MovingAverage, but the closing price from i days ago is given
+    a weight of timespan - i, so that recent prices count for more"""
+
+    def _initial_state(self, end_date):
+        prices = self._closing_prices(end_date, self.timespan)
+        return (sum(prices),
+                sum(weight * price for weight, price in enumerate(prices, 1)))
+
+    def _next_state(self, state, day):
+        total, weighted_total = state
+        price = self._closing_price(day)
+        return (total + price - self._closing_price(day - self.timespan),
+                weighted_total + self.timespan * price - total)
+
+    def _value(self, state):
+        return state[1]/(self.timespan * (self.timespan + 1) / 2)
+
+
+class ExponentialMovingAverage(MovingAverage):
+    """An exponential moving average of the closing prices, with a
+    smoothing factor of 2/(timespan + 1). It starts from the average of
+    the first timespan days of the series"""
+    slide_floats = True
+
+    def __init__(self, series, timespan):
+        super().__init__(series, timespan)
+        self.alpha = 2/(timespan + 1)
+
+    def _initial_state(self, end_date):
+        if not self.series.close_days:
+            raise NotEnoughDataException("Not enough data to calculate moving average")
+        first_day = self.series.close_days[0]
+        last_day = to_epoch_day(end_date)
+        if last_day - first_day + 1 < self.timespan:
             raise NotEnoughDataException("Not enough data to calculate moving average")
-        price_list = [update.value for update in moving_avg_series]
-        return sum(price_list)/self.timespan
+        state = sum(self.series.closing_value_on_day(day)
+                    for day in range(first_day, first_day + self.timespan))/self.timespan
+        for day in range(first_day + self.timespan, last_day + 1):
+            state = self._next_state(state, day)
+        return state
+
+    def _next_state(self, state, day):
+        return (self.alpha * self._closing_price(day) +
+                (1 - self.alpha) * state)
+
+    def _value(self, state):
+        return state